@@ -11,7 +11,15 @@ from routes.cart_routes import cart_bp
 from routes.chat_routes import chat_bp
 from routes.home_routes import home_bp
 from routes.order_routes import order_bp
+from routes.admin_routes import admin_bp
 from routes.socket_handlers import init_socket_handlers
+from services.chat_writer import ChatWriter
+from middleware.identity import init_identity
+from services.indexes import ensure_indexes, verify_indexes, explain_hot_queries
+from services.migrations import run_migrations
+from services.password_hasher import password_hasher
+from services.stock_reservations import HoldReaper
+import config
 
 # Load environment variables
 load_dotenv()
@@ -22,7 +30,7 @@ CORS(app, resources={
         "origins": "*",  # Thêm domain của frontend
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
         "allow_headers": '*',
-        "expose_headers": ["Content-Type", "Authorization"],
+        "expose_headers": ["Content-Type", "Authorization", "Idempotent-Replayed"],
         "supports_credentials": False
     }
 })
@@ -33,6 +41,9 @@ socketio = SocketIO(app,
     ping_timeout=60,  # Thời gian timeout cho ping, mặc định 5s
     ping_interval=25  # Khoảng thời gian giữa các ping, mặc định 25s
 )
+# Tạo process pool bcrypt trước khi MongoClient/ChatWriter mở thread nền
+password_hasher.start()
+
 # MongoDB connection
 mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/ecommerce")
 client = MongoClient(mongo_uri)
@@ -41,6 +52,27 @@ db = client.get_database()
 # Make db available to all routes
 app.config['db'] = db
 app.config['mongo_client'] = client
+app.config['chat_writer'] = ChatWriter(db)
+app.config['hold_reaper'] = HoldReaper(db)
+
+if config.ENSURE_INDEXES_ON_STARTUP:
+    try:
+        ensure_indexes(db)
+        for collection_name, index_name in verify_indexes(db):
+            app.logger.warning(f"Missing MongoDB index {collection_name}.{index_name}")
+        if config.EXPLAIN_HOT_QUERIES_ON_STARTUP:
+            explain_hot_queries(db)
+    except Exception as e:
+        app.logger.error(f"Index bootstrap failed: {e}")
+
+if config.RUN_MIGRATIONS_ON_STARTUP:
+    try:
+        run_migrations(db)
+    except Exception as e:
+        app.logger.error(f"Data migrations failed: {e}")
+
+# Giải mã token một lần mỗi request; route đọc danh tính qua middleware.identity
+init_identity(app)
 
 # Register blueprints
 app.register_blueprint(product_bp, url_prefix='/api/products')
@@ -50,6 +82,7 @@ app.register_blueprint(cart_bp, url_prefix='/api/cart')
 app.register_blueprint(chat_bp, url_prefix='/api/chat')
 app.register_blueprint(home_bp, url_prefix='/api/home')
 app.register_blueprint(order_bp, url_prefix='/api/orders')
+app.register_blueprint(admin_bp, url_prefix='/api/admin')
 
 # Initialize socket handlers
 init_socket_handlers(socketio)
@@ -21,3 +21,82 @@ EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
 
 # Session configuration
 ANONYMOUS_SESSION_EXPIRY = 14  # days
+ANONYMOUS_CART_EXPIRY = int(os.getenv("ANONYMOUS_CART_EXPIRY", 14))  # days since last cart change
+
+# Chat archival (services/lifecycle.py)
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", 90))
+CHAT_ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "../data/chat_archive"))
+
+# Socket.IO chat configuration
+SOCKET_MAX_CONCURRENT_GENERATIONS = int(os.getenv("SOCKET_MAX_CONCURRENT_GENERATIONS", 1))  # per client
+SOCKET_MAX_PENDING_MESSAGES = int(os.getenv("SOCKET_MAX_PENDING_MESSAGES", 5))  # per client
+
+# Chat persistence (write-behind) configuration
+CHAT_WRITE_FLUSH_INTERVAL_MS = int(os.getenv("CHAT_WRITE_FLUSH_INTERVAL_MS", 50))
+CHAT_WRITE_MAX_BATCH = int(os.getenv("CHAT_WRITE_MAX_BATCH", 100))
+CHAT_WRITER_LEASE_SECONDS = int(os.getenv("CHAT_WRITER_LEASE_SECONDS", 30))  # chỉ một process được ghi lịch sử chat
+
+# Chat history storage
+CHAT_BUCKET_SIZE = int(os.getenv("CHAT_BUCKET_SIZE", 50))  # messages per bucket document
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", 30))
+CHAT_PAGE_SIZE_MAX = 100
+
+# Catalog caches
+CATEGORY_CACHE_TTL = int(os.getenv("CATEGORY_CACHE_TTL", 300))  # seconds
+CATALOG_VERSION_REFRESH_SECONDS = int(os.getenv("CATALOG_VERSION_REFRESH_SECONDS", 5))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 50))
+SEARCH_PREFIX_EXPANSIONS = int(os.getenv("SEARCH_PREFIX_EXPANSIONS", 20))  # số từ tối đa khớp theo tiền tố
+SUGGEST_MAX_RESULTS = int(os.getenv("SUGGEST_MAX_RESULTS", 10))
+SUGGEST_MEMO_SIZE = 5000  # số tiền tố được nhớ kết quả giữa hai lần dựng lại
+SUGGEST_REFRESH_SECONDS = int(os.getenv("SUGGEST_REFRESH_SECONDS", 300))  # đọc lại sales_count do process khác ghi
+HOME_SNAPSHOT_PERSIST = os.getenv("HOME_SNAPSHOT_PERSIST", "false").lower() == "true"
+
+# List pagination (services/pagination.py)
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", 20))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", 100))
+PAGINATION_COUNT_TTL = int(os.getenv("PAGINATION_COUNT_TTL", 60))  # seconds a cached total stays valid
+FACET_CACHE_SIZE = int(os.getenv("FACET_CACHE_SIZE", 500))  # filter combinations kept per catalog version
+FACET_MAX_BRANDS = int(os.getenv("FACET_MAX_BRANDS", 50))
+CART_PRODUCT_CACHE_TTL = int(os.getenv("CART_PRODUCT_CACHE_TTL", 5))  # seconds; checkout always reads fresh
+
+# Stock holds for cart items (services/stock_reservations.py)
+STOCK_HOLD_MINUTES = int(os.getenv("STOCK_HOLD_MINUTES", 15))  # tính từ lần cuối sản phẩm trong giỏ thay đổi
+STOCK_HOLD_REAP_INTERVAL_SECONDS = int(os.getenv("STOCK_HOLD_REAP_INTERVAL_SECONDS", 30))
+STOCK_HOLD_REAP_BATCH = int(os.getenv("STOCK_HOLD_REAP_BATCH", 500))
+STOCK_RECONCILE_INTERVAL_SECONDS = int(os.getenv("STOCK_RECONCILE_INTERVAL_SECONDS", 300))  # đối chiếu reserved_count với stock_holds
+
+# Request identity (middleware/identity.py)
+IDENTITY_TOKEN_CACHE_SIZE = int(os.getenv("IDENTITY_TOKEN_CACHE_SIZE", 10000))  # verified tokens kept until exp
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 60))  # seconds
+
+# Idempotency-Key handling (middleware/idempotency.py)
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", 24))  # how long a stored response is replayed
+IDEMPOTENCY_WAIT_SECONDS = int(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 10))  # duplicate waits this long for the first
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 60))  # sau thời gian này request trùng được chạy lại
+
+# Password hashing (services/password_hasher.py) and login throttling (services/rate_limit.py)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))  # hash cũ khác cost sẽ được băm lại khi đăng nhập
+BCRYPT_POOL_SIZE = int(os.getenv("BCRYPT_POOL_SIZE", max(1, (os.cpu_count() or 2) // 2)))  # worker processes
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", 32))  # queued checks before answering 503
+BCRYPT_TIMEOUT_SECONDS = int(os.getenv("BCRYPT_TIMEOUT_SECONDS", 10))
+LOGIN_RATE_EMAIL_CAPACITY = int(os.getenv("LOGIN_RATE_EMAIL_CAPACITY", 5))  # attempts per account
+LOGIN_RATE_EMAIL_REFILL_SECONDS = int(os.getenv("LOGIN_RATE_EMAIL_REFILL_SECONDS", 60))  # one attempt back every N s
+LOGIN_RATE_IP_CAPACITY = int(os.getenv("LOGIN_RATE_IP_CAPACITY", 20))  # attempts per client IP
+LOGIN_RATE_IP_REFILL_SECONDS = int(os.getenv("LOGIN_RATE_IP_REFILL_SECONDS", 6))
+
+# Admin sales reports (services/sales_rollups.py)
+LOW_STOCK_THRESHOLD = int(os.getenv("LOW_STOCK_THRESHOLD", 5))  # cảnh báo khi tồn kho <= ngưỡng này
+SALES_REPORT_MAX_DAYS = int(os.getenv("SALES_REPORT_MAX_DAYS", 366))
+
+# Product recommendations (services/recommendations.py)
+RECOMMENDATION_NEIGHBORS = int(os.getenv("RECOMMENDATION_NEIGHBORS", 10))  # similar products stored per product at index build
+RECOMMENDATION_LIMIT = int(os.getenv("RECOMMENDATION_LIMIT", 6))  # per list in the API response
+RECOMMENDATION_BOUGHT_TOGETHER = int(os.getenv("RECOMMENDATION_BOUGHT_TOGETHER", 20))  # top co-purchases listed per product
+RECOMMENDATION_CHAT_LIMIT = int(os.getenv("RECOMMENDATION_CHAT_LIMIT", 3))  # per list in the chatbot context
+RECOMMENDATION_QUEUE_SIZE = int(os.getenv("RECOMMENDATION_QUEUE_SIZE", 1000))  # orders waiting for co-purchase counting
+RECOMMENDATION_MAX_ORDER_ITEMS = 50  # đơn lớn hơn chỉ tính cặp trong 50 sản phẩm đầu
+
+# Index management (services/indexes.py)
+ENSURE_INDEXES_ON_STARTUP = os.getenv("ENSURE_INDEXES_ON_STARTUP", "true").lower() == "true"
+EXPLAIN_HOT_QUERIES_ON_STARTUP = os.getenv("EXPLAIN_HOT_QUERIES_ON_STARTUP", "false").lower() == "true"
+RUN_MIGRATIONS_ON_STARTUP = os.getenv("RUN_MIGRATIONS_ON_STARTUP", "true").lower() == "true"
@@ -1,9 +1,11 @@
 import os
+import numpy as np
 from pymongo import MongoClient
 from langchain_ollama import OllamaEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.docstore.document import Document
 import config
+from services.recommendations import save_similar_products
 
 def get_data_from_mongodb():
     """Lấy dữ liệu từ MongoDB và định dạng lại theo cấu trúc mong muốn"""
@@ -40,6 +42,7 @@ def get_data_from_mongodb():
         if category_id and category_id in category_dict:
             product_data = {
                 "id": product.get("original_product_id", str(product["_id"])),
+                "product_id": str(product["_id"]),
                 "title": product["title"],
                 "description": product["description"],
                 "price": product["price"],
@@ -85,6 +88,7 @@ def create_vector_database(data, output_path):
             
             product_metadata = {
                 "id": product['id'],
+                "product_id": product['product_id'],
                 "type": "product",
                 "title": product['title'],
                 "category_id": category['category_id'],
@@ -119,6 +123,33 @@ def create_vector_database(data, output_path):
     
     return db
 
+def compute_similar_products(vector_db, k):
+    """K sản phẩm gần nhất của mỗi sản phẩm trong index vừa dựng: {product_id: [(product_id, score), ...]}"""
+    rows = []
+    for row, docstore_id in vector_db.index_to_docstore_id.items():
+        document = vector_db.docstore.search(docstore_id)
+        if document.metadata.get("type") == "product" and document.metadata.get("product_id"):
+            rows.append((row, document.metadata["product_id"]))
+    if not rows:
+        return {}
+
+    product_by_row = dict(rows)
+    vectors = np.vstack([vector_db.index.reconstruct(int(row)) for row, _ in rows])
+    # Lấy dư vì kết quả gồm cả chính sản phẩm đó và các document danh mục
+    distances, neighbour_rows = vector_db.index.search(vectors, min(vector_db.index.ntotal, 2 * k + 1))
+
+    neighbours = {}
+    for (row, product_id), row_distances, row_neighbours in zip(rows, distances, neighbour_rows):
+        similar = []
+        for distance, neighbour_row in zip(row_distances, row_neighbours):
+            neighbour_id = product_by_row.get(int(neighbour_row))
+            if neighbour_id and neighbour_id != product_id:
+                similar.append((neighbour_id, 1.0 / (1.0 + float(distance))))
+            if len(similar) >= k:
+                break
+        neighbours[product_id] = similar
+    return neighbours
+
 if __name__ == "__main__":
     # Lấy dữ liệu từ MongoDB
     data = get_data_from_mongodb()
@@ -127,4 +158,9 @@ if __name__ == "__main__":
     # Tạo vector database
     output_path = config.VECTOR_DB_PATH
     db = create_vector_database(data, output_path)
-    print(f"Đã tạo vector database tại: {output_path}") 
\ No newline at end of file
+    print(f"Đã tạo vector database tại: {output_path}") 
+
+    # Bảng sản phẩm tương tự cho /api/products/<id>/recommendations và chatbot
+    neighbours = compute_similar_products(db, config.RECOMMENDATION_NEIGHBORS)
+    saved = save_similar_products(MongoClient(config.MONGO_URI).get_database(), neighbours)
+    print(f"Đã lưu sản phẩm tương tự cho {saved} sản phẩm")
\ No newline at end of file
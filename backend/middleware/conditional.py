@@ -0,0 +1,46 @@
+from functools import wraps
+from flask import request, current_app, make_response, Response
+from services.catalog_version import catalog_version, stock_version
+
+
+def catalog_etag(name, *versions):
+    return "-".join([name, *(str(version) for version in versions)])
+
+
+def conditional_get(name, max_age=0, stock=False):
+    """
+    Conditional GET for catalog endpoints.
+
+    The ETag is derived from the catalog version, which every product/category write
+    bumps, so a matching If-None-Match is answered with 304 before the view runs —
+    `catalog_version.current()` is served from memory and does not touch Mongo.
+    Endpoints whose body carries stock fields pass stock=True to add the stock
+    version, which orders bump without invalidating the catalog caches.
+    max_age sets how long clients may reuse the body without revalidating.
+    """
+    cache_control = f"public, max-age={max_age}" if max_age else "no-cache"
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            db = current_app.config['db']
+            versions = [catalog_version.current(db)]
+            if stock:
+                versions.append(stock_version.current(db))
+            etag = catalog_etag(name, *versions)
+
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = cache_control
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                # View có thể tự đặt ETag chính xác hơn (ví dụ phiên bản của snapshot đã dựng)
+                if 'ETag' not in response.headers:
+                    response.set_etag(etag)
+                response.headers['Cache-Control'] = cache_control
+            return response
+        return decorated
+    return decorator
@@ -0,0 +1,147 @@
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, current_app, make_response, jsonify, Response
+from pymongo.errors import DuplicateKeyError
+import config
+from middleware.identity import current_user_id
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+PENDING = "pending"
+DONE = "done"
+
+# Request đang chạy trong process này; request trùng chờ trên Event thay vì hỏi Mongo liên tục
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _record_id(scope, key):
+    owner = current_user_id() or request.headers.get('X-Session-ID') or request.remote_addr
+    return f"{scope}:{owner}:{key}"
+
+
+def _replay(record):
+    response = Response(record["body"], status=record["status"], content_type=record["content_type"])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _in_progress():
+    response = jsonify({"error": "A request with this Idempotency-Key is still being processed"})
+    response.headers['Retry-After'] = "1"
+    return response, 409
+
+
+def idempotent(scope):
+    """
+    Honour an Idempotency-Key header on a POST endpoint.
+
+    The first request with a key claims an `idempotency_keys` document and runs the
+    view; its response (if not a 5xx) is stored there for IDEMPOTENCY_TTL_HOURS and
+    replayed to every retry with the same key, so a retried order or chat message is
+    not executed twice. A duplicate that arrives while the first is still running
+    waits up to IDEMPOTENCY_WAIT_SECONDS for its result, then gets 409. Reusing a key
+    with a different body is rejected with 422. Requests without the header run as before.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return f(*args, **kwargs)
+            if len(key) > 255:
+                return jsonify({"error": f"{IDEMPOTENCY_HEADER} is too long"}), 400
+
+            keys = current_app.config['db'].idempotency_keys
+            record_id = _record_id(scope, key)
+            fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+            record = _claim(keys, record_id, fingerprint)
+            if record is not None:
+                if record["fingerprint"] != fingerprint:
+                    return jsonify({"error": f"{IDEMPOTENCY_HEADER} was already used for a different request"}), 422
+                if record["state"] == DONE:
+                    return _replay(record)
+                record = _wait(keys, record_id)
+                if record is None or record["state"] != DONE:
+                    return _in_progress()
+                return _replay(record)
+
+            done = threading.Event()
+            with _inflight_lock:
+                _inflight[record_id] = done
+            try:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code >= 500 or response.is_streamed:
+                    # Lỗi phía server không được lưu lại để client có thể thử lại với cùng key
+                    keys.delete_one({"_id": record_id, "state": PENDING})
+                else:
+                    keys.update_one(
+                        {"_id": record_id},
+                        {"$set": {
+                            "state": DONE,
+                            "status": response.status_code,
+                            "body": response.get_data(),
+                            "content_type": response.content_type,
+                        }}
+                    )
+                return response
+            except Exception:
+                keys.delete_one({"_id": record_id, "state": PENDING})
+                raise
+            finally:
+                with _inflight_lock:
+                    _inflight.pop(record_id, None)
+                done.set()
+        return decorated
+    return decorator
+
+
+def _claim(keys, record_id, fingerprint):
+    """Claim record_id for this request. Returns None when claimed, else the existing record."""
+    now = datetime.utcnow()
+    pending = {
+        "state": PENDING,
+        "fingerprint": fingerprint,
+        "created_at": now,
+        "locked_until": now + timedelta(seconds=config.IDEMPOTENCY_LOCK_SECONDS),
+        "expires_at": now + timedelta(hours=config.IDEMPOTENCY_TTL_HOURS),
+    }
+    try:
+        keys.insert_one({"_id": record_id, **pending})
+        return None
+    except DuplicateKeyError:
+        pass
+
+    # Request đầu tiên có thể đã chết giữa chừng (process bị kill); quá locked_until thì request này tiếp quản
+    taken_over = keys.find_one_and_update(
+        {"_id": record_id, "state": PENDING, "fingerprint": fingerprint, "locked_until": {"$lt": now}},
+        {"$set": pending}
+    )
+    if taken_over:
+        return None
+    return keys.find_one({"_id": record_id}) or {"state": PENDING, "fingerprint": fingerprint}
+
+
+def _wait(keys, record_id):
+    """Wait for the in-flight request with record_id to finish. Returns its record, or None if it was dropped."""
+    deadline = time.monotonic() + config.IDEMPOTENCY_WAIT_SECONDS
+    delay = 0.05
+    while True:
+        with _inflight_lock:
+            local = _inflight.get(record_id)
+        remaining = deadline - time.monotonic()
+        if local is not None:
+            local.wait(max(0, remaining))
+        else:
+            # Request đầu tiên chạy ở process khác: hỏi lại Mongo với độ trễ tăng dần
+            time.sleep(max(0, min(delay, remaining)))
+            delay = min(delay * 2, 1)
+
+        record = keys.find_one({"_id": record_id})
+        if record is None or record["state"] == DONE or time.monotonic() >= deadline:
+            return record
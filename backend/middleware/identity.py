@@ -0,0 +1,137 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from bson import ObjectId
+from flask import g, request
+import jwt as PyJWT
+import config
+
+# Giá trị của g.identity_error
+MISSING = "missing"
+MALFORMED = "malformed"
+EXPIRED = "expired"
+INVALID = "invalid"
+
+
+class VerifiedTokenCache:
+    """
+    LRU of decoded JWT payloads keyed by the SHA-256 of the token.
+
+    A token is verified (signature and exp) once; later requests with the same token
+    reuse the payload until its exp passes, so the HMAC check and JSON parsing leave
+    the request path.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or config.IDENTITY_TOKEN_CACHE_SIZE
+        self._lock = threading.Lock()
+        self._payloads = OrderedDict()
+
+    def decode(self, token):
+        """Return the verified payload; raises PyJWT errors like PyJWT.decode."""
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        now = time.time()
+        with self._lock:
+            cached = self._payloads.get(key)
+            if cached is not None:
+                payload, expires_at = cached
+                if expires_at is None or expires_at > now:
+                    self._payloads.move_to_end(key)
+                    return payload
+                del self._payloads[key]
+        if cached is not None:
+            raise PyJWT.ExpiredSignatureError("Signature has expired")
+
+        payload = PyJWT.decode(token, config.JWT_SECRET_KEY, algorithms=['HS256'])
+        with self._lock:
+            self._payloads[key] = (payload, payload.get("exp"))
+            if len(self._payloads) > self.max_entries:
+                self._payloads.popitem(last=False)
+        return payload
+
+
+class UserCache:
+    """User documents by id, kept USER_CACHE_TTL seconds."""
+
+    def __init__(self, ttl_seconds=None, max_entries=10000):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.USER_CACHE_TTL
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+
+    def get(self, db, user_id):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is not None and cached[1] > now:
+                self._users.move_to_end(user_id)
+                return cached[0]
+
+        if not ObjectId.is_valid(user_id):
+            return None
+        user_data = db.users.find_one({"_id": ObjectId(user_id)})
+        if user_data is None:
+            return None
+        with self._lock:
+            self._users[user_id] = (user_data, now + self.ttl_seconds)
+            if len(self._users) > self.max_entries:
+                self._users.popitem(last=False)
+        return user_data
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+token_cache = VerifiedTokenCache()
+user_cache = UserCache()
+
+
+def current_identity():
+    """
+    The request's verified identity as {"user_id", "role", "payload"}, or None.
+
+    Resolved once per request (init_identity registers it as a before_request hook,
+    and it also resolves lazily outside one); g.identity_error tells why it is None.
+    """
+    if "identity" in g:
+        return g.identity
+
+    g.identity, g.identity_error = None, None
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        g.identity_error = MISSING
+        return None
+
+    parts = auth_header.split(' ')
+    if len(parts) < 2 or not parts[1]:
+        g.identity_error = MALFORMED
+        return None
+
+    try:
+        payload = token_cache.decode(parts[1])
+    except PyJWT.ExpiredSignatureError:
+        g.identity_error = EXPIRED
+        return None
+    except PyJWT.InvalidTokenError:
+        g.identity_error = INVALID
+        return None
+
+    if not payload.get('sub'):
+        g.identity_error = INVALID
+        return None
+
+    g.identity = {"user_id": payload['sub'], "role": payload.get('role'), "payload": payload}
+    return g.identity
+
+
+def current_user_id():
+    identity = current_identity()
+    return identity["user_id"] if identity else None
+
+
+def init_identity(app):
+    @app.before_request
+    def load_identity():
+        current_identity()
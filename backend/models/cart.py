@@ -1,5 +1,6 @@
 from bson import ObjectId
 from datetime import datetime
+from models.product import parse_price_vnd
 
 class CartItem:
     def __init__(self, product_id, quantity=1, price=None, title=None, image_path=None):
@@ -24,7 +25,7 @@ class CartItem:
 
 class Cart:
     def __init__(self, id=None, user_id=None, session_id=None, items=None, 
-                created_at=None, updated_at=None, is_anonymous=False):
+                created_at=None, updated_at=None, is_anonymous=False, expiry_date=None):
         self.id = str(id) if id else None
         self.user_id = str(user_id) if user_id else None
         self.session_id = session_id
@@ -32,6 +33,7 @@ class Cart:
         self.created_at = created_at or datetime.utcnow()
         self.updated_at = updated_at or datetime.utcnow()
         self.is_anonymous = is_anonymous
+        self.expiry_date = expiry_date
     
     @classmethod
     def from_dict(cls, data):
@@ -39,6 +41,8 @@ class Cart:
             data["id"] = data.pop("_id")
         if "items" in data:
             data["items"] = [CartItem.from_dict(item) for item in data["items"]]
+        # Chỉ dùng để merge_anonymous không gộp một giỏ ẩn danh hai lần
+        data.pop("merged_cart_id", None)
         return cls(**data)
     
     def to_dict(self):
@@ -50,6 +54,8 @@ class Cart:
             "updated_at": self.updated_at,
             "is_anonymous": self.is_anonymous
         }
+        if self.expiry_date:
+            result["expiry_date"] = self.expiry_date
         if self.id:
             result["_id"] = ObjectId(self.id)
         return result
@@ -57,13 +63,11 @@ class Cart:
     def to_json(self):
         total_amount = 0
         for item in self.items:
-            try:
-                price_str = str(item.price).replace('.', '')
-                price_val = float(price_str)
-                total_amount += price_val * item.quantity
-            except (ValueError, TypeError) as e:
-                print(f"Warning: Could not parse price for item {item.product_id}: '{item.price}'. Error: {e}")
-                pass
+            price_vnd = parse_price_vnd(item.price)
+            if price_vnd is None:
+                print(f"Warning: Could not parse price for item {item.product_id}: '{item.price}'.")
+                continue
+            total_amount += price_vnd * item.quantity
 
         result = {
             "id": self.id,
@@ -4,33 +4,42 @@ import uuid
 import config
 
 class ChatMessage:
-    def __init__(self, role, content, timestamp=None):
+    def __init__(self, role, content, timestamp=None, truncated=False, seq=None):
         self.role = role
         self.content = content
         self.timestamp = timestamp or datetime.utcnow()
+        self.truncated = truncated
+        self.seq = seq
     
     @classmethod
     def from_dict(cls, data):
         return cls(**data)
     
     def to_dict(self):
-        return {
+        result = {
             "role": self.role,
             "content": self.content,
             "timestamp": self.timestamp
         }
+        if self.truncated:
+            result["truncated"] = True
+        if self.seq is not None:
+            result["seq"] = self.seq
+        return result
     
     def to_json(self):
         return {
+            "seq": self.seq,
             "role": self.role,
             "content": self.content,
-            "timestamp": self.timestamp.isoformat()
+            "timestamp": self.timestamp.isoformat(),
+            "truncated": self.truncated
         }
 
 class ChatSession:
     def __init__(self, id=None, user_id=None, session_id=None, messages=None, 
                     created_at=None, updated_at=None, is_anonymous=False, 
-                    expiry_date=None, cart_id=None):
+                    expiry_date=None, cart_id=None, message_count=0):
         self.id = str(id) if id else None
         self.user_id = str(user_id) if user_id else None
         self.session_id = session_id or str(uuid.uuid4())
@@ -45,6 +54,8 @@ class ChatSession:
         else:
             self.expiry_date = expiry_date
         self.cart_id = str(cart_id) if cart_id else None
+        # Lịch sử đầy đủ nằm trong chat_message_buckets; messages chỉ chứa trang đang được tải
+        self.message_count = message_count
     
     @classmethod
     def from_dict(cls, data):
@@ -58,7 +69,7 @@ class ChatSession:
         result = {
             "user_id": self.user_id,
             "session_id": self.session_id,
-            "messages": [msg.to_dict() for msg in self.messages],
+            "message_count": self.message_count,
             "created_at": self.created_at,
             "updated_at": self.updated_at,
             "is_anonymous": self.is_anonymous,
@@ -76,6 +87,7 @@ class ChatSession:
             "user_id": self.user_id,
             "session_id": self.session_id,
             "messages": [msg.to_json() for msg in self.messages],
+            "message_count": self.message_count,
             "created_at": self.created_at.isoformat(),
             "updated_at": self.updated_at.isoformat(),
             "is_anonymous": self.is_anonymous,
@@ -85,8 +97,8 @@ class ChatSession:
             result["expiry_date"] = self.expiry_date.isoformat()
         return result
     
-    def add_message(self, role, content):
-        message = ChatMessage(role, content)
+    def add_message(self, role, content, truncated=False):
+        message = ChatMessage(role, content, truncated=truncated)
         self.messages.append(message)
         self.updated_at = datetime.utcnow()
         return message
@@ -43,12 +43,26 @@ class Order:
         self.created_at = created_at or datetime.utcnow()
         self.updated_at = updated_at or datetime.utcnow()
 
+    # Lưu kèm đơn hàng để lịch sử đơn ở chế độ summary không phải đọc mảng items
+    SUMMARY_PROJECTION = {"status": 1, "total_amount": 1, "item_count": 1, "first_item_image": 1, "created_at": 1}
+
+    @property
+    def item_count(self):
+        return sum(item.quantity for item in self.items)
+
+    @property
+    def first_item_image(self):
+        return self.items[0].image_path if self.items else None
+
     @classmethod
     def from_dict(cls, data):
         if "_id" in data:
             data["id"] = data.pop("_id")
         if "items" in data:
             data["items"] = [OrderItem.from_dict(item) for item in data["items"]]
+        # Trường tóm tắt luôn được suy ra lại từ items
+        data.pop("item_count", None)
+        data.pop("first_item_image", None)
         return cls(**data)
 
     def to_dict(self):
@@ -59,6 +73,8 @@ class Order:
             "status": self.status,
             "shipping_address": self.shipping_address,
             "payment_method": self.payment_method,
+            "item_count": self.item_count,
+            "first_item_image": self.first_item_image,
             "created_at": self.created_at,
             "updated_at": self.updated_at,
         }
@@ -77,4 +93,17 @@ class Order:
             "payment_method": self.payment_method,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
-        } 
\ No newline at end of file
+        } 
+
+    @staticmethod
+    def summary_json(data):
+        """Order history row from a document read with SUMMARY_PROJECTION."""
+        created_at = data.get("created_at")
+        return {
+            "id": str(data["_id"]),
+            "status": data.get("status"),
+            "total_amount": str(data["total_amount"]) if data.get("total_amount") is not None else "0",
+            "item_count": data.get("item_count", 0),
+            "first_item_image": data.get("first_item_image"),
+            "created_at": created_at.isoformat() if created_at else None,
+        }
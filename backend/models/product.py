@@ -1,10 +1,32 @@
 from bson import ObjectId
 from datetime import datetime
 
+def parse_price_vnd(price):
+    """Parse a stored price ("1.234.000", "1234000" or a number) into integer VND, or None."""
+    if price is None or isinstance(price, bool):
+        return None
+    if isinstance(price, (int, float)):
+        return int(round(price))
+    # Dấu chấm là phân cách hàng nghìn, dấu phẩy (nếu có) là phần thập phân
+    digits = str(price).strip().replace('₫', '').replace('đ', '').replace(' ', '').replace('.', '').replace(',', '.')
+    try:
+        return int(round(float(digits)))
+    except ValueError:
+        return None
+
+BRAND_FEATURE_PREFIX = "Thương hiệu:"
+
+def parse_brand(features):
+    """Brand name from a "Thương hiệu: ..." entry in features, or None."""
+    for feature in features or []:
+        if isinstance(feature, str) and feature.startswith(BRAND_FEATURE_PREFIX):
+            return feature[len(BRAND_FEATURE_PREFIX):].strip() or None
+    return None
+
 class Product:
     def __init__(self, id=None, title="", description="", price="", features=None, 
                  image_path="", category_id=None, stock_count=0, original_product_id=None, 
-                 created_at=None, updated_at=None):
+                 created_at=None, updated_at=None, price_vnd=None, brand=None, sales_count=0, reserved_count=0):
         self.id = str(id) if id else None
         self.title = title
         self.description = description
@@ -16,7 +38,23 @@ class Product:
         self.original_product_id = original_product_id
         self.created_at = created_at or datetime.utcnow()
         self.updated_at = updated_at or datetime.utcnow()
+        self.sales_count = sales_count
+        # Do services/stock_reservations cập nhật bằng $inc; không ghi lại trong to_dict
+        self.reserved_count = reserved_count
     
+    @property
+    def price_vnd(self):
+        # Luôn suy ra từ price nên giá trị lưu trong Mongo không bao giờ lệch với chuỗi hiển thị
+        return parse_price_vnd(self.price)
+
+    @property
+    def available_count(self):
+        return max(0, (self.stock_count or 0) - (self.reserved_count or 0))
+
+    @property
+    def brand(self):
+        return parse_brand(self.features)
+
     @classmethod
     def from_dict(cls, data):
         if "_id" in data:
@@ -28,7 +66,9 @@ class Product:
             "title": self.title,
             "description": self.description,
             "price": self.price,
+            "price_vnd": self.price_vnd,
             "features": self.features,
+            "brand": self.brand,
             "image_path": self.image_path,
             "category_id": self.category_id,
             "stock_count": self.stock_count,
@@ -47,21 +87,24 @@ class Product:
             "title": self.title,
             "description": self.description,
             "price": self.price,
+            "price_vnd": self.price_vnd,
             "features": self.features,
+            "brand": self.brand,
             "image_path": self.image_path,
             "category_id": self.category_id,
             "stock_count": self.stock_count,
+            "available_count": self.available_count,
             "created_at": self.created_at.isoformat(),
             "updated_at": self.updated_at.isoformat(),
-            "is_in_stock": self.stock_count > 0
+            "is_in_stock": self.available_count > 0
         }
         if self.original_product_id:
             result["original_product_id"] = self.original_product_id
         return result
 
     def get_price_float(self):
-        try:
-            return float(str(self.price).replace('.', '').replace(',', '.'))
-        except ValueError:
+        price_vnd = self.price_vnd
+        if price_vnd is None:
             print(f"Warning: Could not parse price string '{self.price}' to float.")
             return 0.0
+        return float(price_vnd)
@@ -3,6 +3,13 @@ import re
 from .vector_store import vector_store_manager
 
 class ActionHandler:
+    """
+    Chat actions (add to cart, recommendations) detected from a message.
+
+    Not instantiated anywhere yet: ChatManager only answers questions, and gets its
+    recommendations straight from services/recommendations.py. The REST endpoints are
+    the only callers of the cart and recommendation services today.
+    """
     
     def detect_action_intents(self, message):
         intents = []
@@ -44,7 +51,7 @@ class ActionHandler:
         id_match = re.search(r'product[_\s]?id[:\s]+([a-zA-Z0-9]+)', message.lower())
         if id_match:
             product_id = id_match.group(1)
-            product = db.products.find_one({"_id": ObjectId(product_id)})
+            product = db.product.find_one({"_id": ObjectId(product_id)})
             if product:
                 return product_id
         
@@ -92,40 +99,51 @@ class ActionHandler:
     
     def add_to_cart(self, db, product_id, quantity, user_id=None, session_id=None):
         try:
-            product = db.products.find_one({"_id": ObjectId(product_id)})
+            product = db.product.find_one({"_id": ObjectId(product_id)})
             if not product:
                 return False, "Product not found"
             
-            if product.get('stock_count', 0) < quantity:
-                return False, f"Not enough stock. Only {product.get('stock_count', 0)} available."
-            
-            cart_data = None
-            if user_id:
-                cart_data = db.carts.find_one({"user_id": user_id})
-            elif session_id:
-                cart_data = db.carts.find_one({"session_id": session_id})
-            
-            if not cart_data:
+            if not user_id and not session_id:
                 return False, "Cart not found. Please refresh your session."
             
-            from models.cart import Cart
-            cart = Cart.from_dict(cart_data)
-            cart.add_item(
+            # Giữ hàng giống POST /api/cart/items (routes/cart_routes.py), nơi duy nhất đang giữ hàng
+            # thật; ActionHandler chưa được gọi ở đâu nên đoạn này chỉ giữ cho hai đường đồng bộ
+            from services.cart_repository import CartRepository
+            from services.stock_reservations import StockReservations, holder_key
+            reservations = StockReservations(db)
+            holder = holder_key(user_id, session_id)
+            if not reservations.reserve(holder, product_id, quantity):
+                return False, f"Not enough stock. Only {reservations.available(product_id) or 0} available."
+            
+            cart = CartRepository(db).add_item(
                 product_id, 
                 quantity, 
                 product.get('price'), 
-                product.get('title')
+                product.get('title'),
+                product.get('image_path'),
+                user_id=user_id,
+                session_id=session_id
             )
-            
-            db.carts.update_one({"_id": ObjectId(cart.id)}, {"$set": cart.to_dict()})
+            if not cart:
+                reservations.release(holder, product_id, quantity)
+                return False, "Cart was modified concurrently, please try again."
             
             return True, f"Added {quantity} of {product.get('title')} to your cart."
         
         except Exception as e:
             return False, str(e)
     
-    def recommend_products(self, db, category_id=None, query=None, limit=3):
+    def recommend_products(self, db, category_id=None, query=None, limit=3, product_id=None):
         try:
+            if product_id:
+                # Bảng gợi ý tính sẵn: một lần đọc theo _id, không cần tìm vector
+                from services.recommendations import recommended_products
+                recommendations = recommended_products(db, product_id, limit)
+                products = recommendations["bought_together"] + recommendations["similar"]
+                unique = list({product["id"]: product for product in products}.values())
+                if unique:
+                    return unique[:limit]
+            
             if query:
                 results = vector_store_manager.similarity_search(query, k=limit)
                 
@@ -133,9 +151,9 @@ class ActionHandler:
                 
                 recommendations = []
                 for result in product_results:
-                    product_id = result.metadata.get('id')
-                    if product_id:
-                        product = db.products.find_one({"_id": ObjectId(product_id)})
+                    result_id = result.metadata.get('product_id') or result.metadata.get('id')
+                    if result_id and ObjectId.is_valid(result_id):
+                        product = db.product.find_one({"_id": ObjectId(result_id)})
                         if product:
                             from models.product import Product
                             recommendations.append(Product.from_dict(product).to_json())
@@ -143,12 +161,12 @@ class ActionHandler:
                 return recommendations
             
             elif category_id:
-                products = db.products.find({"category_id": category_id}).limit(limit)
+                products = db.product.find({"category_id": category_id}).limit(limit)
                 from models.product import Product
                 return [Product.from_dict(p).to_json() for p in products]
             
             else:
-                products = db.products.aggregate([{"$sample": {"size": limit}}])
+                products = db.product.aggregate([{"$sample": {"size": limit}}])
                 from models.product import Product
                 return [Product.from_dict(p).to_json() for p in products]
         
@@ -4,6 +4,8 @@ from pymongo import MongoClient,errors
 from bson import ObjectId
 from datetime import datetime
 from config import MONGO_URI 
+from models.product import parse_brand, parse_price_vnd
+from services.catalog_version import catalog_version
 
 def add_data_to_db():
 
@@ -99,7 +101,9 @@ def add_data_to_db():
                         "title": prod_data.get("title", "Không có tiêu đề"),
                         "description": prod_data.get("description", ""),
                         "price": str(prod_data.get("price", "0")),
+                        "price_vnd": parse_price_vnd(prod_data.get("price", "0")),
                         "features": prod_data.get("features", []),
+                        "brand": parse_brand(prod_data.get("features", [])),
                         "image_path": prod_data.get("image_path", ""),
                         "category_id": str(mongo_category_id),
                         "stock_count": int(prod_data.get("inventory", 0)),
@@ -116,6 +120,9 @@ def add_data_to_db():
                 print(f"Không tìm thấy key 'products' hoặc định dạng không đúng cho category: {cat_data.get('name')}")
 
 
+    # Báo cho các tiến trình app đang chạy dựng lại snapshot trang chủ
+    catalog_version.bump(db)
+
     print(f"\nHoàn thành thêm dữ liệu.")
     print(f"Tổng số categories đã thêm: {categories_added_count}")
     print(f"Tổng số products đã thêm: {products_added_count}")
@@ -0,0 +1,92 @@
+import threading
+
+
+class GenerationCancelled(Exception):
+    """Raised from inside the LLM callback to abort a streaming generation."""
+    pass
+
+
+class CancellationToken:
+    def __init__(self, key=None, owner=None):
+        self.key = key
+        self.owner = owner
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason="cancelled"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise GenerationCancelled(self.reason)
+
+
+class GenerationRegistry:
+    """Theo dõi các lượt sinh câu trả lời đang chạy để có thể hủy khi client ngắt kết nối."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = {}
+        self.completed_generations = 0
+        self.completed_tokens = 0
+        self.cancelled_generations = 0
+        self.cancelled_tokens_generated = 0
+        self.tokens_saved_estimate = 0
+
+    def start(self, key, owner=None):
+        """Register a new generation for key, superseding any generation still running for it."""
+        token = CancellationToken(key, owner)
+        with self._lock:
+            previous = self._active.get(key)
+            self._active[key] = token
+        if previous:
+            previous.cancel("superseded")
+        return token
+
+    def cancel(self, key, reason="client_disconnected"):
+        with self._lock:
+            token = self._active.get(key)
+        if token:
+            token.cancel(reason)
+            return True
+        return False
+
+    def cancel_owner(self, owner, reason="client_disconnected"):
+        """Cancel every generation started by owner (e.g. a Socket.IO sid)."""
+        with self._lock:
+            tokens = [token for token in self._active.values() if token.owner == owner]
+        for token in tokens:
+            token.cancel(reason)
+        return len(tokens)
+
+    def finish(self, token, tokens_generated):
+        with self._lock:
+            if self._active.get(token.key) is token:
+                del self._active[token.key]
+
+            if token.is_cancelled():
+                average = self.completed_tokens // self.completed_generations if self.completed_generations else 0
+                self.cancelled_generations += 1
+                self.cancelled_tokens_generated += tokens_generated
+                self.tokens_saved_estimate += max(average - tokens_generated, 0)
+            else:
+                self.completed_generations += 1
+                self.completed_tokens += tokens_generated
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active_generations": len(self._active),
+                "completed_generations": self.completed_generations,
+                "cancelled_generations": self.cancelled_generations,
+                "cancelled_tokens_generated": self.cancelled_tokens_generated,
+                "tokens_saved_estimate": self.tokens_saved_estimate
+            }
+
+
+generation_registry = GenerationRegistry()
@@ -1,5 +1,6 @@
 import requests
 import json
+import logging
 import config
 import os
 import re
@@ -7,8 +8,13 @@ from langchain.prompts import PromptTemplate
 from langchain_community.llms import Ollama
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
 from langchain.callbacks.base import BaseCallbackHandler
+from langchain.docstore.document import Document
+from rag.cancellation import GenerationCancelled, generation_registry
+from services.recommendations import recommended_products
+
+logger = logging.getLogger(__name__)
 
 # --- Prompt Templates ---
 def get_query_classification_prompt_template():
@@ -60,6 +66,7 @@ Người dùng đang hỏi về sản phẩm trong một danh mục cụ thể.
 
 Định dạng câu trả lời thành danh sách đánh số các đề xuất.
 Chỉ đề xuất sản phẩm phù hợp với danh mục mà người dùng đang hỏi.
+Nếu thông tin có mục "Thường được mua cùng" hoặc "Sản phẩm tương tự", hãy gợi ý thêm vài sản phẩm trong đó ở cuối câu trả lời.
 Nếu người dùng không chắc họ muốn danh mục nào, hãy yêu cầu làm rõ và đề xuất các danh mục.
 
 Câu hỏi của người dùng: {question}
@@ -68,14 +75,20 @@ Câu hỏi của người dùng: {question}
 
 # --- Streaming Callback Handler ---
 class StreamingCallbackHandlerForChat(BaseCallbackHandler):
-    def __init__(self, stream_fn):
+    # Cho phép GenerationCancelled thoát ra khỏi callback để ngắt request stream tới Ollama
+    raise_error = True
+
+    def __init__(self, stream_fn, cancel_token=None):
         self.stream_fn = stream_fn
+        self.cancel_token = cancel_token
         self.response_accumulator = []
         self.in_tool_call = False
 
     def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if self.cancel_token:
+            self.cancel_token.raise_if_cancelled()
 
-        if not self.in_tool_call:
+        if not self.in_tool_call and self.stream_fn:
             try:
                 self.stream_fn(token)
             except Exception as e:
@@ -93,6 +106,9 @@ class StreamingCallbackHandlerForChat(BaseCallbackHandler):
         full_response = "".join(self.response_accumulator)
         return full_response.strip()
 
+    def get_token_count(self) -> int:
+        return len(self.response_accumulator)
+
 
 class ChatManager:
     def __init__(self):
@@ -124,8 +140,47 @@ class ChatManager:
         
         return is_product
 
-    def process_message(self, session_id: str, message: str, stream_callback: callable = None):
+    def process_message(self, message: str, session_id: str, stream_callback: callable = None, cancel_token=None, db=None):
+        """
+        Sinh câu trả lời cho message. Nếu cancel_token bị hủy giữa chừng, request tới Ollama
+        bị ngắt và phần trả lời đã sinh được trả về (cancel_token.is_cancelled() sẽ là True).
+        Khi có db, câu hỏi về sản phẩm được bổ sung gợi ý từ bảng product_recommendations.
+        """
+        if cancel_token is None:
+            cancel_token = generation_registry.start(session_id)
+
+        streaming_handler = StreamingCallbackHandlerForChat(stream_callback, cancel_token)
+        try:
+            cancel_token.raise_if_cancelled()
+            self._run_chain(message, streaming_handler, db)
+        except GenerationCancelled:
+            pass
+        finally:
+            generation_registry.finish(cancel_token, streaming_handler.get_token_count())
+
+        return streaming_handler.get_full_response()
+
+    def _recommendation_documents(self, db, documents):
+        """Bought-together and similar products for the retrieved products, read from the precomputed table."""
+        sections = []
+        for document in documents:
+            product_id = document.metadata.get("product_id")
+            if not product_id:
+                continue
+            try:
+                recommendations = recommended_products(db, product_id, config.RECOMMENDATION_CHAT_LIMIT)
+            except Exception as e:
+                logger.error(f"Could not load recommendations for product {product_id}: {e}")
+                continue
+            for label, key in (("Thường được mua cùng", "bought_together"), ("Sản phẩm tương tự", "similar")):
+                lines = [f"- {product['title']} (giá: {product['price']})" for product in recommendations[key]]
+                if lines:
+                    sections.append(f"{label}:\n" + "\n".join(lines))
+        return [Document(page_content="\n\n".join(sections))] if sections else []
+
+    def _run_chain(self, message: str, streaming_handler: StreamingCallbackHandlerForChat, db=None):
         is_product = self._is_asking_product(message)
+        streaming_handler.cancel_token.raise_if_cancelled()
         
         retriever = None
         prompt = None
@@ -140,7 +195,11 @@ class ChatManager:
             )
             prompt = self.category_prompt
 
-        streaming_handler = StreamingCallbackHandlerForChat(stream_callback)
+        #Thực hiện quá trình tìm kiếm
+        documents = retriever.invoke(message)
+        if is_product and db is not None:
+            documents += self._recommendation_documents(db, documents)
+        streaming_handler.cancel_token.raise_if_cancelled()
 
         #Khai báo model
         streaming_llm = Ollama(
@@ -149,16 +208,5 @@ class ChatManager:
             callbacks=[streaming_handler]
         )
 
-        #Thực hiện quá trình tìm kiếm
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=streaming_llm,
-            chain_type="stuff",
-            retriever=retriever,
-            chain_type_kwargs={"prompt": prompt},
-            return_source_documents=False 
-        )
-        
-        qa_chain.invoke({"query": message}) 
-        full_response = streaming_handler.get_full_response()
-        return full_response
-            
\ No newline at end of file
+        qa_chain = load_qa_chain(streaming_llm, chain_type="stuff", prompt=prompt)
+        qa_chain.invoke({"input_documents": documents, "question": message})
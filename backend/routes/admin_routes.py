@@ -0,0 +1,119 @@
+from flask import Blueprint, jsonify, request, current_app
+from bson import ObjectId
+from models.order import Order
+from middleware.auth import admin_required
+from services.category_cache import category_cache
+from services.pagination import page_size
+from services import sales_rollups
+from services.checkout import CheckoutService, CheckoutError
+import config
+
+admin_bp = Blueprint('admin', __name__)
+
+ORDER_STATUSES = {
+    Order.STATUS_PENDING_PAYMENT, Order.STATUS_PROCESSING, Order.STATUS_SHIPPING,
+    Order.STATUS_DELIVERED, Order.STATUS_CANCELLED, Order.STATUS_REFUNDED,
+}
+
+def report_days():
+    days = request.args.get('days', 7, type=int)
+    return max(1, min(days, config.SALES_REPORT_MAX_DAYS))
+
+@admin_bp.route('/sales/daily', methods=['GET'])
+@admin_required
+def get_daily_sales(user_id):
+    """Revenue, orders and units per day for the last `days` days"""
+    db = current_app.config['db']
+
+    rollups = sales_rollups.daily_rollups(db, report_days())
+    series = [{
+        "date": rollup["_id"],
+        "revenue_vnd": rollup.get("revenue_vnd", 0),
+        "orders": rollup.get("orders", 0),
+        "units": rollup.get("units", 0),
+        "reversed_orders": rollup.get("reversed_orders", 0),
+    } for rollup in rollups]
+
+    return jsonify({
+        "days": series,
+        "totals": {
+            field: sum(day[field] for day in series)
+            for field in ("revenue_vnd", "orders", "units", "reversed_orders")
+        }
+    }), 200
+
+@admin_bp.route('/sales/top-products', methods=['GET'])
+@admin_required
+def get_top_products(user_id):
+    """Best-selling products by units over the last `days` days"""
+    db = current_app.config['db']
+
+    top = sales_rollups.top_entries(
+        sales_rollups.daily_rollups(db, report_days()), "products", page_size(request.args.get('limit', type=int), default=10)
+    )
+    object_ids = [ObjectId(product_id) for product_id, _ in top if ObjectId.is_valid(product_id)]
+    products = {
+        str(doc["_id"]): doc
+        for doc in db.product.find({"_id": {"$in": object_ids}}, {"title": 1, "image_path": 1, "stock_count": 1})
+    }
+
+    return jsonify({"products": [{
+        "product_id": product_id,
+        "title": products.get(product_id, {}).get("title"),
+        "image_path": products.get(product_id, {}).get("image_path"),
+        "stock_count": products.get(product_id, {}).get("stock_count"),
+        **totals
+    } for product_id, totals in top]}), 200
+
+@admin_bp.route('/sales/top-categories', methods=['GET'])
+@admin_required
+def get_top_categories(user_id):
+    """Best-selling categories by units over the last `days` days"""
+    db = current_app.config['db']
+
+    top = sales_rollups.top_entries(
+        sales_rollups.daily_rollups(db, report_days()), "categories", page_size(request.args.get('limit', type=int), default=10)
+    )
+    return jsonify({"categories": [{
+        "category_id": category_id,
+        "name": category_cache.get_name(db, category_id),
+        **totals
+    } for category_id, totals in top]}), 200
+
+@admin_bp.route('/inventory/low-stock', methods=['GET'])
+@admin_required
+def get_low_stock(user_id):
+    """Products whose stock is at or below LOW_STOCK_THRESHOLD, lowest first"""
+    db = current_app.config['db']
+
+    alerts = db.low_stock_alerts.find().sort([("stock_count", 1), ("_id", 1)]).limit(page_size(request.args.get('limit', type=int)))
+    return jsonify({
+        "threshold": config.LOW_STOCK_THRESHOLD,
+        "products": [{
+            "product_id": alert["_id"],
+            "title": alert.get("title"),
+            "stock_count": alert.get("stock_count"),
+            "category_id": alert.get("category_id"),
+            "raised_at": alert["raised_at"].isoformat() if alert.get("raised_at") else None,
+        } for alert in alerts]
+    }), 200
+
+@admin_bp.route('/orders/<order_id>/status', methods=['PUT'])
+@admin_required
+def update_order_status(order_id, user_id):
+    """Change an order's status; cancelling or refunding restocks it and removes it from the sales rollups"""
+    db = current_app.config['db']
+    status = (request.json or {}).get('status')
+
+    if status not in ORDER_STATUSES:
+        return jsonify({"error": f"status must be one of: {', '.join(sorted(ORDER_STATUSES))}"}), 400
+    if not ObjectId.is_valid(order_id):
+        return jsonify({"error": "Invalid order ID format"}), 400
+
+    try:
+        order = CheckoutService(current_app.config['mongo_client'], db).change_order_status(order_id, status)
+    except CheckoutError as e:
+        return jsonify({"error": e.message}), e.status_code
+    if not order:
+        return jsonify({"error": "Order not found"}), 404
+    return jsonify({"order": order.to_json()}), 200
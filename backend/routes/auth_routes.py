@@ -1,17 +1,38 @@
 from flask import Blueprint, jsonify, request, current_app
 from bson import ObjectId
 from models.user import User
-from middleware.auth import token_required
+from middleware.auth import token_required, get_current_user
 from services.auth_service import AuthService
+from services.password_hasher import HasherBusy
+from services.rate_limit import login_email_limiter, login_ip_limiter
 import config
 
 auth_bp = Blueprint('auth', __name__)
 
+def rate_limited(*checks):
+    """429 response if any (limiter, key) pair is out of tokens, else None."""
+    for limiter, key in checks:
+        allowed, retry_after = limiter.allow(key)
+        if not allowed:
+            response = jsonify({"error": "Too many attempts, please try again later"})
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
+    return None
+
+def hasher_busy():
+    response = jsonify({"error": "Server busy, please try again"})
+    response.headers['Retry-After'] = "1"
+    return response, 503
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     db = current_app.config['db']
     data = request.json
     
+    limited = rate_limited((login_ip_limiter, request.remote_addr))
+    if limited:
+        return limited
+    
     try:
         auth_service = AuthService(db)
         user, token = auth_service.register_user(data)
@@ -23,6 +44,8 @@ def register():
         }), 201
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except HasherBusy:
+        return hasher_busy()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -36,6 +59,13 @@ def login():
         if field not in data:
             return jsonify({"error": f"Missing required field: {field}"}), 400
     
+    limited = rate_limited(
+        (login_ip_limiter, request.remote_addr),
+        (login_email_limiter, str(data['email']).strip().lower())
+    )
+    if limited:
+        return limited
+    
     try:
         auth_service = AuthService(db)
         user, token = auth_service.login_user(data['email'], data['password'])
@@ -47,6 +77,8 @@ def login():
         }), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 401
+    except HasherBusy:
+        return hasher_busy()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -56,8 +88,7 @@ def get_profile(user_id):
     db = current_app.config['db']
     
     try:
-        auth_service = AuthService(db)
-        user = auth_service.get_user_by_id(user_id)
+        user = get_current_user(db)
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -76,6 +107,10 @@ def create_admin():
         if field not in data:
             return jsonify({"error": f"Missing required field: {field}"}), 400
     
+    limited = rate_limited((login_ip_limiter, request.remote_addr))
+    if limited:
+        return limited
+    
     try:
         admin_exists = db.users.find_one({"role": "admin"})
         if admin_exists:
@@ -91,5 +126,7 @@ def create_admin():
         }), 201
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except HasherBusy:
+        return hasher_busy()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
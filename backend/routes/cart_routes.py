@@ -1,52 +1,51 @@
-from flask import Blueprint, jsonify, request, current_app
+import uuid
+from flask import Blueprint, jsonify, request, current_app, g
 from bson import ObjectId
 from models.cart import Cart
 from models.product import Product
-import uuid
-import jwt as PyJWT
-import config
+from services.cart_repository import CartRepository
+from services.cart_pricing import acknowledge_price_changes, priced_cart_json
+from services.stock_reservations import StockReservations, holder_key
+from middleware.identity import current_identity, current_user_id, MISSING
 
 cart_bp = Blueprint('cart', __name__)
 
+def cart_item_not_found(carts, user_id, session_id):
+    # Chỉ chạy khi cập nhật thất bại, để phân biệt giỏ không tồn tại với sản phẩm không có trong giỏ
+    if not carts.find(user_id=user_id, session_id=session_id):
+        return jsonify({"error": "Cart not found"}), 404
+    return jsonify({"error": "Product not found in cart"}), 404
+
 @cart_bp.route('/', methods=['GET'])
 def get_cart():
     db = current_app.config['db']
     
-    user_id = None
-    auth_header = request.headers.get('Authorization')
-    if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.split(' ')[1]
-        try:
-            payload = PyJWT.decode(token, config.JWT_SECRET_KEY, algorithms=['HS256'])
-            user_id = payload['sub']
-        except:
-            pass
+    user_id = current_user_id()
     
     session_id = request.headers.get('X-Session-ID')
     
-    cart_data = None
-    if user_id:
-        cart_data = db.carts.find_one({"user_id": user_id})
-    elif session_id:
-        cart_data = db.carts.find_one({"session_id": session_id})
+    cart = CartRepository(db).get_or_create(user_id=user_id, session_id=session_id)
+    return jsonify({
+        "cart": priced_cart_json(db, cart),
+        "session_id": cart.session_id
+    }), 200
+
+@cart_bp.route('/acknowledge-prices', methods=['POST'])
+def acknowledge_prices():
+    db = current_app.config['db']
     
-    if not cart_data:
-        if not session_id:
-            session_id = str(uuid.uuid4())
-        
-        cart = Cart(user_id=user_id, session_id=session_id, is_anonymous=(user_id is None))
-        result = db.carts.insert_one(cart.to_dict())
-        cart.id = str(result.inserted_id)
-        
-        return jsonify({
-            "cart": cart.to_json(),
-            "session_id": session_id
-        }), 200
+    user_id = current_user_id()
     
-    cart = Cart.from_dict(cart_data)
+    session_id = request.headers.get('X-Session-ID')
+    
+    cart = CartRepository(db).find(user_id=user_id, session_id=session_id)
+    if not cart:
+        return jsonify({"error": "Cart not found"}), 404
+    
+    updated = acknowledge_price_changes(db, cart)
     return jsonify({
-        "cart": cart.to_json(),
-        "session_id": cart.session_id
+        "message": f"Updated the price of {updated} item(s)",
+        "cart": priced_cart_json(db, cart)
     }), 200
 
 @cart_bp.route('/items', methods=['POST'])
@@ -71,48 +70,30 @@ def add_to_cart():
             return jsonify({"error": "Product not found"}), 404
         
         product = Product.from_dict(product_data)
-        
-        if product.stock_count < quantity:
-            return jsonify({"error": f"Not enough stock. Only {product.stock_count} available."}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 400
     
-    user_id = None
-    auth_header = request.headers.get('Authorization')
-    if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.split(' ')[1]
-        try:
-            payload = PyJWT.decode(token, config.JWT_SECRET_KEY, algorithms=['HS256'])
-            user_id = payload['sub']
-        except:
-            pass
+    user_id = current_user_id()
     
-    session_id = request.headers.get('X-Session-ID')
+    # Giỏ mới của khách chưa có session id: tạo trước để giữ hàng đúng chủ giỏ
+    session_id = request.headers.get('X-Session-ID') or (None if user_id else str(uuid.uuid4()))
     
-    cart_data = None
-    if user_id:
-        cart_data = db.carts.find_one({"user_id": user_id})
-    elif session_id:
-        cart_data = db.carts.find_one({"session_id": session_id})
+    reservations = StockReservations(db)
+    holder = holder_key(user_id, session_id)
+    if not reservations.reserve(holder, product_id, quantity):
+        return jsonify({"error": f"Not enough stock. Only {reservations.available(product_id) or 0} available."}), 400
     
-    if not cart_data:
-        if not session_id:
-            session_id = str(uuid.uuid4())
-        
-        cart = Cart(user_id=user_id, session_id=session_id, is_anonymous=(user_id is None))
-        cart.add_item(product_id, quantity, product.price, product.title, product.image_path)
-        
-        result = db.carts.insert_one(cart.to_dict())
-        cart.id = str(result.inserted_id)
-    else:
-        cart = Cart.from_dict(cart_data)
-        cart.add_item(product_id, quantity, product.price, product.title, product.image_path)
-        
-        db.carts.update_one({"_id": ObjectId(cart.id)}, {"$set": cart.to_dict()})
+    cart = CartRepository(db).add_item(
+        product_id, quantity, product.price, product.title, product.image_path,
+        user_id=user_id, session_id=session_id
+    )
+    if not cart:
+        reservations.release(holder, product_id, quantity)
+        return jsonify({"error": "Cart was modified concurrently, please retry"}), 409
     
     return jsonify({
         "message": f"Added {quantity} of {product.title} to cart",
-        "cart": cart.to_json(),
+        "cart": priced_cart_json(db, cart),
         "session_id": cart.session_id
     }), 200
 
@@ -129,167 +110,94 @@ def update_cart_item(product_id):
     if quantity < 0:
         return jsonify({"error": "Quantity cannot be negative"}), 400
     
-    user_id = None
-    auth_header = request.headers.get('Authorization')
-    if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.split(' ')[1]
-        try:
-            payload = PyJWT.decode(token, config.JWT_SECRET_KEY, algorithms=['HS256'])
-            user_id = payload['sub']
-        except:
-            pass
+    user_id = current_user_id()
     
     session_id = request.headers.get('X-Session-ID')
     
-    cart_data = None
-    if user_id:
-        cart_data = db.carts.find_one({"user_id": user_id})
-    elif session_id:
-        cart_data = db.carts.find_one({"session_id": session_id})
-    
-    if not cart_data:
-        return jsonify({"error": "Cart not found"}), 404
-    
-    cart = Cart.from_dict(cart_data)
-    
-    if quantity == 0:
-        if not cart.remove_item(product_id):
-            return jsonify({"error": "Product not found in cart"}), 404
-    else:
-        if not cart.update_item(product_id, quantity):
-            return jsonify({"error": "Product not found in cart"}), 404
+    reservations = StockReservations(db)
+    holder = holder_key(user_id, session_id)
+    if holder and not reservations.set_quantity(holder, product_id, quantity):
+        return jsonify({"error": f"Not enough stock. Only {reservations.available(product_id) or 0} more available."}), 400
     
-    db.carts.update_one({"_id": ObjectId(cart.id)}, {"$set": cart.to_dict()})
+    carts = CartRepository(db)
+    cart = carts.set_quantity(product_id, quantity, user_id=user_id, session_id=session_id)
+    if not cart:
+        if holder:
+            reservations.release(holder, product_id)
+        return cart_item_not_found(carts, user_id, session_id)
     
     return jsonify({
         "message": "Cart updated successfully",
-        "cart": cart.to_json()
+        "cart": priced_cart_json(db, cart)
     }), 200
 
 @cart_bp.route('/items/<product_id>', methods=['DELETE'])
 def remove_cart_item(product_id):
     db = current_app.config['db']
     
-    user_id = None
-    auth_header = request.headers.get('Authorization')
-    if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.split(' ')[1]
-        try:
-            payload = PyJWT.decode(token, config.JWT_SECRET_KEY, algorithms=['HS256'])
-            user_id = payload['sub']
-        except:
-            pass
+    user_id = current_user_id()
     
     session_id = request.headers.get('X-Session-ID')
     
-    cart_data = None
-    if user_id:
-        cart_data = db.carts.find_one({"user_id": user_id})
-    elif session_id:
-        cart_data = db.carts.find_one({"session_id": session_id})
-    
-    if not cart_data:
-        return jsonify({"error": "Cart not found"}), 404
+    holder = holder_key(user_id, session_id)
+    if holder:
+        StockReservations(db).release(holder, product_id)
     
-    cart = Cart.from_dict(cart_data)
-    
-    if not cart.remove_item(product_id):
-        return jsonify({"error": "Product not found in cart"}), 404
-    
-    db.carts.update_one({"_id": ObjectId(cart.id)}, {"$set": cart.to_dict()})
+    carts = CartRepository(db)
+    cart = carts.remove_item(product_id, user_id=user_id, session_id=session_id)
+    if not cart:
+        return cart_item_not_found(carts, user_id, session_id)
     
     return jsonify({
         "message": "Item removed from cart",
-        "cart": cart.to_json()
+        "cart": priced_cart_json(db, cart)
     }), 200
 
 @cart_bp.route('/items/clear', methods=['DELETE'])
 def clear_cart():
     db = current_app.config['db']
     
-    user_id = None
-    auth_header = request.headers.get('Authorization')
-    if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.split(' ')[1]
-        try:
-            payload = PyJWT.decode(token, config.JWT_SECRET_KEY, algorithms=['HS256'])
-            user_id = payload['sub']
-        except:
-            pass 
+    user_id = current_user_id()
     
     session_id = request.headers.get('X-Session-ID')
     
-    cart_data = None
-    if user_id:
-        cart_data = db.carts.find_one({"user_id": user_id})
-    elif session_id:
-        cart_data = db.carts.find_one({"session_id": session_id})
+    holder = holder_key(user_id, session_id)
+    if holder:
+        StockReservations(db).release_all(holder)
     
-    if not cart_data:
+    cart = CartRepository(db).clear(user_id=user_id, session_id=session_id)
+    if not cart:
         return jsonify({
             "message": "Cart is already empty or not found",
             "cart": Cart(user_id=user_id, session_id=session_id, is_anonymous=(user_id is None)).to_json()
         }), 200
     
-    cart = Cart.from_dict(cart_data)
-    cart.clear_items()
-    
-    db.carts.update_one({"_id": ObjectId(cart.id)}, {"$set": cart.to_dict()})
-    
     return jsonify({
         "message": "Cart cleared successfully",
-        "cart": cart.to_json()
+        "cart": priced_cart_json(db, cart)
     }), 200
 
 @cart_bp.route('/merge', methods=['POST'])
 def merge_carts():
     db = current_app.config['db']
     
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({"error": "Authorization required"}), 401
-    
-    token = auth_header.split(' ')[1]
-    
-    try:
-        payload = PyJWT.decode(token, config.JWT_SECRET_KEY, algorithms=['HS256'])
-        user_id = payload['sub']
-    except:
+    identity = current_identity()
+    if not identity:
+        if g.identity_error == MISSING:
+            return jsonify({"error": "Authorization required"}), 401
         return jsonify({"error": "Invalid token"}), 401
+    user_id = identity['user_id']
     
     session_id = request.headers.get('X-Session-ID')
     if not session_id:
         return jsonify({"error": "Session ID required"}), 400
     
-    anon_cart_data = db.carts.find_one({"session_id": session_id, "is_anonymous": True})
-    if not anon_cart_data:
+    cart, converted = CartRepository(db).merge_anonymous(user_id, session_id)
+    if not cart:
         return jsonify({"error": "Anonymous cart not found"}), 404
+    StockReservations(db).transfer(holder_key(session_id=session_id), holder_key(user_id=user_id))
     
-    anon_cart = Cart.from_dict(anon_cart_data)
-    
-    user_cart_data = db.carts.find_one({"user_id": user_id})
-    
-    if user_cart_data:
-        user_cart = Cart.from_dict(user_cart_data)
-        
-        for item in anon_cart.items:
-            user_cart.add_item(item.product_id, item.quantity, item.price, item.title)
-        
-        db.carts.update_one({"_id": ObjectId(user_cart.id)}, {"$set": user_cart.to_dict()})
-        
-        db.carts.delete_one({"_id": ObjectId(anon_cart.id)})
-        
-        return jsonify({
-            "message": "Carts merged successfully",
-            "cart": user_cart.to_json()
-        }), 200
-    else:
-        anon_cart.user_id = user_id
-        anon_cart.is_anonymous = False
-        
-        db.carts.update_one({"_id": ObjectId(anon_cart.id)}, {"$set": anon_cart.to_dict()})
-        
-        return jsonify({
-            "message": "Anonymous cart converted to user cart",
-            "cart": anon_cart.to_json()
-        }), 200
+    return jsonify({
+        "message": "Anonymous cart converted to user cart" if converted else "Carts merged successfully",
+        "cart": priced_cart_json(db, cart)
+    }), 200
@@ -2,10 +2,15 @@ from flask import Blueprint, jsonify, request, current_app
 from bson import ObjectId
 from models.category import Category
 from middleware.auth import admin_required, token_required
+from middleware.conditional import conditional_get
+from services.category_cache import category_cache
+from services.catalog_version import catalog_version
+from services.pagination import InvalidCursor, keyset_page, page_size, parse_sort, price_range_filter
 
 category_bp = Blueprint('category', __name__)
 
 @category_bp.route('/', methods=['GET'])
+@conditional_get('categories', max_age=60)
 def get_categories():
     """Get all categories"""
     db = current_app.config['db']
@@ -13,6 +18,7 @@ def get_categories():
     return jsonify([Category.from_dict(c).to_json() for c in categories]), 200
 
 @category_bp.route('/<category_id>', methods=['GET'])
+@conditional_get('category', max_age=60)
 def get_category(category_id):
     """Get a single category by ID"""
     db = current_app.config['db']
@@ -35,6 +41,8 @@ def create_category(user_id):
         category = Category.from_dict(data)
         result = db.categorie.insert_one(category.to_dict())
         category.id = str(result.inserted_id)
+        category_cache.invalidate()
+        catalog_version.bump(db, [category.id])
         return jsonify(category.to_json()), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -53,6 +61,8 @@ def update_category(category_id, user_id):
         
         category = Category.from_dict({**existing, **data, "id": category_id})
         db.categorie.update_one({"_id": ObjectId(category_id)}, {"$set": category.to_dict()})
+        category_cache.invalidate()
+        catalog_version.bump(db, [category_id])
         return jsonify(category.to_json()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -71,21 +81,49 @@ def delete_category(category_id, user_id):
         result = db.categorie.delete_one({"_id": ObjectId(category_id)})
         if result.deleted_count == 0:
             return jsonify({"error": "Category not found"}), 404
+        category_cache.invalidate()
+        catalog_version.bump(db, [category_id])
         return jsonify({"message": "Category deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @category_bp.route('/<category_id>/products', methods=['GET'])
+@conditional_get('category-products', stock=True)
 def get_category_products(category_id):
     """Get all products in a category"""
     db = current_app.config['db']
     try:
-        category = db.categorie.find_one({"_id": ObjectId(category_id)})
-        if not category:
+        if not category_cache.get(db, category_id):
             return jsonify({"error": "Category not found"}), 404
         
         from models.product import Product
-        products = db.product.find({"category_id": category_id})
-        return jsonify([Product.from_dict(p).to_json() for p in products]), 200
+
+        sort = [("_id", 1)]
+        if request.args.get('sort'):
+            sort = parse_sort(request.args.get('sort'), {"price": "price_vnd"})
+            if sort is None:
+                return jsonify({"error": "Unsupported sort, use price or -price"}), 400
+
+        query = {"category_id": category_id}
+        price_range = price_range_filter(request.args.get('min_price', type=int), request.args.get('max_price', type=int), sort)
+        if price_range:
+            query['price_vnd'] = price_range
+
+        # Phân trang chỉ khi client yêu cầu (?per_page= / ?cursor=); client cũ vẫn nhận toàn bộ danh mục
+        next_cursor = None
+        if 'per_page' in request.args or 'cursor' in request.args:
+            products, next_cursor = keyset_page(
+                db.product, query, sort,
+                page_size(request.args.get('per_page', type=int)), request.args.get('cursor')
+            )
+        else:
+            products = db.product.find(query).sort(sort)
+        response = jsonify([Product.from_dict(p).to_json() for p in products])
+        # Giữ nguyên dạng mảng của body; con trỏ trang sau đi trong header
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 400
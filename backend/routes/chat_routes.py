@@ -1,13 +1,15 @@
 from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context, g
 from bson import ObjectId
-from models.chat_session import ChatSession
+from models.chat_session import ChatSession, ChatMessage
 import uuid
-import jwt as PyJWT
-import config
 from rag.chat import ChatManager
+from rag.cancellation import generation_registry
+from middleware.auth import admin_required
+from middleware.identity import current_user_id
+from middleware.idempotency import idempotent
 import json
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 import threading
 import queue
 
@@ -23,24 +25,18 @@ def get_chat_session(session_id=None):
     """Get or create a chat session"""
     db = current_app.config['db']
     
-    user_id = None
-    auth_header = request.headers.get('Authorization')
-    if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.split(' ')[1]
-        try:
-            payload = PyJWT.decode(token, config.JWT_SECRET_KEY, algorithms=['HS256'])
-            user_id = payload['sub']
-        except:
-            pass
+    user_id = current_user_id()
     
     if not session_id:
         session_id = request.headers.get('X-Session-ID')
     
+    chat_writer = current_app.config['chat_writer']
+
     chat_data = None
     if session_id:
-        chat_data = db.chat_sessions.find_one({"session_id": session_id})
+        chat_data = chat_writer.history.load_session({"session_id": session_id})
     elif user_id:
-        chat_data = db.chat_sessions.find_one({"user_id": user_id})
+        chat_data = chat_writer.history.load_session({"user_id": user_id})
     
     if session_id and not chat_data:
         return jsonify({"error": "Chat session not found"}), 404
@@ -65,22 +61,102 @@ def get_chat_session(session_id=None):
             cart_id=cart_id
         )
         
-        chat_session.add_message("assistant", "Xin chào, mình là trợ giúp mua sắm của bạn. Hôm nay bạn mua gì?")
-        
         result = db.chat_sessions.insert_one(chat_session.to_dict())
         chat_session.id = str(result.inserted_id)
-        
-        return jsonify({
-            "chat_session": chat_session.to_json(),
-            "session_id": session_id
-        }), 200
-    
-    chat_session = ChatSession.from_dict(chat_data)
+        chat_writer.remember_session(session_id, result.inserted_id, 0, chat_session.expiry_date)
+        chat_writer.append(session_id, "assistant", "Xin chào, mình là trợ giúp mua sắm của bạn. Hôm nay bạn mua gì?")
+    else:
+        chat_session = ChatSession.from_dict(chat_data)
+        chat_writer.remember_session(
+            chat_session.session_id, chat_session.id, chat_session.message_count, chat_session.expiry_date
+        )
+
+    # Chỉ trả về trang tin nhắn mới nhất; các trang cũ hơn lấy qua /sessions/<id>/messages?before=...
+    messages, before_cursor = chat_writer.read_page(chat_session.session_id)
+    chat_session.messages = [ChatMessage.from_dict(msg) for msg in messages]
+    chat_session.message_count = chat_writer.message_count(chat_session.session_id)
+
     return jsonify({
         "chat_session": chat_session.to_json(),
-        "session_id": chat_session.session_id
+        "session_id": chat_session.session_id,
+        "messages_before": before_cursor
+    }), 200
+
+@chat_bp.route('/sessions/<session_id>/messages', methods=['GET'])
+def get_chat_messages(session_id):
+    """Get one page of older chat messages, ending just before the `before` sequence number"""
+    chat_writer = current_app.config['chat_writer']
+
+    if not chat_writer.session_exists(session_id):
+        return jsonify({"error": "Chat session not found"}), 404
+
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', type=int)
+
+    messages, before_cursor = chat_writer.read_page(session_id, before=before, limit=limit)
+    return jsonify({
+        "session_id": session_id,
+        "messages": [ChatMessage.from_dict(msg).to_json() for msg in messages],
+        "message_count": chat_writer.message_count(session_id),
+        "messages_before": before_cursor
     }), 200
 
+@chat_bp.route('/sessions/<session_id>/sync', methods=['GET'])
+def sync_chat_messages(session_id):
+    """
+    Incremental refresh for the chat screen: only messages after `since` (a seq number)
+    or `since_ts` (ISO timestamp). Answers 304 when nothing new was added.
+    """
+    chat_writer = current_app.config['chat_writer']
+
+    if not chat_writer.session_exists(session_id):
+        return jsonify({"error": "Chat session not found"}), 404
+
+    since = request.args.get('since', type=int)
+    since_ts = request.args.get('since_ts')
+    limit = request.args.get('limit', type=int)
+
+    if since is None and not since_ts:
+        return jsonify({"error": "since or since_ts is required"}), 400
+
+    since_dt = None
+    if since is None:
+        try:
+            since_dt = datetime.fromisoformat(since_ts.replace('Z', '+00:00'))
+        except ValueError:
+            return jsonify({"error": "Invalid since_ts"}), 400
+        if since_dt.tzinfo is not None:
+            # Timestamp trong Mongo là UTC không kèm múi giờ
+            since_dt = since_dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+    message_count = chat_writer.message_count(session_id)
+    # ETag gồm cả con trỏ và limit: trang tiếp theo (has_more) là một biểu diễn khác
+    cursor = since if since is not None else since_dt.isoformat()
+    etag = f'"{session_id}-{message_count}-{cursor}-{limit or ""}"'
+    if request.if_none_match.contains_weak(etag.strip('"')) or (since is not None and since >= message_count - 1):
+        response = Response(status=304)
+        response.headers["ETag"] = etag
+        return response
+
+    if since is not None:
+        messages = chat_writer.read_since(session_id, since_seq=since, limit=limit)
+    else:
+        messages = chat_writer.read_since(session_id, since_ts=since_dt, limit=limit)
+
+    if not messages:
+        response = Response(status=304)
+        response.headers["ETag"] = etag
+        return response
+
+    last_seq = messages[-1]["seq"]
+    response = jsonify({
+        "messages": [ChatMessage.from_dict(msg).to_json() for msg in messages],
+        "last_seq": last_seq,
+        "has_more": last_seq < message_count - 1
+    })
+    response.headers["ETag"] = etag
+    return response, 200
+
 @chat_bp.route('/stream', methods=['GET'])
 def stream_response():
     """
@@ -122,6 +198,11 @@ def stream_response():
 
         except GeneratorExit:
             current_app.logger.info(f"SSE client disconnected for session: {session_id}")
+            # Chỉ hủy khi không có stream mới nào thay thế stream này (client mở lại SSE trước mỗi tin nhắn)
+            with queues_lock:
+                replaced = session_stream_queues.get(session_id) is not q
+            if not replaced and generation_registry.cancel(session_id):
+                current_app.logger.info(f"Cancelled generation for disconnected session: {session_id}")
         except Exception as e:
             current_app.logger.error(f"Error in SSE generator for session {session_id}: {e}")
             try:
@@ -130,7 +211,7 @@ def stream_response():
                  pass
         finally:
             with queues_lock:
-                if session_id in session_stream_queues:
+                if session_stream_queues.get(session_id) is q:
                     del session_stream_queues[session_id]
                     current_app.logger.info(f"Cleaned up queue for session: {session_id}")
 
@@ -142,6 +223,7 @@ def stream_response():
     return response
 
 @chat_bp.route('/message', methods=['POST'])
+@idempotent('chat-message')
 def send_message():
     """
     Endpoint để gửi tin nhắn và kích hoạt quá trình xử lý nền.
@@ -153,27 +235,20 @@ def send_message():
     if not message or not session_id:
         return jsonify({"error": "Message and session_id are required"}), 400
 
-    db = current_app.config['db']
+    chat_writer = current_app.config['chat_writer']
     flask_app = current_app._get_current_object()
 
-    chat_data = db.chat_sessions.find_one({"session_id": session_id})
-
-    if not chat_data:
+    if not chat_writer.session_exists(session_id):
         return jsonify({"error": "Chat session not found"}), 404
 
     try:
-        db.chat_sessions.update_one(
-            {'session_id': session_id},
-            {'$push': {'messages': {
-                'role': 'user',
-                'content': message,
-                'timestamp': datetime.utcnow()
-            }}}
-        )
+        chat_writer.append(session_id, 'user', message)
     except Exception as e:
         current_app.logger.error(f"Error saving user message for session {session_id}: {e}")
         return jsonify({"error": "Failed to save user message"}), 500
 
+    cancel_token = generation_registry.start(session_id)
+
     def process_async_with_context(app, message_content, session_identifier):
         with app.app_context():
             def queue_stream_callback(token):
@@ -186,23 +261,22 @@ def send_message():
                         current_app.logger.error(f"Error putting token in queue for {session_identifier}: {e}")
 
             try:
-                db_inside_context = current_app.config['db']
-
                 full_response = chat_manager.process_message(
                     message_content,
                     session_identifier,
-                    stream_callback=queue_stream_callback
+                    stream_callback=queue_stream_callback,
+                    cancel_token=cancel_token,
+                    db=current_app.config['db']
                 )
 
-                db_inside_context.chat_sessions.update_one(
-                    {'session_id': session_identifier},
-                    {'$push': {'messages': {
-                        'role': 'assistant',
-                        'content': full_response,
-                        'timestamp': datetime.utcnow()
-                    }}}
-                )
-                current_app.logger.info(f"Assistant response saved for session: {session_identifier}")
+                truncated = cancel_token.is_cancelled()
+                if truncated:
+                    current_app.logger.info(f"Generation cancelled ({cancel_token.reason}) for session: {session_identifier}")
+                    if not full_response:
+                        return
+
+                chat_writer.append(session_identifier, 'assistant', full_response, truncated=truncated)
+                current_app.logger.info(f"Assistant response queued for session: {session_identifier}")
 
             except Exception as e:
                 current_app.logger.error(f"Error processing message in thread for session {session_identifier}: {str(e)}")
@@ -230,3 +304,8 @@ def send_message():
 
     return jsonify({"status": "processing", "session_id": session_id}), 202
 
+@chat_bp.route('/generation-stats', methods=['GET'])
+@admin_required
+def get_generation_stats(user_id):
+    """Thống kê các lượt sinh câu trả lời bị hủy và số token ước tính đã tiết kiệm"""
+    return jsonify(generation_registry.stats()), 200
@@ -1,39 +1,71 @@
 from flask import Blueprint, jsonify, request, current_app
 from bson import ObjectId
 from models.product import Product
-from models.category import Category
 from middleware.auth import admin_required, token_required
+from middleware.conditional import conditional_get
+from services.category_cache import category_cache
+from services.catalog_version import catalog_version
+from services.sales_rollups import refresh_low_stock
+from services.recommendations import recommended_products
+from services.search_index import search_index
+from services.suggest_index import suggest_index
+from services.facets import catalog_facets
+from services.pagination import InvalidCursor, approximate_counter, decode_cursor, encode_cursor, keyset_page, page_size, parse_sort, price_range_filter
+import config
 
 product_bp = Blueprint('product', __name__)
 
 @product_bp.route('/', methods=['GET'])
+@conditional_get('products', stock=True)
 def get_products():
-    """Get all products with optional pagination and filtering by category"""
+    """Get all products with optional pagination, filtering by category and price range, and price sorting"""
     db = current_app.config['db']
     
     page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    per_page = page_size(request.args.get('per_page', type=int), default=10)
+    cursor = request.args.get('cursor')
     category_id = request.args.get('category_id')
+    brands = request.args.getlist('brand')
+    min_price = request.args.get('min_price', type=int)
+    max_price = request.args.get('max_price', type=int)
+
+    sort = [("_id", 1)]
+    if request.args.get('sort'):
+        sort = parse_sort(request.args.get('sort'), {"price": "price_vnd"})
+        if sort is None:
+            return jsonify({"error": "Unsupported sort, use price or -price"}), 400
 
     query = {}
     if category_id:
         query['category_id'] = category_id
-        category_check = db.categorie.find_one({"_id": ObjectId(category_id)})
-        if not category_check:
+        if not category_cache.get(db, category_id):
             return jsonify({"error": "Category not found"}), 404
+    if brands:
+        query['brand'] = {"$in": brands}
+    price_range = price_range_filter(min_price, max_price, sort)
+    if price_range:
+        query['price_vnd'] = price_range
             
-    total_products = db.product.count_documents(query)
-    products_cursor = db.product.find(query).skip((page - 1) * per_page).limit(per_page)
+    total_products = approximate_counter.count(db.product, query)
+    try:
+        if page > 1 and not cursor:
+            # Client cũ vẫn gửi page; client mới nên đi theo next_cursor để trang sâu không phải skip
+            products_page = list(db.product.find(query).sort(sort).skip((page - 1) * per_page).limit(per_page + 1))
+            next_cursor = None
+            if len(products_page) > per_page:
+                last = products_page[per_page - 1]
+                next_cursor = encode_cursor({field: last.get(field) for field, _ in sort})
+            products_page = products_page[:per_page]
+        else:
+            products_page, next_cursor = keyset_page(db.product, query, sort, per_page, cursor)
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
     
     products_list = []
-    for p_data in products_cursor:
+    for p_data in products_page:
         product = Product.from_dict(p_data)
-        cat_info = db.categorie.find_one({"_id": ObjectId(product.category_id)})
         product_json = product.to_json()
-        if cat_info:
-            product_json['category_name'] = Category.from_dict(cat_info).name
-        else:
-            product_json['category_name'] = "N/A"
+        product_json['category_name'] = category_cache.get_name(db, product.category_id)
         products_list.append(product_json)
         
     return jsonify({
@@ -41,10 +73,12 @@ def get_products():
         "total": total_products,
         "page": page,
         "per_page": per_page,
-        "pages": (total_products + per_page - 1) // per_page
+        "pages": (total_products + per_page - 1) // per_page,
+        "next_cursor": next_cursor
     }), 200
 
 @product_bp.route('/<product_id>', methods=['GET'])
+@conditional_get('product', stock=True)
 def get_product(product_id):
     """Get a single product by ID"""
     db = current_app.config['db']
@@ -55,17 +89,24 @@ def get_product(product_id):
         
         product = Product.from_dict(product_data)
         product_json = product.to_json()
-        
-        cat_info = db.categorie.find_one({"_id": ObjectId(product.category_id)})
-        if cat_info:
-            product_json['category_name'] = Category.from_dict(cat_info).name
-        else:
-            product_json['category_name'] = "N/A"
+        product_json['category_name'] = category_cache.get_name(db, product.category_id)
 
         return jsonify(product_json), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@product_bp.route('/<product_id>/recommendations', methods=['GET'])
+def get_product_recommendations(product_id):
+    """Similar and frequently-bought-together products, read from the precomputed table"""
+    db = current_app.config['db']
+
+    if not ObjectId.is_valid(product_id):
+        return jsonify({"error": "Invalid product ID"}), 400
+
+    limit = page_size(request.args.get('limit', type=int), default=config.RECOMMENDATION_LIMIT)
+    recommendations = recommended_products(db, product_id, limit)
+    return jsonify({"product_id": product_id, **recommendations}), 200
+
 @product_bp.route('/', methods=['POST'])
 @admin_required
 def create_product(user_id):
@@ -78,8 +119,7 @@ def create_product(user_id):
         if field not in data:
             return jsonify({"error": f"Missing required field: {field}"}), 400
 
-    category = db.categorie.find_one({"_id": ObjectId(data['category_id'])})
-    if not category:
+    if not category_cache.get(db, data['category_id']):
         return jsonify({"error": "Category not found"}), 404
         
     try:
@@ -90,6 +130,7 @@ def create_product(user_id):
         
         result = db.product.insert_one(product.to_dict())
         product.id = str(result.inserted_id)
+        catalog_version.bump(db, [product.category_id])
         return jsonify(product.to_json()), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -107,16 +148,14 @@ def update_product(product_id, user_id):
             return jsonify({"error": "Product not found"}), 404
         
         if 'category_id' in data:
-            category = db.categorie.find_one({"_id": ObjectId(data['category_id'])})
-            if not category:
+            if not category_cache.get(db, data['category_id']):
                 return jsonify({"error": "Category not found for update"}), 404
         
-        updated_data = {**Product.from_dict(existing_product_data).to_dict(for_update=True), **data}
-        if '_id' in updated_data:
-            del updated_data['_id']
-
+        previous_category_id = existing_product_data.get('category_id')
+        updated_data = {**existing_product_data, **data}
+        updated_data.pop('id', None)
 
-        product = Product.from_dict({**data, "id": product_id})
+        product = Product.from_dict(updated_data)
         
         from datetime import datetime
         product.updated_at = datetime.utcnow()
@@ -129,13 +168,13 @@ def update_product(product_id, user_id):
 
 
         db.product.update_one({"_id": ObjectId(product_id)}, {"$set": update_payload})
+        catalog_version.bump(db, [previous_category_id, product.category_id])
+        refresh_low_stock(db, [product_id])
         
         updated_product_data = db.product.find_one({"_id": ObjectId(product_id)})
         final_product = Product.from_dict(updated_product_data)
         final_product_json = final_product.to_json()
-        cat_info = db.categorie.find_one({"_id": ObjectId(final_product.category_id)})
-        if cat_info:
-            final_product_json['category_name'] = Category.from_dict(cat_info).name
+        final_product_json['category_name'] = category_cache.get_name(db, final_product.category_id)
         
         return jsonify(final_product_json), 200
     except Exception as e:
@@ -148,29 +187,117 @@ def delete_product(product_id, user_id):
     db = current_app.config['db']
     try:
             
-        result = db.product.delete_one({"_id": ObjectId(product_id)})
-        if result.deleted_count == 0:
+        deleted = db.product.find_one_and_delete({"_id": ObjectId(product_id)}, projection={"category_id": 1})
+        if not deleted:
             return jsonify({"error": "Product not found"}), 404
+        catalog_version.bump(db, [deleted.get('category_id')])
         return jsonify({"message": "Product deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@product_bp.route('/facets', methods=['GET'])
+@conditional_get('facets', stock=True)
+def get_product_facets():
+    """Category, price band and brand counts plus the first page of matching products"""
+    db = current_app.config['db']
+
+    sort = [("_id", 1)]
+    if request.args.get('sort'):
+        sort = parse_sort(request.args.get('sort'), {"price": "price_vnd"})
+        if sort is None:
+            return jsonify({"error": "Unsupported sort, use price or -price"}), 400
+
+    filters = {
+        "category_id": request.args.get('category_id'),
+        "brands": request.args.getlist('brand'),
+        "min_price": request.args.get('min_price', type=int),
+        "max_price": request.args.get('max_price', type=int),
+    }
+    per_page = page_size(request.args.get('per_page', type=int), default=10)
+
+    try:
+        result = catalog_facets.get(db, filters, sort, per_page)
+    except Exception as e:
+        current_app.logger.error(f"Error computing product facets: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    products_list = []
+    for p_data in result["products"]:
+        # Bản trong cache dùng chung giữa các request nên không để from_dict sửa trực tiếp
+        product = Product.from_dict(dict(p_data))
+        product_json = product.to_json()
+        product_json['category_name'] = category_cache.get_name(db, product.category_id)
+        products_list.append(product_json)
+
+    categories = [
+        {**c, "name": category_cache.get_name(db, c["category_id"])}
+        for c in result["categories"]
+    ]
+
+    # Trang tiếp theo lấy qua /api/products với cùng bộ lọc và next_cursor
+    return jsonify({
+        "facets": {
+            "categories": categories,
+            "price_bands": result["price_bands"],
+            "brands": result["brands"],
+        },
+        "products": products_list,
+        "total": result["total"],
+        "per_page": per_page,
+        "next_cursor": result["next_cursor"],
+    }), 200
+
+@product_bp.route('/suggest', methods=['GET'])
+def suggest_products():
+    """Typeahead completions (product titles and brands) for a search prefix"""
+    db = current_app.config['db']
+    prefix = request.args.get('q', '')
+    limit = request.args.get('limit', type=int)
+
+    if not prefix.strip():
+        return jsonify({"suggestions": []}), 200
+
+    suggestions = [
+        {key: value for key, value in suggestion.items() if key != "weight"}
+        for suggestion in suggest_index.suggest(db, prefix, limit)
+    ]
+    return jsonify({"suggestions": suggestions}), 200
+
 @product_bp.route('/search', methods=['GET'])
 def search_products():
-    """Search products by title, description, or features"""
+    """Search products by title, description, or features, ranked by relevance"""
     db = current_app.config['db']
     query = request.args.get('q', '')
     
     if not query:
         return jsonify([]), 200
-    
-    search_query = {
-        "$or": [
-            {"title": {"$regex": query, "$options": "i"}},
-            {"description": {"$regex": query, "$options": "i"}},
-            {"features": {"$regex": query, "$options": "i"}}
-        ]
+
+    next_cursor = None
+    if 'per_page' in request.args or 'cursor' in request.args:
+        per_page = page_size(request.args.get('per_page', type=int))
+        try:
+            offset = decode_cursor(request.args['cursor']).get('offset', 0) if request.args.get('cursor') else 0
+        except InvalidCursor as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Thứ hạng được tính trong bộ nhớ nên trang sau chỉ là cắt tiếp danh sách đã xếp hạng
+        ranked = search_index.search(db, query, offset + per_page + 1)
+        next_cursor = encode_cursor({"offset": offset + per_page}) if len(ranked) > offset + per_page else None
+        ranked = ranked[offset:offset + per_page]
+    else:
+        ranked = search_index.search(db, query, request.args.get('limit', type=int))
+    if not ranked:
+        return jsonify([]), 200
+
+    # Một truy vấn $in theo _id rồi sắp lại theo thứ hạng của index
+    products = {
+        str(p["_id"]): p
+        for p in db.product.find({"_id": {"$in": [ObjectId(product_id) for product_id, _ in ranked]}})
     }
-    
-    products = db.product.find(search_query)
-    return jsonify([Product.from_dict(p).to_json() for p in products]), 200
+    response = jsonify([
+        Product.from_dict(products[product_id]).to_json()
+        for product_id, _ in ranked if product_id in products
+    ])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
@@ -1,17 +1,98 @@
 from flask_socketio import emit
 from flask import current_app, request
 from rag.chat import ChatManager
+from rag.cancellation import generation_registry
 from models.chat_session import ChatSession
 from datetime import datetime
 from bson import ObjectId
+from collections import deque
 import threading
 import os
+import config
+
+
+class ClientTaskDispatcher:
+    """
+    Chạy các tin nhắn chat của mỗi client trong background task của Socket.IO.
+    Tin nhắn cùng một session được xử lý tuần tự theo thứ tự gửi; mỗi client chỉ có tối đa
+    max_concurrent session sinh câu trả lời cùng lúc và max_pending tin nhắn đang chờ.
+    """
+
+    def __init__(self, socketio, max_concurrent=1, max_pending=5):
+        self.socketio = socketio
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def submit(self, client_id, lane_key, job):
+        with self._lock:
+            state = self._clients.setdefault(client_id, {"lanes": {}, "active": set(), "pending": 0})
+            if state["pending"] >= self.max_pending:
+                return False
+            state["lanes"].setdefault(lane_key, deque()).append(job)
+            state["pending"] += 1
+            lanes_to_start = self._claim_lanes(state)
+
+        for key in lanes_to_start:
+            self.socketio.start_background_task(self._run_lane, client_id, key)
+        return True
+
+    def drop(self, client_id):
+        """Bỏ các tin nhắn còn chờ của client đã ngắt kết nối; job đang chạy sẽ tự kết thúc."""
+        with self._lock:
+            state = self._clients.pop(client_id, None)
+            if state:
+                for key, lane in state["lanes"].items():
+                    lane.clear()
+
+    def _claim_lanes(self, state):
+        claimed = []
+        for key, lane in state["lanes"].items():
+            if len(state["active"]) >= self.max_concurrent:
+                break
+            if lane and key not in state["active"]:
+                state["active"].add(key)
+                claimed.append(key)
+        return claimed
+
+    def _run_lane(self, client_id, lane_key):
+        while True:
+            with self._lock:
+                state = self._clients.get(client_id)
+                lane = state["lanes"].get(lane_key) if state else None
+                if not lane:
+                    lanes_to_start = []
+                    if state:
+                        state["active"].discard(lane_key)
+                        state["lanes"].pop(lane_key, None)
+                        lanes_to_start = self._claim_lanes(state)
+                    break
+                job = lane.popleft()
+
+            try:
+                job()
+            except Exception as e:
+                print(f"Lỗi khi xử lý tin nhắn của client {client_id}: {str(e)}")
+            finally:
+                with self._lock:
+                    state = self._clients.get(client_id)
+                    if state:
+                        state["pending"] -= 1
+
+        for key in lanes_to_start:
+            self.socketio.start_background_task(self._run_lane, client_id, key)
 
 def init_socket_handlers(socketio):
     """
     Khởi tạo các event handlers cho WebSocket
     """
     chat_manager = ChatManager()
+    dispatcher = ClientTaskDispatcher(
+        socketio,
+        max_concurrent=config.SOCKET_MAX_CONCURRENT_GENERATIONS,
+        max_pending=config.SOCKET_MAX_PENDING_MESSAGES
+    )
 
     @socketio.on('connect')
     @staticmethod
@@ -29,6 +110,10 @@ def init_socket_handlers(socketio):
     def handle_disconnect():
         client_id = request.sid
         print(f'Client ngắt kết nối! ID: {client_id}')
+        dispatcher.drop(client_id)
+        cancelled = generation_registry.cancel_owner(client_id)
+        if cancelled:
+            print(f'Đã hủy {cancelled} lượt sinh câu trả lời của client {client_id}')
         
     @socketio.on('ping')
     def handle_ping():
@@ -46,82 +131,95 @@ def init_socket_handlers(socketio):
 
     @socketio.on('chat_message')
     def handle_message(data):
-        try:
-            db = current_app.config['db']
-            message = data.get('message', '')
-            session_id = data.get('session_id')
-            user_id = data.get('user_id')
-
-            chat_session = None
-            if session_id:
+        client_id = request.sid
+        app = current_app._get_current_object()
+
+        accepted = dispatcher.submit(
+            client_id,
+            data.get('session_id'),
+            lambda: process_chat_message(app, client_id, data)
+        )
+        if not accepted:
+            emit('error', {
+                'error': 'Bạn đang gửi quá nhiều tin nhắn, vui lòng chờ phản hồi trước đó.',
+                'session_id': data.get('session_id')
+            }, to=client_id)
+
+    def process_chat_message(app, client_id, data):
+        """Chạy trong background task: sinh câu trả lời và emit về đúng room của client."""
+        with app.app_context():
+            try:
+                db = app.config['db']
+                chat_writer = app.config['chat_writer']
+                message = data.get('message', '')
+                session_id = data.get('session_id')
+                user_id = data.get('user_id')
+
+                chat_session_key = None
+                if session_id:
+                    try:
+                        chat_session_key = chat_writer.resolve_session_id(ObjectId(session_id))
+                    except Exception as e:
+                        print(f"Lỗi khi tìm session: {str(e)}")
+                
+                if not chat_session_key:
+                    chat_session = ChatSession(
+                        user_id=user_id,
+                        created_at=datetime.utcnow(),
+                        messages=[]
+                    )
+                    result = db.chat_sessions.insert_one(chat_session.to_dict())
+                    session_id = str(result.inserted_id)
+                    chat_session_key = chat_session.session_id
+                    chat_writer.remember_session(chat_session_key, result.inserted_id)
+
+                chat_writer.append(chat_session_key, 'user', message)
+
+                response_content = ""
+                cancel_token = generation_registry.start(session_id, owner=client_id)
+                
+                def stream_callback(token):
+                    nonlocal response_content
+                    response_content += token
+                    socketio.emit('chat_response', {
+                        'token': token,
+                        'session_id': session_id,
+                        'finished': False
+                    }, to=client_id)
+
                 try:
-                    session_id_obj = ObjectId(session_id) if session_id else None
-                    chat_session = db.chat_sessions.find_one({'_id': session_id_obj})
+                    full_response = chat_manager.process_message(
+                        message, 
+                        session_id,
+                        stream_callback=stream_callback,
+                        cancel_token=cancel_token,
+                        db=db
+                    )
+                    if not response_content and full_response:
+                        response_content = full_response
                 except Exception as e:
-                    print(f"Lỗi khi tìm session: {str(e)}")
-            
-            if not chat_session:
-                chat_session = ChatSession(
-                    user_id=user_id,
-                    created_at=datetime.utcnow(),
-                    messages=[]
-                ).to_dict()
-                result = db.chat_sessions.insert_one(chat_session)
-                session_id = str(result.inserted_id)
-
-            db.chat_sessions.update_one(
-                {'_id': ObjectId(session_id)},
-                {'$push': {'messages': {
-                    'role': 'user',
-                    'content': message,
-                    'timestamp': datetime.utcnow()
-                }}}
-            )
-
-            response_content = ""
-            
-            def stream_callback(token):
-                nonlocal response_content
-                response_content += token
-                emit('chat_response', {
-                    'token': token,
+                    error_message = f"Lỗi khi xử lý tin nhắn: {str(e)}"
+                    socketio.emit('error', {'error': error_message}, to=client_id)
+                    response_content = "Xin lỗi, đã xảy ra lỗi khi xử lý tin nhắn của bạn."
+
+                truncated = cancel_token.is_cancelled()
+                if truncated and not response_content:
+                    return
+
+                chat_writer.append(chat_session_key, 'assistant', response_content, truncated=truncated)
+
+                socketio.emit('chat_response', {
+                    'token': '',
                     'session_id': session_id,
-                    'finished': False
-                })
+                    'finished': True,
+                    'truncated': truncated,
+                    'full_response': response_content
+                }, to=client_id)
 
-            try:
-                full_response = chat_manager.process_message(
-                    message, 
-                    session_id,
-                    stream_callback=stream_callback
-                )
-                if not response_content and full_response:
-                    response_content = full_response
             except Exception as e:
-                error_message = f"Lỗi khi xử lý tin nhắn: {str(e)}"
-                emit('error', {'error': error_message})
-                response_content = "Xin lỗi, đã xảy ra lỗi khi xử lý tin nhắn của bạn."
-
-            db.chat_sessions.update_one(
-                {'_id': ObjectId(session_id)},
-                {'$push': {'messages': {
-                    'role': 'assistant',
-                    'content': response_content,
-                    'timestamp': datetime.utcnow()
-                }}}
-            )
-
-            emit('chat_response', {
-                'token': '',
-                'session_id': session_id,
-                'finished': True,
-                'full_response': response_content
-            })
-
-        except Exception as e:
-            error_message = f"Lỗi hệ thống: {str(e)}"
-            print(error_message)
-            emit('error', {'error': error_message})
+                error_message = f"Lỗi hệ thống: {str(e)}"
+                print(error_message)
+                socketio.emit('error', {'error': error_message}, to=client_id)
 
     @socketio.on('admin_create_vector_db')
     def handle_create_vector_db_request(data):
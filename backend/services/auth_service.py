@@ -1,9 +1,10 @@
 import jwt as PyJWT
 import datetime
-import bcrypt
 from bson import ObjectId
 import config
 from models.user import User
+from services.password_hasher import password_hasher
+from middleware.identity import user_cache
 
 class AuthService:
     def __init__(self, db):
@@ -40,6 +41,13 @@ class AuthService:
         if not self._verify_password(password, user.password):
             raise ValueError("Invalid email or password")
         
+        if password_hasher.needs_rehash(user.password):
+            self.db.users.update_one(
+                {"_id": ObjectId(user.id), "password": user.password},
+                {"$set": {"password": self._hash_password(password)}}
+            )
+            user_cache.invalidate(user.id)
+        
         token = self.generate_token(user)
         
         return user, token
@@ -65,10 +73,10 @@ class AuthService:
         return PyJWT.encode(payload, config.JWT_SECRET_KEY, algorithm='HS256')
     
     def _hash_password(self, password):
-        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        return password_hasher.hash(password)
     
     def _verify_password(self, password, hashed_password):
-        return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+        return password_hasher.verify(password, hashed_password)
     
     def validate_token(self, token):
         try:
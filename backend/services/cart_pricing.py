@@ -0,0 +1,154 @@
+import threading
+import time
+from bson import ObjectId
+import config
+from models.product import parse_price_vnd
+from services.catalog_version import catalog_version
+
+PRODUCT_FIELDS = {"title": 1, "price": 1, "price_vnd": 1, "stock_count": 1, "image_path": 1, "category_id": 1}
+
+
+class ProductLookupCache:
+    """
+    Short-lived copies of the product fields carts need (price, stock, title).
+
+    `get_many()` answers from memory and loads every missing id with one `$in` query.
+    Entries live CART_PRODUCT_CACHE_TTL seconds and are dropped on catalog version
+    changes; checkout passes fresh=True to always read current stock.
+    """
+
+    def __init__(self, ttl_seconds=None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.CART_PRODUCT_CACHE_TTL
+        self._lock = threading.Lock()
+        self._products = {}
+
+    def on_catalog_change(self, version, category_ids):
+        with self._lock:
+            self._products.clear()
+
+    def get_many(self, db, product_ids, fresh=False):
+        """Return {product_id: product document} for the ids that exist."""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for product_id in set(product_ids):
+                cached = None if fresh else self._products.get(product_id)
+                if cached and cached[1] > now:
+                    found[product_id] = cached[0]
+                else:
+                    missing.append(product_id)
+
+        object_ids = [ObjectId(product_id) for product_id in missing if ObjectId.is_valid(product_id)]
+        if object_ids:
+            loaded = {str(doc["_id"]): doc for doc in db.product.find({"_id": {"$in": object_ids}}, PRODUCT_FIELDS)}
+            with self._lock:
+                for product_id, doc in loaded.items():
+                    self._products[product_id] = (doc, now + self.ttl_seconds)
+            found.update(loaded)
+        return found
+
+
+product_lookup = ProductLookupCache()
+catalog_version.subscribe(product_lookup.on_catalog_change)
+
+
+def price_cart(db, cart, fresh=False):
+    """
+    Price every cart item against the current catalog, in integer VND.
+
+    Returns {"items": [...], "subtotal_vnd", "total_items", "has_issues"}. Each item
+    carries the current title/price/stock plus flags: price_changed (the price stored
+    when it was added differs), unavailable (product deleted), insufficient_stock.
+    """
+    products = product_lookup.get_many(db, [item.product_id for item in cart.items], fresh=fresh)
+
+    priced_items = []
+    subtotal_vnd = 0
+    has_issues = False
+    for item in cart.items:
+        product = products.get(item.product_id)
+        stored_price_vnd = parse_price_vnd(item.price)
+        priced = {
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "title": item.title,
+            "image_path": item.image_path,
+            "price": item.price,
+            "unit_price_vnd": stored_price_vnd,
+            "line_total_vnd": 0,
+            "available_stock": 0,
+            "price_changed": False,
+            "unavailable": product is None,
+            "insufficient_stock": False,
+        }
+        if product is not None:
+            unit_price_vnd = product.get("price_vnd")
+            if unit_price_vnd is None:
+                unit_price_vnd = parse_price_vnd(product.get("price"))
+            stock = product.get("stock_count", 0)
+            priced.update({
+                "title": product.get("title", item.title),
+                "image_path": product.get("image_path", item.image_path),
+                "price": product.get("price"),
+                "unit_price_vnd": unit_price_vnd,
+                "available_stock": stock,
+                "price_changed": stored_price_vnd != unit_price_vnd,
+                "insufficient_stock": stock < item.quantity,
+                "category_id": product.get("category_id"),
+            })
+            if unit_price_vnd is None:
+                priced["unavailable"] = True
+            else:
+                priced["line_total_vnd"] = unit_price_vnd * item.quantity
+                subtotal_vnd += priced["line_total_vnd"]
+
+        has_issues = has_issues or priced["unavailable"] or priced["insufficient_stock"] or priced["price_changed"]
+        priced_items.append(priced)
+
+    return {
+        "items": priced_items,
+        "subtotal_vnd": subtotal_vnd,
+        "total_items": sum(item.quantity for item in cart.items),
+        "has_issues": has_issues,
+    }
+
+
+def acknowledge_price_changes(db, cart, pricing=None):
+    """
+    Store the current price in the cart items flagged price_changed, with one update,
+    so the flag clears. Only called when the client confirms it has shown the new
+    prices (POST /api/cart/acknowledge-prices); reads never write. Returns the number
+    of items updated.
+    """
+    pricing = pricing or price_cart(db, cart)
+    changed = [priced for priced in pricing["items"] if priced["price_changed"] and not priced["unavailable"]]
+    if not changed or not cart.id:
+        return 0
+    db.carts.update_one(
+        {"_id": ObjectId(cart.id)},
+        {"$set": {f"items.$[item{index}].price": priced["price"] for index, priced in enumerate(changed)}},
+        array_filters=[{f"item{index}.product_id": priced["product_id"]} for index, priced in enumerate(changed)]
+    )
+    prices = {priced["product_id"]: priced["price"] for priced in changed}
+    for item in cart.items:
+        if item.product_id in prices:
+            item.price = prices[item.product_id]
+    return len(changed)
+
+
+def priced_cart_json(db, cart):
+    """The cart as JSON, with items and totals built from price_cart() only (stored prices are not parsed again)."""
+    pricing = price_cart(db, cart)
+    return {
+        "id": cart.id,
+        "user_id": cart.user_id,
+        "session_id": cart.session_id,
+        "items": pricing["items"],
+        "created_at": cart.created_at.isoformat(),
+        "updated_at": cart.updated_at.isoformat(),
+        "is_anonymous": cart.is_anonymous,
+        "total_items": pricing["total_items"],
+        "total": str(pricing["subtotal_vnd"]),
+        "total_vnd": pricing["subtotal_vnd"],
+        "has_issues": pricing["has_issues"],
+    }
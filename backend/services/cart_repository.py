@@ -0,0 +1,199 @@
+import uuid
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import config
+from models.cart import Cart, CartItem
+
+
+class CartRepository:
+    """
+    Cart mutations as atomic Mongo updates instead of whole-document rewrites.
+
+    Items are changed with positional `$inc` / `$set`, `$push` and `$pull` through
+    `find_one_and_update(return_document=AFTER)`, so the app and the chatbot can edit
+    the same cart concurrently without overwriting each other, and each call returns
+    the cart as it is after the change. Every mutation is one round trip, except adding
+    a product that is not in the cart yet (a guarded `$push` after the `$inc` misses).
+    Methods return a `Cart`, or None when the cart (or the item, for item-level
+    changes) does not exist.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def owner_filter(user_id=None, session_id=None):
+        if user_id:
+            return {"user_id": user_id}
+        if session_id:
+            return {"session_id": session_id}
+        return None
+
+    def find(self, user_id=None, session_id=None):
+        owner = self.owner_filter(user_id, session_id)
+        cart_data = self.db.carts.find_one(owner) if owner else None
+        return Cart.from_dict(cart_data) if cart_data else None
+
+    def get_or_create(self, user_id=None, session_id=None):
+        """Return the owner's cart, creating an empty one (and a session id if needed) in the same round trip."""
+        session_id = session_id or str(uuid.uuid4())
+        new_cart = self._new_cart(user_id, session_id)
+        cart_data = self.db.carts.find_one_and_update(
+            self.owner_filter(user_id, session_id),
+            {"$setOnInsert": new_cart.to_dict()},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return Cart.from_dict(cart_data)
+
+    def add_item(self, product_id, quantity, price=None, title=None, image_path=None, user_id=None, session_id=None):
+        """Add quantity of a product, creating the cart if needed. Returns the updated cart."""
+        session_id = session_id or str(uuid.uuid4())
+        owner = self.owner_filter(user_id, session_id)
+        product_id = str(product_id)
+        item = CartItem(product_id, quantity, price, title, image_path)
+
+        # Thường chỉ một lượt: tăng số lượng nếu đã có, nếu chưa thì push; chỉ lặp lại khi
+        # một request khác thêm cùng sản phẩm hoặc tạo giỏ chen vào giữa các bước
+        for _ in range(3):
+            cart_data = self.db.carts.find_one_and_update(
+                {**owner, "items.product_id": product_id},
+                {"$inc": {"items.$.quantity": quantity}, "$set": self._touch_fields(user_id)},
+                return_document=ReturnDocument.AFTER
+            )
+            if cart_data:
+                return Cart.from_dict(cart_data)
+
+            cart_data = self.db.carts.find_one_and_update(
+                {**owner, "items.product_id": {"$ne": product_id}},
+                {"$push": {"items": item.to_dict()}, "$set": self._touch_fields(user_id)},
+                return_document=ReturnDocument.AFTER
+            )
+            if cart_data:
+                return Cart.from_dict(cart_data)
+
+            cart = self._new_cart(user_id, session_id, items=[item], id=ObjectId())
+            existing = self.db.carts.find_one_and_update(
+                owner,
+                {"$setOnInsert": cart.to_dict()},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+            if existing is None:
+                return cart
+        return None
+
+    def set_quantity(self, product_id, quantity, user_id=None, session_id=None):
+        if quantity == 0:
+            return self.remove_item(product_id, user_id, session_id)
+        owner = self.owner_filter(user_id, session_id)
+        if not owner:
+            return None
+        cart_data = self.db.carts.find_one_and_update(
+            {**owner, "items.product_id": str(product_id)},
+            {"$set": {"items.$.quantity": quantity, **self._touch_fields(user_id)}},
+            return_document=ReturnDocument.AFTER
+        )
+        return Cart.from_dict(cart_data) if cart_data else None
+
+    def remove_item(self, product_id, user_id=None, session_id=None):
+        owner = self.owner_filter(user_id, session_id)
+        if not owner:
+            return None
+        cart_data = self.db.carts.find_one_and_update(
+            {**owner, "items.product_id": str(product_id)},
+            {"$pull": {"items": {"product_id": str(product_id)}}, "$set": self._touch_fields(user_id)},
+            return_document=ReturnDocument.AFTER
+        )
+        return Cart.from_dict(cart_data) if cart_data else None
+
+    def clear(self, user_id=None, session_id=None):
+        owner = self.owner_filter(user_id, session_id)
+        if not owner:
+            return None
+        cart_data = self.db.carts.find_one_and_update(
+            owner,
+            {"$set": {"items": [], **self._touch_fields(user_id)}},
+            return_document=ReturnDocument.AFTER
+        )
+        return Cart.from_dict(cart_data) if cart_data else None
+
+    def merge_anonymous(self, user_id, session_id):
+        """
+        Fold the anonymous cart of session_id into the user's cart. Returns (cart, converted)
+        where converted is True when the anonymous cart simply became the user's cart, or
+        (None, False) when there is no anonymous cart.
+
+        Converting relies on the unique index on carts.user_id: if the user already has a
+        cart it fails with a duplicate key and the items are merged instead. The merged item
+        list is written with one update, guarded by the items it was computed from, and
+        records the anonymous cart's id so a merge interrupted before the anonymous cart is
+        deleted is not applied twice.
+        """
+        anonymous = {"session_id": session_id, "is_anonymous": True}
+        try:
+            cart_data = self.db.carts.find_one_and_update(
+                anonymous,
+                {"$set": {"user_id": user_id, "is_anonymous": False, "updated_at": datetime.utcnow()},
+                 "$unset": {"expiry_date": ""}},
+                return_document=ReturnDocument.AFTER
+            )
+            return (Cart.from_dict(cart_data), True) if cart_data else (None, False)
+        except DuplicateKeyError:
+            pass
+
+        anon_cart_data = self.db.carts.find_one(anonymous)
+        if not anon_cart_data:
+            return None, False
+        anon_cart_id = str(anon_cart_data["_id"])
+
+        for _ in range(3):
+            user_cart_data = self.db.carts.find_one({"user_id": user_id})
+            if not user_cart_data:
+                self.get_or_create(user_id=user_id)
+                continue
+            if user_cart_data.get("merged_cart_id") != anon_cart_id:
+                user_cart_data = self.db.carts.find_one_and_update(
+                    {"_id": user_cart_data["_id"], "items": user_cart_data.get("items", [])},
+                    {"$set": {
+                        "items": self._merged_items(user_cart_data.get("items", []), anon_cart_data.get("items", [])),
+                        "merged_cart_id": anon_cart_id,
+                        **self._touch_fields(user_id)
+                    }},
+                    return_document=ReturnDocument.AFTER
+                )
+                if not user_cart_data:
+                    # Giỏ vừa bị sửa bởi request khác: đọc lại và gộp lại
+                    continue
+            self.db.carts.delete_one({"_id": anon_cart_data["_id"]})
+            return Cart.from_dict(user_cart_data), False
+        return None, False
+
+    @staticmethod
+    def _merged_items(items, added):
+        merged = [dict(item) for item in items]
+        by_product = {item["product_id"]: item for item in merged}
+        for item in added:
+            if item["product_id"] in by_product:
+                by_product[item["product_id"]]["quantity"] += item["quantity"]
+            else:
+                merged.append(dict(item))
+                by_product[item["product_id"]] = merged[-1]
+        return merged
+
+    @classmethod
+    def _new_cart(cls, user_id, session_id, items=None, id=None):
+        """A cart to insert, with the same updated_at / expiry_date a write would set."""
+        return Cart(id=id, user_id=user_id, session_id=session_id, items=items,
+                    is_anonymous=(user_id is None), **cls._touch_fields(user_id))
+
+    @staticmethod
+    def _touch_fields(user_id):
+        now = datetime.utcnow()
+        fields = {"updated_at": now}
+        if not user_id:
+            # Giỏ ẩn danh hết hạn sau ANONYMOUS_CART_EXPIRY ngày không hoạt động (TTL index trên expiry_date)
+            fields["expiry_date"] = now + timedelta(days=config.ANONYMOUS_CART_EXPIRY)
+        return fields
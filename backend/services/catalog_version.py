@@ -0,0 +1,75 @@
+import logging
+import threading
+import time
+from pymongo import ReturnDocument
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogVersion:
+    """
+    Monotonic version of the product catalog.
+
+    Every product or category write calls `bump()`, which increments the counter in
+    `catalog_meta` and notifies in-process subscribers (snapshots, indexes, caches) with
+    the affected category ids. `current()` answers from memory and re-reads Mongo at most
+    every CATALOG_VERSION_REFRESH_SECONDS to notice writes made by other processes.
+    """
+
+    def __init__(self, meta_id="catalog", refresh_seconds=None):
+        self.meta_id = meta_id
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else config.CATALOG_VERSION_REFRESH_SECONDS
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """listener(version, category_ids) — category_ids is None when the whole catalog may have changed."""
+        self._listeners.append(listener)
+
+    def current(self, db):
+        with self._lock:
+            if self._version is not None and time.monotonic() - self._checked_at < self.refresh_seconds:
+                return self._version
+
+        meta = db.catalog_meta.find_one({"_id": self.meta_id}, {"version": 1})
+        version = meta["version"] if meta else 0
+        with self._lock:
+            changed = self._version is not None and version != self._version
+            self._version = version
+            self._checked_at = time.monotonic()
+
+        if changed:
+            self._notify(version, None)
+        return version
+
+    def bump(self, db, category_ids=None):
+        """Record a catalog write. category_ids lists the categories whose content changed, if known."""
+        meta = db.catalog_meta.find_one_and_update(
+            {"_id": self.meta_id},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        with self._lock:
+            self._version = meta["version"]
+            self._checked_at = time.monotonic()
+
+        ids = None if category_ids is None else {str(category_id) for category_id in category_ids if category_id}
+        self._notify(meta["version"], ids)
+        return meta["version"]
+
+    def _notify(self, version, category_ids):
+        for listener in self._listeners:
+            try:
+                listener(version, category_ids)
+            except Exception as e:
+                logger.error(f"Catalog version listener failed: {e}")
+
+
+catalog_version = CatalogVersion()
+# Tồn kho đổi theo từng đơn hàng nên có bộ đếm riêng: chỉ ETag của các response chứa
+# số tồn kho đổi theo, snapshot / index / cache của catalog thì không bị dựng lại
+stock_version = CatalogVersion("stock")
@@ -0,0 +1,52 @@
+import threading
+import time
+from bson import ObjectId
+import config
+
+
+class CategoryCache:
+    """
+    In-process copy of the `categorie` collection.
+
+    Categories are few and rarely change, so product listings resolve category names
+    from memory instead of one `find_one` per product. category_routes calls
+    `invalidate()` after every write; the TTL bounds staleness across processes.
+    """
+
+    def __init__(self, ttl_seconds=None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.CATEGORY_CACHE_TTL
+        self._lock = threading.Lock()
+        self._categories = None
+        self._loaded_at = 0
+
+    def all(self, db):
+        """Return {category_id: category document} for every category."""
+        with self._lock:
+            if self._categories is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+                return self._categories
+
+        categories = {str(doc["_id"]): doc for doc in db.categorie.find()}
+        with self._lock:
+            self._categories = categories
+            self._loaded_at = time.monotonic()
+        return categories
+
+    def get(self, db, category_id):
+        """Return the category document or None. Falls back to Mongo for ids not in the cached copy."""
+        category = self.all(db).get(str(category_id))
+        if category is None:
+            category = db.categorie.find_one({"_id": ObjectId(category_id)})
+            if category:
+                self.invalidate()
+        return category
+
+    def get_name(self, db, category_id, default="N/A"):
+        category = self.all(db).get(str(category_id)) if category_id else None
+        return category.get("name", default) if category else default
+
+    def invalidate(self):
+        with self._lock:
+            self._categories = None
+
+
+category_cache = CategoryCache()
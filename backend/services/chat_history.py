@@ -0,0 +1,201 @@
+from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import config
+
+DUPLICATE_KEY = 11000
+
+
+class ChatHistory:
+    """
+    Bucketed storage for chat messages.
+
+    Messages live in `chat_message_buckets`, CHAT_BUCKET_SIZE per document and keyed
+    by (session_id, bucket). Every message carries a per-session sequence number `seq`,
+    so bucket = seq // CHAT_BUCKET_SIZE and any page of history touches at most a
+    couple of bucket documents however long the conversation is. The session document
+    only keeps `message_count`.
+    """
+
+    def __init__(self, db, bucket_size=None):
+        self.db = db
+        self.bucket_size = bucket_size or config.CHAT_BUCKET_SIZE
+
+    def load_session(self, query):
+        """
+        Find a session document without its message history, restoring it from the cold
+        archive or migrating legacy embedded messages first when needed.
+        """
+        chat_data = self.db.chat_sessions.find_one(query, {"messages": 0})
+        if chat_data and chat_data.get("archived"):
+            self.restore_archived([chat_data["session_id"]])
+            for field in ("archived", "archived_at", "archive_path"):
+                chat_data.pop(field, None)
+        if chat_data and "message_count" not in chat_data:
+            chat_data["message_count"] = self.migrate_legacy(chat_data["session_id"])
+        return chat_data
+
+    def restore_archived(self, session_ids):
+        """Restore those of session_ids that were archived since they were loaded (one query when none were)."""
+        from services.lifecycle import restore_session
+        for chat_data in self.db.chat_sessions.find(
+            {"session_id": {"$in": list(session_ids)}, "archived": True}, {"session_id": 1}
+        ):
+            restore_session(self.db, chat_data["session_id"])
+
+    def migrate_legacy(self, session_id):
+        """Move a session's embedded `messages` array into buckets and return its message count."""
+        chat_data = self.db.chat_sessions.find_one(
+            {"session_id": session_id},
+            {"messages": 1, "message_count": 1, "expiry_date": 1}
+        )
+        if not chat_data:
+            return 0
+        if "message_count" in chat_data:
+            return chat_data["message_count"]
+
+        messages = []
+        for seq, message in enumerate(chat_data.get("messages", [])):
+            messages.append({**message, "seq": seq})
+
+        operations = []
+        for bucket, bucket_messages in self._group_by_bucket(messages).items():
+            fields = {
+                "messages": bucket_messages,
+                "count": len(bucket_messages),
+                "updated_at": bucket_messages[-1].get("timestamp", datetime.utcnow())
+            }
+            if chat_data.get("expiry_date"):
+                fields["expiry_date"] = chat_data["expiry_date"]
+            operations.append(UpdateOne(
+                {"session_id": session_id, "bucket": bucket},
+                {
+                    "$set": fields,
+                    "$setOnInsert": {"created_at": bucket_messages[0].get("timestamp", datetime.utcnow())}
+                },
+                upsert=True
+            ))
+        if operations:
+            self.db.chat_message_buckets.bulk_write(operations, ordered=False)
+
+        self.db.chat_sessions.update_one(
+            {"_id": chat_data["_id"]},
+            {"$set": {"message_count": len(messages)}, "$unset": {"messages": ""}}
+        )
+        return len(messages)
+
+    def bucket_operations(self, session_id, messages, expiry_date=None):
+        """
+        Upserts appending already-sequenced messages to their buckets. Buckets of an
+        anonymous session copy its expiry_date so the TTL index removes them together.
+
+        Each upsert only matches a bucket that does not hold the first message it pushes
+        yet, so replaying the same operations (a retried flush) pushes nothing twice.
+        """
+        operations = []
+        for bucket, bucket_messages in self._group_by_bucket(messages).items():
+            on_insert = {"created_at": bucket_messages[0]["timestamp"]}
+            if expiry_date:
+                on_insert["expiry_date"] = expiry_date
+            operations.append(UpdateOne(
+                {"session_id": session_id, "bucket": bucket, "messages.seq": {"$ne": bucket_messages[0]["seq"]}},
+                {
+                    "$push": {"messages": {"$each": bucket_messages}},
+                    "$inc": {"count": len(bucket_messages)},
+                    "$set": {"updated_at": bucket_messages[-1]["timestamp"]},
+                    "$setOnInsert": on_insert
+                },
+                upsert=True
+            ))
+        return operations
+
+    def write_buckets(self, operations):
+        """
+        Run bucket_operations. An already-applied upsert no longer matches and tries to
+        insert a second (session_id, bucket) document; that duplicate key is ignored.
+        """
+        try:
+            self.db.chat_message_buckets.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if e.details.get("writeConcernErrors") or any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+
+    def get_range(self, session_id, start, end, pending=None):
+        """Messages with start <= seq < end, oldest first. `pending` are not-yet-flushed messages."""
+        if end <= start:
+            return []
+
+        by_seq = {}
+        first_bucket = start // self.bucket_size
+        last_bucket = (end - 1) // self.bucket_size
+        buckets = self.db.chat_message_buckets.find(
+            {"session_id": session_id, "bucket": {"$gte": first_bucket, "$lte": last_bucket}},
+            {"messages": 1, "_id": 0}
+        )
+        for bucket in buckets:
+            for message in bucket.get("messages", []):
+                if start <= message["seq"] < end:
+                    by_seq[message["seq"]] = message
+
+        # Tin nhắn chờ ghi đã có seq, nên bản đã flush và bản trong bộ đệm không bị nhân đôi
+        for message in pending or []:
+            if start <= message["seq"] < end:
+                by_seq[message["seq"]] = message
+
+        return [by_seq[seq] for seq in sorted(by_seq)]
+
+    def get_since(self, session_id, since_seq=None, since_ts=None, limit=None, pending=None):
+        """
+        Messages newer than `since_seq` (or newer than `since_ts`), oldest first, at most `limit`.
+        The $filter runs in Mongo so only the new messages leave the server.
+        """
+        limit = max(1, min(limit or config.CHAT_PAGE_SIZE_MAX, config.CHAT_PAGE_SIZE_MAX))
+
+        match = {"session_id": session_id}
+        if since_seq is not None:
+            match["bucket"] = {
+                "$gte": (since_seq + 1) // self.bucket_size,
+                "$lte": (since_seq + limit) // self.bucket_size
+            }
+            condition = {"$gt": ["$$message.seq", since_seq]}
+        else:
+            match["updated_at"] = {"$gt": since_ts}
+            condition = {"$gt": ["$$message.timestamp", since_ts]}
+
+        buckets = self.db.chat_message_buckets.aggregate([
+            {"$match": match},
+            {"$sort": {"bucket": 1}},
+            {"$project": {
+                "_id": 0,
+                "messages": {"$filter": {"input": "$messages", "as": "message", "cond": condition}}
+            }}
+        ])
+
+        by_seq = {}
+        for bucket in buckets:
+            for message in bucket["messages"]:
+                by_seq[message["seq"]] = message
+        for message in pending or []:
+            if (since_seq is not None and message["seq"] > since_seq) or \
+                    (since_seq is None and message["timestamp"] > since_ts):
+                by_seq[message["seq"]] = message
+
+        return [by_seq[seq] for seq in sorted(by_seq)[:limit]]
+
+    def get_page(self, session_id, message_count, before=None, limit=None, pending=None):
+        """
+        Return (messages, before_cursor) for the page ending just before `before`
+        (the latest page when `before` is None). before_cursor is None on the oldest page.
+        """
+        limit = max(1, min(limit or config.CHAT_PAGE_SIZE, config.CHAT_PAGE_SIZE_MAX))
+        end = message_count if before is None else max(0, min(before, message_count))
+        start = max(0, end - limit)
+        messages = self.get_range(session_id, start, end, pending)
+        return messages, (start if start > 0 else None)
+
+    def _group_by_bucket(self, messages):
+        grouped = {}
+        for message in messages:
+            grouped.setdefault(message["seq"] // self.bucket_size, []).append(message)
+        return grouped
@@ -0,0 +1,326 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+import config
+from services.chat_history import ChatHistory
+
+logger = logging.getLogger(__name__)
+
+LEASE_ID = "chat_writer"
+
+
+class ChatWriter:
+    """
+    Write-behind buffer for chat messages.
+
+    Appends are queued in memory and flushed with one `bulk_write` to the message
+    buckets (and one to `chat_sessions` for `message_count`) every
+    CHAT_WRITE_FLUSH_INTERVAL_MS or as soon as CHAT_WRITE_MAX_BATCH messages are
+    waiting, so the request path never waits on Mongo. Pending messages stay visible
+    to `read_page` until the flush that persists them has completed; a failed flush
+    is retried with the same operations, which never push a message twice.
+
+    Sequence numbers are handed out by this process from a per-session counter seeded
+    from `message_count`, so a database must be written by a single app process. The
+    first append takes a lease in `process_leases` (renewed by the flusher, released
+    on close); while another live process holds it appends raise ChatWriterBusy.
+    """
+
+    def __init__(self, db, flush_interval_ms=None, max_batch=None, known_sessions_size=10000):
+        self.db = db
+        self.history = ChatHistory(db)
+        self.flush_interval = (flush_interval_ms or config.CHAT_WRITE_FLUSH_INTERVAL_MS) / 1000.0
+        self.max_batch = max_batch or config.CHAT_WRITE_MAX_BATCH
+        self.known_sessions_size = known_sessions_size
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._pending_count = 0
+        self._inflight = []
+        self._retry = []
+        self._sessions = OrderedDict()
+        self._doc_ids = OrderedDict()
+        self._wake = threading.Event()
+        self._closed = False
+
+        self.lease_seconds = config.CHAT_WRITER_LEASE_SECONDS
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lease_lock = threading.Lock()
+        self._lease_expires = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, session_id, role, content, truncated=False):
+        self._ensure_lease()
+        message = {
+            "role": role,
+            "content": content,
+            # Mongo lưu datetime ở độ chính xác millisecond; làm tròn trước để bản chờ ghi và bản đã ghi giống hệt nhau
+            "timestamp": _truncate_to_millis(datetime.utcnow())
+        }
+        if truncated:
+            message["truncated"] = True
+
+        with self._session_state(session_id) as state:
+            if state is None:
+                raise ValueError(f"Chat session not found: {session_id}")
+            if self._closed:
+                raise RuntimeError("ChatWriter is closed")
+            message["seq"] = state["message_count"]
+            state["message_count"] += 1
+            self._pending.setdefault(session_id, []).append(message)
+            self._pending_count += 1
+            should_wake = self._pending_count >= self.max_batch
+
+        if should_wake:
+            self._wake.set()
+        return message
+
+    def pending_messages(self, session_id):
+        """Messages for session_id that have been accepted but may not be in Mongo yet, oldest first."""
+        with self._lock:
+            return self._buffered(session_id)
+
+    def message_count(self, session_id):
+        """Number of messages in the session, including pending ones."""
+        with self._session_state(session_id) as state:
+            return state["message_count"] if state else 0
+
+    def read_page(self, session_id, before=None, limit=None):
+        """Latest page of messages (or the page before `before`), with this process's pending writes."""
+        return self.history.get_page(
+            session_id,
+            self.message_count(session_id),
+            before=before,
+            limit=limit,
+            pending=self.pending_messages(session_id)
+        )
+
+    def read_since(self, session_id, since_seq=None, since_ts=None, limit=None):
+        """Messages newer than since_seq / since_ts, including this process's pending writes."""
+        return self.history.get_since(
+            session_id,
+            since_seq=since_seq,
+            since_ts=since_ts,
+            limit=limit,
+            pending=self.pending_messages(session_id)
+        )
+
+    def remember_session(self, session_id, doc_id=None, message_count=0, expiry_date=None):
+        with self._lock:
+            self._remember(session_id, doc_id, message_count, expiry_date)
+
+    def session_exists(self, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                self._sessions.move_to_end(session_id)
+                return True
+
+        chat_data = self.history.load_session({"session_id": session_id})
+        if not chat_data:
+            return False
+        self.remember_session(session_id, chat_data["_id"], chat_data["message_count"], chat_data.get("expiry_date"))
+        return True
+
+    @contextmanager
+    def _session_state(self, session_id):
+        """Hold _lock and yield the cached state of session_id, or yield None (unlocked) if it does not exist."""
+        while True:
+            if not self.session_exists(session_id):
+                yield None
+                return
+            with self._lock:
+                state = self._sessions.get(session_id)
+                if state is not None:
+                    yield state
+                    return
+            # Phiên vừa bị _remember đồng thời đẩy khỏi LRU giữa hai lần lấy lock: nạp lại
+
+    def resolve_session_id(self, doc_id):
+        """Map a chat_sessions _id (as used by the Socket.IO client) to its session_id."""
+        key = str(doc_id)
+        with self._lock:
+            session_id = self._doc_ids.get(key)
+            if session_id in self._sessions:
+                self._sessions.move_to_end(session_id)
+                return session_id
+
+        chat_data = self.history.load_session({"_id": doc_id})
+        if not chat_data:
+            return None
+        self.remember_session(
+            chat_data["session_id"], chat_data["_id"], chat_data["message_count"], chat_data.get("expiry_date")
+        )
+        return chat_data["session_id"]
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending and not self._retry:
+                    return 0
+                # Lô ghi lỗi lần trước đi trước và giữ nguyên thao tác, để bộ lọc bucket chống ghi trùng
+                batches = self._retry + ([self._pending] if self._pending else [])
+                self._inflight = batches
+                self._retry = []
+                self._pending = OrderedDict()
+                self._pending_count = 0
+                expiry_dates = {
+                    session_id: self._sessions[session_id]["expiry_date"]
+                    for batch in batches for session_id in batch if session_id in self._sessions
+                }
+
+            bucket_operations = []
+            last_messages = {}
+            for batch in batches:
+                for session_id, messages in batch.items():
+                    bucket_operations.extend(
+                        self.history.bucket_operations(session_id, messages, expiry_dates.get(session_id))
+                    )
+                    last_messages[session_id] = messages[-1]
+            session_operations = [
+                UpdateOne(
+                    {"session_id": session_id},
+                    {
+                        "$max": {"message_count": message["seq"] + 1},
+                        "$set": {"updated_at": message["timestamp"]}
+                    }
+                )
+                for session_id, message in last_messages.items()
+            ]
+
+            try:
+                self._ensure_lease()
+                # Phiên có thể đã bị CLI lưu trữ ở process khác sau khi được nạp vào bộ nhớ
+                self.history.restore_archived(last_messages)
+                self.history.write_buckets(bucket_operations)
+                self.db.chat_sessions.bulk_write(session_operations, ordered=False)
+            except Exception as e:
+                logger.error(f"Chat writer flush failed, {len(last_messages)} sessions requeued: {e}")
+                with self._lock:
+                    self._retry = batches
+                    self._inflight = []
+                raise
+
+            with self._lock:
+                self._inflight = []
+            return sum(len(messages) for batch in batches for messages in batch.values())
+
+    def close(self):
+        """Stop the background flusher, persist everything still buffered and release the lease."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=10)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Chat writer final flush failed")
+        if self._lease_expires:
+            try:
+                self.db.process_leases.delete_one({"_id": LEASE_ID, "owner": self._owner})
+            except Exception:
+                logger.exception("Could not release the chat writer lease")
+
+    def _ensure_lease(self):
+        """Take or renew the single-writer lease; raises ChatWriterBusy if another process holds it."""
+        if self._lease_expires - time.monotonic() > self.lease_seconds / 2:
+            return
+        with self._lease_lock:
+            now = time.monotonic()
+            if self._lease_expires - now > self.lease_seconds / 2:
+                return
+            renewing = self._lease_expires > now
+            moment = datetime.utcnow()
+            try:
+                self.db.process_leases.update_one(
+                    {"_id": LEASE_ID, "$or": [{"owner": self._owner}, {"expires_at": {"$lt": moment}}]},
+                    {"$set": {"owner": self._owner, "expires_at": moment + timedelta(seconds=self.lease_seconds)}},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                holder = self.db.process_leases.find_one({"_id": LEASE_ID}) or {}
+                self._lease_expires = 0.0
+                raise ChatWriterBusy(holder.get("owner"))
+
+            if not renewing:
+                with self._lock:
+                    if not self._buffered_count():
+                        # Process khác có thể đã ghi khi ta chưa giữ lease: đọc lại bộ đếm từ Mongo
+                        self._sessions.clear()
+                        self._doc_ids.clear()
+            self._lease_expires = now + self.lease_seconds
+
+    def _buffered(self, session_id):
+        messages = []
+        for batch in self._retry + self._inflight:
+            messages.extend(batch.get(session_id, []))
+        return messages + list(self._pending.get(session_id, []))
+
+    def _buffered_count(self):
+        return self._pending_count + sum(
+            len(messages) for batch in self._retry + self._inflight for messages in batch.values()
+        )
+
+    def _remember(self, session_id, doc_id, message_count, expiry_date=None):
+        state = self._sessions.get(session_id)
+        if state:
+            # Không bao giờ lùi bộ đếm: có thể còn tin nhắn chờ ghi với seq lớn hơn giá trị trong Mongo
+            state["message_count"] = max(state["message_count"], message_count)
+            self._sessions.move_to_end(session_id)
+        else:
+            pending = self._buffered(session_id)
+            if pending:
+                message_count = max(message_count, pending[-1]["seq"] + 1)
+            self._sessions[session_id] = {
+                "doc_id": str(doc_id) if doc_id else None,
+                "message_count": message_count,
+                "expiry_date": expiry_date
+            }
+
+        if doc_id is not None:
+            self._doc_ids[str(doc_id)] = session_id
+
+        while len(self._sessions) > self.known_sessions_size:
+            evicted_id, evicted = self._sessions.popitem(last=False)
+            self._doc_ids.pop(evicted["doc_id"], None)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            with self._lock:
+                closed = self._closed
+            try:
+                if self._lease_expires and not closed:
+                    self._ensure_lease()
+                self.flush()
+            except Exception:
+                logger.exception("Chat writer background flush failed")
+            if closed:
+                return
+
+
+class ChatWriterBusy(RuntimeError):
+    """Another app process holds the chat writer lease for this database."""
+
+    def __init__(self, owner):
+        super().__init__(f"Chat history is being written by another process ({owner}); run a single app process per database")
+        self.owner = owner
+
+
+def _truncate_to_millis(value):
+    return value.replace(microsecond=value.microsecond - value.microsecond % 1000)
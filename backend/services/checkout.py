@@ -0,0 +1,296 @@
+import logging
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from models.order import Order, OrderItem
+from services.cart_pricing import price_cart
+from services.catalog_version import stock_version
+from services.recommendations import co_purchase_recorder
+from services.sales_rollups import record_order, record_status_change, refresh_low_stock, reversal_sign
+from services.stock_reservations import holder_key
+from services.suggest_index import suggest_index
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutError(Exception):
+    """A checkout the client has to fix (missing product, stock, cart already ordered)."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def supports_transactions(client):
+    """True when the deployment is a replica set or sharded cluster (standalone mongod has no transactions)."""
+    try:
+        hello = client.admin.command("hello")
+    except Exception:
+        return False
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+
+_transaction_support = {}  # id(MongoClient) -> bool, hỏi server một lần
+
+
+class CheckoutService:
+    """
+    Turns a cart into an order, and moves orders in and out of cancelled / refunded
+    together with their stock.
+
+    Every product is read with one `$in` (price_cart(fresh=True)); stock is then taken
+    with conditional updates (units not held by other carts, plus this cart's own stock
+    hold, must cover qty) so two orders can never both take the last unit, and the
+    cart's holds are consumed in the same update. On a replica set the stock updates
+    (one bulk_write), the hold, order and cart deletes commit in one transaction,
+    retried by with_transaction on write conflicts. A standalone mongod has no
+    transactions, so there each item is taken separately and compensated if a later
+    step fails.
+    """
+
+    def __init__(self, client, db):
+        self.client = client
+        self.db = db
+
+    def use_transactions(self):
+        key = id(self.client)
+        if key not in _transaction_support:
+            _transaction_support[key] = supports_transactions(self.client)
+            if not _transaction_support[key]:
+                logger.warning("MongoDB has no transaction support (not a replica set); checkout uses compensation")
+        return _transaction_support[key]
+
+    def place_order(self, cart, user_id, shipping_address, payment_method):
+        """Create the order for cart and delete the cart. Raises CheckoutError."""
+        pricing = price_cart(self.db, cart, fresh=True)
+        for priced in pricing["items"]:
+            if priced["unavailable"]:
+                raise CheckoutError(f"Product with ID {priced['product_id']} not found", 404)
+            if priced["insufficient_stock"]:
+                raise CheckoutError(self._stock_message(priced["title"], priced["available_stock"], priced["quantity"]))
+
+        order = Order(
+            id=ObjectId(),
+            user_id=user_id,
+            items=[
+                OrderItem(
+                    product_id=priced["product_id"],
+                    quantity=priced["quantity"],
+                    price=float(priced["unit_price_vnd"]),
+                    title=priced["title"],
+                    image_path=priced["image_path"]
+                )
+                for priced in pricing["items"]
+            ],
+            total_amount=pricing["subtotal_vnd"],
+            shipping_address=shipping_address,
+            payment_method=payment_method,
+            status=Order.STATUS_PROCESSING
+        )
+        order_doc = order.to_dict()
+        cart_filter = {"_id": ObjectId(cart.id), "user_id": user_id}
+        holder = holder_key(user_id=user_id)
+        category_ids = {priced["product_id"]: priced.get("category_id") for priced in pricing["items"]}
+
+        if self.use_transactions():
+            with self.client.start_session() as session:
+                session.with_transaction(lambda s: self._commit(s, order, order_doc, cart_filter, holder))
+        else:
+            self._commit_with_compensation(order, order_doc, cart_filter, holder)
+
+        # Ghi sau commit: mọi đơn trong ngày cùng cộng vào một document, đưa vào transaction
+        # sẽ khiến các checkout đồng thời xung đột ghi với nhau
+        self._after_commit(order, [
+            ("Sales rollup", lambda: record_order(self.db, order, category_ids)),
+            ("Co-purchase recording", lambda: co_purchase_recorder.submit(self.db, order)),
+            ("Suggest weights", lambda: suggest_index.record_sales({item.product_id: item.quantity for item in order.items})),
+            # Chỉ tồn kho thay đổi: catalog version giữ nguyên để snapshot, index và cache không bị dựng lại
+            ("Stock version bump", lambda: stock_version.bump(self.db)),
+            ("Low-stock refresh", lambda: refresh_low_stock(self.db, list(category_ids))),
+        ])
+        return order
+
+    @staticmethod
+    def _after_commit(order, steps):
+        """
+        Run the bookkeeping that follows a committed order write. The order stands either
+        way, so failures are logged rather than raised; the rollups, co-purchases and
+        sales counts all have rebuild commands to repair them.
+        """
+        for name, step in steps:
+            try:
+                step()
+            except Exception:
+                logger.exception(f"{name} failed for order {order.id}")
+
+    def _commit(self, session, order, order_doc, cart_filter, holder):
+        hold_filter = {"holder": holder, "product_id": {"$in": [item.product_id for item in order.items]}}
+        holds = {hold["product_id"]: hold["quantity"] for hold in self.db.stock_holds.find(hold_filter, session=session)}
+        result = self.db.product.bulk_write(
+            [UpdateOne(*self._stock_update(item, holds.get(item.product_id, 0))) for item in order.items],
+            ordered=False, session=session
+        )
+        if result.matched_count != len(order.items):
+            # Hủy transaction: không sản phẩm nào bị trừ kho. Đọc lại ngoài session, nếu không sẽ
+            # thấy chính các lần trừ kho của bulk_write này và có thể báo nhầm sản phẩm còn đủ hàng
+            raise self._stock_error(order.items, holds)
+
+        self.db.stock_holds.delete_many(hold_filter, session=session)
+        if self.db.carts.delete_one(cart_filter, session=session).deleted_count != 1:
+            raise CheckoutError("Cart has already been ordered", 409)
+        self.db.orders.insert_one(order_doc, session=session)
+
+    def _commit_with_compensation(self, order, order_doc, cart_filter, holder):
+        claimed, taken = [], []
+        try:
+            for item in order.items:
+                hold = self.db.stock_holds.find_one_and_delete({"holder": holder, "product_id": item.product_id})
+                held = hold["quantity"] if hold else 0
+                if hold:
+                    claimed.append(hold)
+                if self.db.product.update_one(*self._stock_update(item, held)).matched_count != 1:
+                    raise self._stock_error([item], {item.product_id: held})
+                taken.append((item, held))
+
+            cart_doc = self.db.carts.find_one_and_delete(cart_filter)
+            if cart_doc is None:
+                raise CheckoutError("Cart has already been ordered", 409)
+            try:
+                self.db.orders.insert_one(order_doc)
+            except PyMongoError:
+                self.db.carts.insert_one(cart_doc)
+                raise
+        except Exception:
+            for item, held in taken:
+                self.db.product.update_one(*self._restock_update(item, held))
+            for hold in claimed:
+                self.db.stock_holds.update_one(
+                    {"holder": hold["holder"], "product_id": hold["product_id"]},
+                    {"$inc": {"quantity": hold["quantity"]}, "$max": {"expires_at": hold["expires_at"]}},
+                    upsert=True
+                )
+            raise
+
+    def change_order_status(self, order_id, status):
+        """
+        Set an order's status. Cancelling or refunding gives its units back to stock and
+        takes them off sales_count; moving back out of those statuses takes the stock
+        again with the checkout's conditional update (CheckoutError when it is gone).
+        On a replica set the status and stock writes share one transaction.
+        Returns the updated Order, or None if it does not exist.
+        """
+        if self.use_transactions():
+            with self.client.start_session() as session:
+                previous = session.with_transaction(lambda s: self._set_status(s, order_id, status))
+        else:
+            previous = self._set_status_with_compensation(order_id, status)
+        if previous is None:
+            return None
+
+        order = Order.from_dict(previous)
+        sign = reversal_sign(order.status, status)
+        if sign:
+            product_ids = [item.product_id for item in order.items]
+            self._after_commit(order, [
+                ("Sales rollup", lambda: record_status_change(self.db, order, status)),
+                ("Suggest weights", lambda: suggest_index.record_sales({item.product_id: sign * item.quantity for item in order.items})),
+                ("Stock version bump", lambda: stock_version.bump(self.db)),
+                ("Low-stock refresh", lambda: refresh_low_stock(self.db, product_ids)),
+            ])
+        order.status = status
+        return order
+
+    def _set_status(self, session, order_id, status):
+        previous = self.db.orders.find_one_and_update(
+            {"_id": ObjectId(order_id)},
+            {"$set": {"status": status, "updated_at": datetime.utcnow()}},
+            session=session
+        )
+        if previous is None:
+            return None
+        order = Order.from_dict(dict(previous))
+        sign = reversal_sign(order.status, status)
+        if sign < 0:
+            self.db.product.bulk_write(
+                [UpdateOne(*self._restock_update(item)) for item in order.items], ordered=False, session=session
+            )
+        elif sign > 0:
+            result = self.db.product.bulk_write(
+                [UpdateOne(*self._stock_update(item, 0)) for item in order.items], ordered=False, session=session
+            )
+            if result.matched_count != len(order.items):
+                # Hủy transaction: trạng thái và tồn kho giữ nguyên
+                raise self._stock_error(order.items, {})
+        return previous
+
+    def _set_status_with_compensation(self, order_id, status):
+        previous = self.db.orders.find_one({"_id": ObjectId(order_id)})
+        if previous is None:
+            return None
+        order = Order.from_dict(dict(previous))
+        sign = reversal_sign(order.status, status)
+
+        taken = []
+        try:
+            if sign > 0:
+                for item in order.items:
+                    if self.db.product.update_one(*self._stock_update(item, 0)).matched_count != 1:
+                        raise self._stock_error([item], {})
+                    taken.append(item)
+            # Chỉ đổi khi trạng thái chưa bị request khác đổi trước, để hàng không bị trả hoặc lấy hai lần
+            if self.db.orders.update_one(
+                {"_id": ObjectId(order_id), "status": order.status},
+                {"$set": {"status": status, "updated_at": datetime.utcnow()}}
+            ).matched_count != 1:
+                raise CheckoutError("Order status was changed concurrently, please retry", 409)
+        except Exception:
+            for item in taken:
+                self.db.product.update_one(*self._restock_update(item))
+            raise
+
+        if sign < 0:
+            for item in order.items:
+                self.db.product.update_one(*self._restock_update(item))
+        return previous
+
+    @staticmethod
+    def _restock_update(item, held=0):
+        """Give back item.quantity units taken by _stock_update (held of them go back to the cart's hold)."""
+        return (
+            {"_id": ObjectId(item.product_id)},
+            {"$inc": {"stock_count": item.quantity, "reserved_count": held, "sales_count": -item.quantity}}
+        )
+
+    @staticmethod
+    def _stock_update(item, held):
+        """Take item.quantity units, of which held are already reserved for this cart."""
+        free_for_cart = {"$add": [
+            {"$subtract": [{"$ifNull": ["$stock_count", 0]}, {"$ifNull": ["$reserved_count", 0]}]}, held
+        ]}
+        return (
+            {"_id": ObjectId(item.product_id), "$expr": {"$gte": [free_for_cart, item.quantity]}},
+            {"$inc": {"stock_count": -item.quantity, "reserved_count": -held, "sales_count": item.quantity}}
+        )
+
+    def _stock_error(self, items, holds):
+        """CheckoutError naming the first item whose committed stock no longer covers it."""
+        stock = {
+            str(doc["_id"]): doc.get("stock_count", 0) - doc.get("reserved_count", 0) + holds.get(str(doc["_id"]), 0)
+            for doc in self.db.product.find(
+                {"_id": {"$in": [ObjectId(item.product_id) for item in items]}},
+                {"stock_count": 1, "reserved_count": 1}
+            )
+        }
+        for item in items:
+            available = stock.get(item.product_id)
+            if available is None:
+                return CheckoutError(f"Product with ID {item.product_id} not found", 404)
+            if available < item.quantity:
+                return CheckoutError(self._stock_message(item.title, available, item.quantity))
+        return CheckoutError("Stock changed during checkout, please try again", 409)
+
+    @staticmethod
+    def _stock_message(title, available, requested):
+        return f"Not enough stock for product: {title}. Available: {available}, Requested: {requested}"
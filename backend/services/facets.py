@@ -0,0 +1,164 @@
+import logging
+import threading
+from collections import OrderedDict
+import config
+from services.catalog_version import catalog_version
+from services.pagination import encode_cursor
+
+logger = logging.getLogger(__name__)
+
+# Các mốc giá (VND) của bộ lọc khoảng giá; mốc cuối chỉ để đóng khoảng trên cùng
+PRICE_BAND_BOUNDARIES = [0, 1_000_000, 3_000_000, 5_000_000, 10_000_000, 20_000_000, 10 ** 15]
+
+
+class CatalogFacets:
+    """
+    Counts per category, price band and brand plus the first page of matching
+    products, computed by one `$facet` aggregation.
+
+    Each facet ignores its own filter (selecting a brand still shows the other brands'
+    counts) and applies the rest. Results are kept in an LRU keyed by the normalized
+    filter set and dropped whenever the catalog version changes. Orders do not bump
+    that version, so the stock of the cached page's products is re-read on every call.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or config.FACET_CACHE_SIZE
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._version = None
+
+    def on_catalog_change(self, version, category_ids):
+        with self._lock:
+            self._cache.clear()
+
+    def get(self, db, filters, sort, limit):
+        """filters: {"category_id": str|None, "brands": [str], "min_price": int|None, "max_price": int|None}."""
+        version = catalog_version.current(db)
+        key = (
+            filters.get("category_id"),
+            tuple(sorted(set(filters.get("brands") or []))),
+            filters.get("min_price"),
+            filters.get("max_price"),
+            tuple(sort),
+            limit,
+        )
+        with self._lock:
+            if self._version != version:
+                self._cache.clear()
+                self._version = version
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return self._with_live_stock(db, cached)
+
+        result = self._aggregate(db, filters, sort, limit)
+        with self._lock:
+            if self._version == version:
+                self._cache[key] = result
+                if len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _with_live_stock(db, result):
+        """Copy of a cached result with stock_count / reserved_count re-read by one `$in`."""
+        stock = {
+            doc["_id"]: doc
+            for doc in db.product.find(
+                {"_id": {"$in": [product["_id"] for product in result["products"]]}},
+                {"stock_count": 1, "reserved_count": 1}
+            )
+        }
+        products = [
+            {**product, **{field: stock.get(product["_id"], {}).get(field, 0) for field in ("stock_count", "reserved_count")}}
+            for product in result["products"]
+        ]
+        return {**result, "products": products}
+
+    def _aggregate(self, db, filters, sort, limit):
+        conditions = {}
+        if filters.get("category_id"):
+            conditions["category"] = {"category_id": filters["category_id"]}
+        if filters.get("brands"):
+            conditions["brand"] = {"brand": {"$in": list(filters["brands"])}}
+        price_range = {}
+        if filters.get("min_price") is not None:
+            price_range["$gte"] = filters["min_price"]
+        if filters.get("max_price") is not None:
+            price_range["$lte"] = filters["max_price"]
+        if not price_range and sort[0][0] == "price_vnd":
+            # Giống /api/products: thứ tự theo giá chỉ gồm sản phẩm có price_vnd
+            price_range["$type"] = "number"
+        if price_range:
+            conditions["price"] = {"price_vnd": price_range}
+
+        def match_except(dimension=None):
+            clauses = [condition for name, condition in conditions.items() if name != dimension]
+            return {"$match": {"$and": clauses} if clauses else {}}
+
+        pipeline = [
+            {"$facet": {
+                "categories": [
+                    match_except("category"),
+                    {"$group": {"_id": "$category_id", "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1}},
+                ],
+                "price_bands": [
+                    match_except("price"),
+                    {"$match": {"price_vnd": {"$type": "number"}}},
+                    {"$bucket": {
+                        "groupBy": "$price_vnd",
+                        "boundaries": PRICE_BAND_BOUNDARIES,
+                        "default": "other",
+                        "output": {"count": {"$sum": 1}}
+                    }},
+                ],
+                "brands": [
+                    match_except("brand"),
+                    {"$match": {"brand": {"$type": "string"}}},
+                    {"$group": {"_id": "$brand", "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1, "_id": 1}},
+                    {"$limit": config.FACET_MAX_BRANDS},
+                ],
+                "total": [match_except(), {"$count": "count"}],
+                "products": [
+                    match_except(),
+                    {"$sort": dict(sort)},
+                    {"$limit": limit + 1},
+                ],
+            }},
+        ]
+        facet = next(db.product.aggregate(pipeline), {})
+
+        products = facet.get("products", [])
+        next_cursor = None
+        if len(products) > limit:
+            products = products[:limit]
+            next_cursor = encode_cursor({field: products[-1].get(field) for field, _ in sort})
+
+        price_bands = []
+        for band in facet.get("price_bands", []):
+            if band["_id"] == "other":
+                continue
+            upper_index = PRICE_BAND_BOUNDARIES.index(band["_id"]) + 1
+            upper = PRICE_BAND_BOUNDARIES[upper_index]
+            price_bands.append({
+                "min_price": band["_id"],
+                "max_price": upper - 1 if upper_index < len(PRICE_BAND_BOUNDARIES) - 1 else None,
+                "count": band["count"]
+            })
+
+        total = facet.get("total", [])
+        return {
+            "categories": [{"category_id": c["_id"], "count": c["count"]} for c in facet.get("categories", [])],
+            "price_bands": price_bands,
+            "brands": [{"brand": b["_id"], "count": b["count"]} for b in facet.get("brands", [])],
+            "total": total[0]["count"] if total else 0,
+            "products": products,
+            "next_cursor": next_cursor,
+        }
+
+
+catalog_facets = CatalogFacets()
+catalog_version.subscribe(catalog_facets.on_catalog_change)
@@ -0,0 +1,194 @@
+import gzip
+import json
+import logging
+import threading
+from bson import Binary, ObjectId
+import config
+from services.catalog_version import catalog_version, stock_version
+
+logger = logging.getLogger(__name__)
+
+
+class HomeSnapshot:
+    """
+    Precomputed payload for /api/home/structured-content.
+
+    Each category (with its products) is built by one aggregation and kept as a
+    serialized JSON fragment; the full body is kept both raw and gzip-compressed and
+    tagged with the catalog version it was built from. When `catalog_version.bump()` reports which
+    categories changed, only those fragments are rebuilt. With HOME_SNAPSHOT_PERSIST
+    the compressed body is also stored in `home_snapshots` so a cold process can skip
+    the aggregation. Stock changes with every order, which does not bump the catalog
+    version, so fragments leave it out; `get()` fills each product's `inventory` from
+    one `$in` read of stock_count, redone only when the stock version has moved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._fragments = {}
+        self._version = None
+        self._body = None
+        self._gzip_body = None
+        self._dirty = set()
+        self._full_rebuild = True
+        self._stock_lock = threading.Lock()
+        self._stocked = None
+
+    def on_catalog_change(self, version, category_ids):
+        with self._lock:
+            if category_ids is None:
+                self._full_rebuild = True
+            else:
+                self._dirty.update(category_ids)
+
+    def get(self, db):
+        """Return (body, gzip_body, version, stock) with live inventory, for the current catalog and stock versions."""
+        body, _, version = self.get_catalog(db)
+        stock = stock_version.current(db)
+        with self._stock_lock:
+            if self._stocked is None or self._stocked[:2] != (version, stock) or self._stocked[2] is not body:
+                self._stocked = (version, stock, body, *self._with_inventory(db, body))
+            _, _, _, stocked_body, stocked_gzip = self._stocked
+        return stocked_body, stocked_gzip, version, stock
+
+    def _with_inventory(self, db, body):
+        payload = json.loads(body)
+        products = [product for category in payload["categories"] for product in category["products"]]
+        object_ids = [ObjectId(product["_id"]) for product in products]
+        stock_counts = {
+            str(doc["_id"]): doc.get("stock_count", 0)
+            for doc in db.product.find({"_id": {"$in": object_ids}}, {"stock_count": 1})
+        }
+        for product in products:
+            product["inventory"] = stock_counts.get(product["_id"], 0)
+        stocked_body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        return stocked_body, gzip.compress(stocked_body, compresslevel=6)
+
+    def get_catalog(self, db):
+        """Return (body, gzip_body, version) for the current catalog version, without inventory."""
+        version = catalog_version.current(db)
+        with self._lock:
+            if self._version == version and self._body is not None:
+                return self._body, self._gzip_body, self._version
+
+        with self._build_lock:
+            with self._lock:
+                if self._version == version and self._body is not None:
+                    return self._body, self._gzip_body, self._version
+                full_rebuild, dirty = self._full_rebuild, set(self._dirty)
+                self._full_rebuild, self._dirty = False, set()
+
+            try:
+                if not (full_rebuild and self._load_persisted(db, version)):
+                    self._rebuild(db, version, None if full_rebuild else dirty)
+            except Exception:
+                with self._lock:
+                    self._full_rebuild = self._full_rebuild or full_rebuild
+                    self._dirty.update(dirty)
+                raise
+
+            with self._lock:
+                return self._body, self._gzip_body, self._version
+
+    def _rebuild(self, db, version, category_ids):
+        if category_ids is None:
+            fragments = {}
+            for category in self._aggregate(db):
+                fragments[category["_id"]] = self._serialize_category(category)
+        else:
+            fragments = dict(self._fragments)
+            for category_id in category_ids:
+                fragments.pop(category_id, None)
+            object_ids = [ObjectId(category_id) for category_id in category_ids if ObjectId.is_valid(category_id)]
+            if object_ids:
+                for category in self._aggregate(db, object_ids):
+                    fragments[category["_id"]] = self._serialize_category(category)
+
+        # ObjectId tăng dần theo thời gian tạo nên sắp theo id giữ đúng thứ tự categorie.find() cũ
+        ordered = [fragments[category_id] for category_id in sorted(fragments)]
+        body = b'{"categories":[' + b",".join(ordered) + b"]}"
+        gzip_body = gzip.compress(body, compresslevel=6)
+
+        with self._lock:
+            self._fragments = fragments
+            self._body = body
+            self._gzip_body = gzip_body
+            self._version = version
+
+        if config.HOME_SNAPSHOT_PERSIST:
+            db.home_snapshots.replace_one(
+                {"_id": "home"},
+                {"_id": "home", "version": version, "body": Binary(gzip_body), "fragments": {
+                    category_id: Binary(fragment) for category_id, fragment in fragments.items()
+                }},
+                upsert=True
+            )
+        logger.info(f"Home snapshot rebuilt at catalog version {version} ({len(body)} bytes, {len(gzip_body)} gzipped)")
+
+    def _load_persisted(self, db, version):
+        if not config.HOME_SNAPSHOT_PERSIST:
+            return False
+        stored = db.home_snapshots.find_one({"_id": "home", "version": version})
+        if not stored:
+            return False
+        gzip_body = bytes(stored["body"])
+        with self._lock:
+            self._fragments = {category_id: bytes(fragment) for category_id, fragment in stored.get("fragments", {}).items()}
+            self._body = gzip.decompress(gzip_body)
+            self._gzip_body = gzip_body
+            self._version = version
+        return True
+
+    def _aggregate(self, db, category_object_ids=None):
+        pipeline = []
+        if category_object_ids is not None:
+            pipeline.append({"$match": {"_id": {"$in": category_object_ids}}})
+        pipeline.extend([
+            {"$lookup": {
+                "from": "product",
+                "let": {"category_id": {"$toString": "$_id"}},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$category_id", "$$category_id"]}}},
+                    {"$match": {"original_product_id": {"$nin": [None, ""]}}},
+                    {"$project": {
+                        "original_product_id": 1, "title": 1, "description": 1, "price": 1,
+                        "features": 1, "image_path": 1
+                    }}
+                ],
+                "as": "products"
+            }},
+            {"$project": {"original_id": 1, "name": 1, "description": 1, "image_path": 1, "products": 1}}
+        ])
+        for category in db.categorie.aggregate(pipeline):
+            category["_id"] = str(category["_id"])
+            yield category
+
+    def _serialize_category(self, cat_doc):
+        category_original_id = cat_doc.get('original_id')
+        category_name = cat_doc.get('name')
+        payload = {
+            "category_id": category_original_id,
+            "name": category_name,
+            "description": cat_doc.get('description', ''),
+            "image_path": cat_doc.get('image_path', ''),
+            "products": [
+                {
+                    "_id": str(prod_doc['_id']),
+                    "id": prod_doc.get('original_product_id'),
+                    "title": prod_doc.get('title'),
+                    "description": prod_doc.get('description'),
+                    "price": prod_doc.get('price'),
+                    "features": prod_doc.get('features', []),
+                    "image_path": prod_doc.get('image_path'),
+                    "category_id": category_original_id,
+                    "category_name": category_name
+                }
+                for prod_doc in cat_doc.get('products', [])
+            ]
+        }
+        return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+home_snapshot = HomeSnapshot()
+catalog_version.subscribe(home_snapshot.on_catalog_change)
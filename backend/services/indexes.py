@@ -0,0 +1,197 @@
+"""
+Khai báo và tạo các index MongoDB cho những truy vấn nóng.
+
+Chạy khi khởi động app (ENSURE_INDEXES_ON_STARTUP) hoặc bằng tay:
+
+    python -m services.indexes            # tạo index còn thiếu
+    python -m services.indexes --verify   # chỉ kiểm tra
+    python -m services.indexes --explain  # cảnh báo truy vấn nào còn COLLSCAN
+
+Mỗi lần thay đổi INDEXES phải tăng INDEX_VERSION để lần khởi động sau tạo lại.
+"""
+import argparse
+import logging
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
+from pymongo.errors import OperationFailure
+import config
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 9
+
+INDEXES = {
+    "chat_sessions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        # Chỉ phiên ẩn danh có expiry_date nên chỉ chúng bị xóa tự động
+        IndexModel([("expiry_date", ASCENDING)], name="expiry_date_ttl", expireAfterSeconds=0),
+        IndexModel([("is_anonymous", ASCENDING), ("archived", ASCENDING), ("updated_at", ASCENDING)], name="archive_candidates"),
+    ],
+    "chat_message_buckets": [
+        IndexModel([("session_id", ASCENDING), ("bucket", ASCENDING)], name="session_bucket_unique", unique=True),
+        # Bucket của phiên ẩn danh mang cùng expiry_date với phiên nên bị xóa cùng lúc
+        IndexModel([("expiry_date", ASCENDING)], name="expiry_date_ttl", expireAfterSeconds=0),
+    ],
+    "carts": [
+        # Mỗi người dùng một giỏ; giỏ ẩn danh (user_id null) không thuộc index
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True,
+                   partialFilterExpression={"user_id": {"$type": "string"}}),
+        IndexModel([("session_id", ASCENDING)], name="session_id"),
+        IndexModel([("expiry_date", ASCENDING)], name="expiry_date_ttl", expireAfterSeconds=0),
+    ],
+    "product": [
+        # _id là khóa phân trang keyset của danh sách sản phẩm theo danh mục
+        IndexModel([("category_id", ASCENDING), ("_id", ASCENDING)], name="category_id_id"),
+        # Lọc theo khoảng giá và sắp theo giá trong một danh mục hoặc toàn bộ danh mục
+        IndexModel([("category_id", ASCENDING), ("price_vnd", ASCENDING), ("_id", ASCENDING)], name="category_price_vnd"),
+        IndexModel([("price_vnd", ASCENDING), ("_id", ASCENDING)], name="price_vnd"),
+        IndexModel([("brand", ASCENDING), ("_id", ASCENDING)], name="brand"),
+    ],
+    "stock_holds": [
+        IndexModel([("holder", ASCENDING), ("product_id", ASCENDING)], name="holder_product_unique", unique=True),
+        # Không dùng TTL: hold hết hạn phải được trả lại reserved_count nên do HoldReaper xóa
+        IndexModel([("expires_at", ASCENDING)], name="expires_at"),
+    ],
+    "idempotency_keys": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "orders": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created_at_id"),
+    ],
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "product_co_purchases": [
+        # Danh sách bought_together của một sản phẩm là K cặp có count lớn nhất
+        IndexModel([("product_id", ASCENDING), ("count", DESCENDING)], name="product_count"),
+    ],
+}
+
+# Index cũ bị thay bằng index cùng khóa nhưng khác tùy chọn; phải xóa trước khi tạo index mới
+REPLACED_INDEXES = {
+    "carts": ["user_id"],
+}
+
+# (tên, collection, filter, sort) của các truy vấn mà route chạy trên mỗi request
+HOT_QUERIES = [
+    ("chat session by session_id", "chat_sessions", {"session_id": ""}, None),
+    ("chat session by user_id", "chat_sessions", {"user_id": ""}, None),
+    ("chat history page", "chat_message_buckets", {"session_id": "", "bucket": {"$gte": 0, "$lte": 1}}, None),
+    ("cart by user_id", "carts", {"user_id": ""}, None),
+    ("cart by session_id", "carts", {"session_id": ""}, None),
+    ("products by category", "product", {"category_id": ""}, [("_id", ASCENDING)]),
+    ("products by category and price", "product", {"category_id": "", "price_vnd": {"$gte": 0}}, [("price_vnd", ASCENDING), ("_id", ASCENDING)]),
+    ("expired stock holds", "stock_holds", {"expires_at": {"$lte": datetime.utcnow()}}, None),
+    ("order history", "orders", {"user_id": ""}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("user by email", "users", {"email": ""}, None),
+    ("top co-purchases", "product_co_purchases", {"product_id": ""}, [("count", DESCENDING)]),
+]
+
+
+def ensure_indexes(db, force=False):
+    """Create every declared index unless this INDEX_VERSION was already applied. Returns True if it ran."""
+    applied = db.schema_versions.find_one({"_id": "indexes"})
+    if applied and applied.get("version", 0) >= INDEX_VERSION and not force:
+        return False
+
+    failed = []
+    for collection_name, models in INDEXES.items():
+        try:
+            existing = db[collection_name].index_information()
+            for index_name in REPLACED_INDEXES.get(collection_name, []):
+                if index_name in existing:
+                    db[collection_name].drop_index(index_name)
+            db[collection_name].create_indexes(models)
+        except OperationFailure as e:
+            # Ví dụ: email trùng lặp làm unique index thất bại; phải làm sạch dữ liệu rồi chạy lại
+            failed.append(collection_name)
+            logger.error(f"Could not create indexes on {collection_name}: {e}")
+
+    if failed:
+        return False
+
+    db.schema_versions.update_one(
+        {"_id": "indexes"},
+        {"$set": {"version": INDEX_VERSION, "applied_at": datetime.utcnow()}},
+        upsert=True
+    )
+    logger.info(f"MongoDB indexes at version {INDEX_VERSION}")
+    return True
+
+
+def verify_indexes(db):
+    """Return a list of (collection, index name) that are declared but missing."""
+    missing = []
+    for collection_name, models in INDEXES.items():
+        existing = db[collection_name].index_information()
+        existing_keys = {tuple(info["key"]) for info in existing.values()}
+        for model in models:
+            document = model.document
+            if tuple(document["key"].items()) not in existing_keys:
+                missing.append((collection_name, document["name"]))
+    return missing
+
+
+def explain_hot_queries(db):
+    """Run explain() on every HOT_QUERIES entry and return warnings for the ones that fall back to COLLSCAN."""
+    warnings = []
+    for name, collection_name, query, sort in HOT_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        except Exception as e:
+            logger.warning(f"explain() failed for '{name}': {e}")
+            continue
+        if "COLLSCAN" in _plan_stages(plan):
+            warnings.append(f"'{name}' on {collection_name} uses a collection scan")
+    for warning in warnings:
+        logger.warning(warning)
+    return warnings
+
+
+def _plan_stages(plan):
+    stages = [plan.get("stage")]
+    if "inputStage" in plan:
+        stages.extend(_plan_stages(plan["inputStage"]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    if "queryPlan" in plan:
+        stages.extend(_plan_stages(plan["queryPlan"]))
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tạo và kiểm tra index MongoDB")
+    parser.add_argument("--verify", action="store_true", help="chỉ kiểm tra, không tạo index")
+    parser.add_argument("--explain", action="store_true", help="chạy explain() cho các truy vấn nóng")
+    parser.add_argument("--force", action="store_true", help="tạo lại dù phiên bản đã được áp dụng")
+    args = parser.parse_args()
+
+    db = MongoClient(config.MONGO_URI).get_database()
+
+    if not args.verify:
+        if ensure_indexes(db, force=args.force):
+            print(f"Đã tạo index, phiên bản {INDEX_VERSION}")
+        else:
+            print("Không tạo index mới (đã ở phiên bản hiện tại hoặc có lỗi, xem log)")
+
+    missing = verify_indexes(db)
+    for collection_name, index_name in missing:
+        print(f"Thiếu index: {collection_name}.{index_name}")
+    if not missing:
+        print("Tất cả index đã tồn tại")
+
+    if args.explain:
+        warnings = explain_hot_queries(db)
+        for warning in warnings:
+            print(f"Cảnh báo: {warning}")
+        if not warnings:
+            print("Không có truy vấn nóng nào dùng COLLSCAN")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
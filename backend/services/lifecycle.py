@@ -0,0 +1,152 @@
+"""
+Vòng đời dữ liệu phiên chat và giỏ hàng.
+
+- Phiên chat ẩn danh, bucket tin nhắn của chúng và giỏ hàng ẩn danh có expiry_date;
+  TTL index (services/indexes.py) tự xóa khi hết hạn.
+- Lịch sử chat của người dùng đã đăng nhập không hoạt động quá CHAT_ARCHIVE_AFTER_DAYS
+  ngày được nén ra CHAT_ARCHIVE_DIR và xóa khỏi Mongo; mở lại phiên sẽ tự khôi phục.
+
+    python -m services.lifecycle archive [--days 90] [--limit 1000]
+    python -m services.lifecycle restore <session_id>
+"""
+import argparse
+import gzip
+import logging
+import os
+from datetime import datetime, timedelta
+from bson import json_util
+from pymongo import DeleteOne, MongoClient, UpdateOne
+import config
+from services.chat_history import ChatHistory
+
+logger = logging.getLogger(__name__)
+
+
+def archive_inactive_sessions(db, older_than_days=None, archive_dir=None, limit=None):
+    """Archive authenticated chat sessions idle for older_than_days. Returns the number archived."""
+    older_than_days = older_than_days or config.CHAT_ARCHIVE_AFTER_DAYS
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+    cursor = db.chat_sessions.find(
+        {"is_anonymous": False, "archived": {"$ne": True}, "updated_at": {"$lt": cutoff}},
+        {"session_id": 1}
+    )
+    if limit:
+        cursor = cursor.limit(limit)
+
+    archived = 0
+    for chat_data in cursor:
+        try:
+            archive_session(db, chat_data["session_id"], archive_dir)
+            archived += 1
+        except Exception as e:
+            logger.error(f"Could not archive chat session {chat_data['session_id']}: {e}")
+    return archived
+
+
+def archive_session(db, session_id, archive_dir=None):
+    """Write a session's message buckets to a gzip'd JSON file and remove them from Mongo."""
+    archive_dir = archive_dir or config.CHAT_ARCHIVE_DIR
+    os.makedirs(archive_dir, exist_ok=True)
+    archive_path = os.path.join(archive_dir, f"{session_id}.json.gz")
+
+    ChatHistory(db).migrate_legacy(session_id)
+    buckets = list(db.chat_message_buckets.find({"session_id": session_id}, {"_id": 0}).sort("bucket", 1))
+    payload = json_util.dumps({"session_id": session_id, "buckets": buckets})
+
+    # Ghi ra file tạm rồi đổi tên để không bao giờ để lại bản lưu trữ dở dang
+    tmp_path = archive_path + ".tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        f.write(payload)
+    os.replace(tmp_path, archive_path)
+
+    db.chat_sessions.update_one(
+        {"session_id": session_id},
+        {"$set": {"archived": True, "archived_at": datetime.utcnow(), "archive_path": archive_path}}
+    )
+    # Chỉ xóa bucket còn đúng như bản đã lưu; bucket vừa được ghi thêm ở lại và được gộp khi khôi phục
+    if buckets:
+        db.chat_message_buckets.bulk_write([
+            DeleteOne({"session_id": session_id, "bucket": bucket["bucket"], "count": bucket.get("count")})
+            for bucket in buckets
+        ], ordered=False)
+    return archive_path
+
+
+def restore_session(db, session_id):
+    """
+    Bring an archived session's buckets back into Mongo. Returns False if it was not archived.
+
+    Messages appended after archival may already have re-created some buckets, so the
+    archived messages are merged into them by seq rather than replacing them.
+    """
+    chat_data = db.chat_sessions.find_one({"session_id": session_id}, {"archived": 1, "archive_path": 1})
+    if not chat_data or not chat_data.get("archived"):
+        return False
+
+    archive_path = chat_data.get("archive_path") or os.path.join(config.CHAT_ARCHIVE_DIR, f"{session_id}.json.gz")
+    with gzip.open(archive_path, "rt", encoding="utf-8") as f:
+        payload = json_util.loads(f.read())
+
+    present = {
+        bucket["bucket"]: {message["seq"] for message in bucket.get("messages", [])}
+        for bucket in db.chat_message_buckets.find({"session_id": session_id}, {"bucket": 1, "messages.seq": 1})
+    }
+    operations = []
+    for bucket in payload["buckets"]:
+        missing = [message for message in bucket.get("messages", [])
+                   if message["seq"] not in present.get(bucket["bucket"], set())]
+        if not missing:
+            continue
+        on_insert = {"created_at": bucket.get("created_at", missing[0]["timestamp"])}
+        if bucket.get("expiry_date"):
+            on_insert["expiry_date"] = bucket["expiry_date"]
+        operations.append(UpdateOne(
+            {"session_id": session_id, "bucket": bucket["bucket"]},
+            {
+                "$push": {"messages": {"$each": missing, "$sort": {"seq": 1}}},
+                "$inc": {"count": len(missing)},
+                "$max": {"updated_at": bucket.get("updated_at", missing[-1]["timestamp"])},
+                "$setOnInsert": on_insert
+            },
+            upsert=True
+        ))
+    if operations:
+        db.chat_message_buckets.bulk_write(operations, ordered=False)
+
+    db.chat_sessions.update_one(
+        {"session_id": session_id},
+        {"$unset": {"archived": "", "archived_at": "", "archive_path": ""}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+    os.remove(archive_path)
+    logger.info(f"Restored archived chat session {session_id}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lưu trữ / khôi phục lịch sử chat")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    archive_parser = subparsers.add_parser("archive", help="lưu trữ các phiên không hoạt động")
+    archive_parser.add_argument("--days", type=int, default=config.CHAT_ARCHIVE_AFTER_DAYS)
+    archive_parser.add_argument("--limit", type=int, default=None)
+
+    restore_parser = subparsers.add_parser("restore", help="khôi phục một phiên đã lưu trữ")
+    restore_parser.add_argument("session_id")
+
+    args = parser.parse_args()
+    db = MongoClient(config.MONGO_URI).get_database()
+
+    if args.command == "archive":
+        count = archive_inactive_sessions(db, older_than_days=args.days, limit=args.limit)
+        print(f"Đã lưu trữ {count} phiên chat")
+    else:
+        if restore_session(db, args.session_id):
+            print(f"Đã khôi phục phiên {args.session_id}")
+        else:
+            print(f"Phiên {args.session_id} không ở trạng thái lưu trữ")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
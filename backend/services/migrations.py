@@ -0,0 +1,119 @@
+"""
+Các bước chuyển đổi dữ liệu MongoDB, mỗi bước chỉ chạy một lần.
+
+Chạy khi khởi động app (RUN_MIGRATIONS_ON_STARTUP) hoặc bằng tay:
+
+    python -m services.migrations          # chạy các bước chưa áp dụng
+    python -m services.migrations --list   # liệt kê trạng thái
+
+Tên các bước đã chạy được lưu trong schema_versions {"_id": "migrations"}.
+Mỗi bước phải chạy lại được an toàn nếu bị ngắt giữa chừng.
+"""
+import argparse
+import logging
+from datetime import datetime
+from pymongo import MongoClient, UpdateOne
+import config
+from models.product import parse_brand, parse_price_vnd
+from services.catalog_version import catalog_version
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def _backfill(collection, field, projection, derive):
+    """Set `field` = derive(document) on every document that lacks it, in batches."""
+    operations = []
+    updated = 0
+    for document in collection.find({field: {"$exists": False}}, projection):
+        operations.append(UpdateOne({"_id": document["_id"]}, {"$set": {field: derive(document)}}))
+        if len(operations) >= BATCH_SIZE:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
+def _backfill_products(db, field, projection, derive):
+    updated = _backfill(db.product, field, projection, derive)
+    if updated:
+        catalog_version.bump(db)
+    return updated
+
+
+def add_product_price_vnd(db):
+    """Store the integer price_vnd parsed from every product's price string."""
+    return _backfill_products(db, "price_vnd", {"price": 1}, lambda product: parse_price_vnd(product.get("price")))
+
+
+def add_product_brand(db):
+    """Store the brand taken from every product's "Thương hiệu: ..." feature."""
+    return _backfill_products(db, "brand", {"features": 1}, lambda product: parse_brand(product.get("features")))
+
+
+def add_order_summary_fields(db):
+    """Store item_count and first_item_image on every order for the summary order history."""
+    item_counts = _backfill(
+        db.orders, "item_count", {"items.quantity": 1},
+        lambda order: sum(item.get("quantity", 0) for item in order.get("items", []))
+    )
+    first_images = _backfill(
+        db.orders, "first_item_image", {"items": {"$slice": 1}},
+        lambda order: order["items"][0].get("image_path") if order.get("items") else None
+    )
+    return item_counts + first_images
+
+
+# (tên, hàm) theo thứ tự áp dụng; không đổi tên bước đã phát hành
+MIGRATIONS = [
+    ("0001_product_price_vnd", add_product_price_vnd),
+    ("0002_product_brand", add_product_brand),
+    ("0003_order_summary_fields", add_order_summary_fields),
+]
+
+
+def applied_migrations(db):
+    state = db.schema_versions.find_one({"_id": "migrations"}) or {}
+    return set(state.get("applied", []))
+
+
+def run_migrations(db):
+    """Apply every migration not yet recorded. Returns the names that ran."""
+    applied = applied_migrations(db)
+    ran = []
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        result = migration(db)
+        db.schema_versions.update_one(
+            {"_id": "migrations"},
+            {"$addToSet": {"applied": name}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        logger.info(f"Migration {name} applied ({result})")
+        ran.append(name)
+    return ran
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy các bước chuyển đổi dữ liệu MongoDB")
+    parser.add_argument("--list", action="store_true", help="chỉ liệt kê trạng thái")
+    args = parser.parse_args()
+
+    db = MongoClient(config.MONGO_URI).get_database()
+
+    if args.list:
+        applied = applied_migrations(db)
+        for name, _ in MIGRATIONS:
+            print(f"{'[x]' if name in applied else '[ ]'} {name}")
+        return
+
+    ran = run_migrations(db)
+    print(f"Đã chạy {len(ran)} bước: {', '.join(ran)}" if ran else "Không có bước nào cần chạy")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,130 @@
+import base64
+import threading
+import time
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING
+import config
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def page_size(requested, default=None, maximum=None):
+    """Clamp a client-supplied page size to [1, maximum]."""
+    default = default or config.PAGE_SIZE_DEFAULT
+    maximum = maximum or config.PAGE_SIZE_MAX
+    if not requested or requested < 1:
+        return default
+    return min(requested, maximum)
+
+
+def parse_sort(value, allowed):
+    """
+    Turn ?sort=price / ?sort=-price into a keyset sort list, ending with _id.
+    allowed maps public sort names to document fields. Returns None for an unknown name.
+    """
+    value = value or ""
+    direction = DESCENDING if value.startswith("-") else ASCENDING
+    field = allowed.get(value.lstrip("-"))
+    if field is None:
+        return None
+    return [(field, direction), ("_id", direction)]
+
+
+def price_range_filter(min_price, max_price, sort):
+    """price_vnd condition for ?min_price=&max_price=, or None when the listing needs none."""
+    price_range = {}
+    if min_price is not None:
+        price_range["$gte"] = min_price
+    if max_price is not None:
+        price_range["$lte"] = max_price
+    if not price_range and sort[0][0] == "price_vnd":
+        # Sản phẩm không đọc được giá (price_vnd null) không có vị trí trong thứ tự theo giá
+        price_range["$type"] = "number"
+    return price_range or None
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(values, dict):
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+
+def keyset_page(collection, query, sort, limit, cursor=None, projection=None):
+    """
+    Fetch one page ordered by `sort` (a list of (field, direction) ending with _id),
+    starting after the position encoded in `cursor`. Returns (documents, next_cursor);
+    next_cursor is None on the last page.
+
+    The cursor holds the sort-key values of the last document, so every page is a
+    range scan on the sort index no matter how deep it is.
+    """
+    if sort[-1][0] != "_id":
+        sort = list(sort) + [("_id", ASCENDING)]
+
+    filters = [query] if query else []
+    if cursor:
+        last = decode_cursor(cursor)
+        if any(field not in last for field, _ in sort):
+            raise InvalidCursor("Cursor does not match this listing")
+        filters.append(_after(sort, last))
+    combined = {"$and": filters} if len(filters) > 1 else (filters[0] if filters else {})
+
+    documents = list(collection.find(combined, projection).sort(sort).limit(limit + 1))
+    if len(documents) <= limit:
+        return documents, None
+
+    documents = documents[:limit]
+    last_document = documents[-1]
+    return documents, encode_cursor({field: last_document.get(field) for field, _ in sort})
+
+
+def _after(sort, last):
+    # (a > x) OR (a = x AND b > y) OR ... theo thứ tự của khóa sắp xếp
+    clauses = []
+    for position, (field, direction) in enumerate(sort):
+        clause = {prev_field: last[prev_field] for prev_field, _ in sort[:position]}
+        clause[field] = {"$gt" if direction == ASCENDING else "$lt": last[field]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+class ApproximateCounter:
+    """count_documents results cached for PAGINATION_COUNT_TTL seconds per (collection, filter)."""
+
+    def __init__(self, ttl_seconds=None, max_entries=1000):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.PAGINATION_COUNT_TTL
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def count(self, collection, query):
+        key = (collection.name, json_util.dumps(query, sort_keys=True))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached and cached[1] > now:
+                return cached[0]
+
+        # Không có điều kiện lọc thì đọc số lượng từ metadata của collection
+        total = collection.estimated_document_count() if not query else collection.count_documents(query)
+        with self._lock:
+            if len(self._counts) >= self.max_entries:
+                self._counts = {k: v for k, v in self._counts.items() if v[1] > now}
+                if len(self._counts) >= self.max_entries:
+                    self._counts.clear()
+            self._counts[key] = (total, now + self.ttl_seconds)
+        return total
+
+
+approximate_counter = ApproximateCounter()
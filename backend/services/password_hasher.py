@@ -0,0 +1,123 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class HasherBusy(Exception):
+    """Raised when BCRYPT_MAX_PENDING credential checks are already queued, or one timed out in the queue."""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def _check(password, hashed_password):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def _warm_up():
+    return True
+
+
+def hash_rounds(hashed_password):
+    """Cost factor of a '$2b$12$...' hash, or None."""
+    try:
+        return int(hashed_password.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """
+    bcrypt in a dedicated, bounded process pool.
+
+    Hashing and verification run in BCRYPT_POOL_SIZE worker processes, so a login storm
+    burns those cores instead of the GIL the request threads share; the calling thread
+    only waits on the result. At most BCRYPT_MAX_PENDING checks may be queued or running,
+    beyond that (or when a check waits longer than BCRYPT_TIMEOUT_SECONDS) `HasherBusy`
+    is raised so the route can answer 503 instead of piling up.
+    If the pool cannot be started (or dies), hashing falls back to the calling thread.
+    """
+
+    def __init__(self, pool_size=None, max_pending=None, rounds=None):
+        self.pool_size = pool_size or config.BCRYPT_POOL_SIZE
+        self.rounds = rounds or config.BCRYPT_ROUNDS
+        self._slots = threading.BoundedSemaphore(max_pending or config.BCRYPT_MAX_PENDING)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def start(self):
+        """
+        Create the worker processes now. app.py calls this before the Mongo client and
+        the chat writer start their threads, so the workers fork a single-threaded process.
+        """
+        with self._lock:
+            if self._pool is not None:
+                return
+            try:
+                pool = ProcessPoolExecutor(
+                    max_workers=self.pool_size,
+                    mp_context=multiprocessing.get_context("fork")
+                )
+                for future in [pool.submit(_warm_up) for _ in range(self.pool_size)]:
+                    future.result()
+            except (OSError, ValueError, BrokenProcessPool) as e:
+                logger.error(f"bcrypt pool unavailable, hashing inline: {e}")
+                return
+            self._pool = pool
+        logger.info(f"bcrypt pool started with {self.pool_size} processes (cost {self.rounds})")
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def verify(self, password, hashed_password):
+        return self._run(_check, password, hashed_password)
+
+    def needs_rehash(self, hashed_password):
+        return hash_rounds(hashed_password) != self.rounds
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many credential checks in progress")
+        future = None
+        try:
+            if self._pool is None:
+                self.start()
+            if self._pool is not None:
+                future = self._pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._pool_died()
+        except BaseException:
+            self._slots.release()
+            raise
+
+        if future is None:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+
+        # Slot chỉ được trả khi job thực sự chạy xong (hoặc bị hủy khi còn trong hàng đợi),
+        # kể cả khi request đã thôi chờ, để BCRYPT_MAX_PENDING giới hạn đúng hàng đợi của pool
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=config.BCRYPT_TIMEOUT_SECONDS)
+        except FutureTimeout:
+            future.cancel()
+            raise HasherBusy("Credential check timed out")
+        except BrokenProcessPool:
+            self._pool_died()
+            return fn(*args)
+
+    def _pool_died(self):
+        logger.error("bcrypt pool died, hashing inline until restart")
+        self._pool = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,46 @@
+import threading
+import time
+import config
+
+
+class TokenBucketLimiter:
+    """
+    In-process token buckets keyed by an arbitrary string (an email, an IP).
+
+    Each key holds up to `capacity` tokens and regains one every `refill_seconds`;
+    `allow()` spends one. Buckets that have refilled completely are dropped when the
+    table grows past `max_keys`, so memory stays bounded.
+    """
+
+    def __init__(self, capacity, refill_seconds, max_keys=100000):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def allow(self, key):
+        """Return (allowed, retry_after_seconds)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) / self.refill_seconds)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return False, int((1 - tokens) * self.refill_seconds) + 1
+
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return True, 0
+
+    def _prune(self, now):
+        full_after = self.capacity * self.refill_seconds
+        self._buckets = {
+            key: (tokens, updated_at) for key, (tokens, updated_at) in self._buckets.items()
+            if now - updated_at < full_after
+        }
+
+
+login_email_limiter = TokenBucketLimiter(config.LOGIN_RATE_EMAIL_CAPACITY, config.LOGIN_RATE_EMAIL_REFILL_SECONDS)
+login_ip_limiter = TokenBucketLimiter(config.LOGIN_RATE_IP_CAPACITY, config.LOGIN_RATE_IP_REFILL_SECONDS)
@@ -0,0 +1,212 @@
+"""
+Bảng gợi ý sản phẩm tính trước: "thường được mua cùng" và "sản phẩm tương tự".
+
+Mỗi sản phẩm có một document trong product_recommendations (_id = id sản phẩm):
+- bought_together: [{product_id, count}], RECOMMENDATION_BOUGHT_TOGETHER sản phẩm hay
+  được mua cùng nhất, sắp theo count giảm dần. Số đếm đầy đủ của từng cặp nằm trong
+  product_co_purchases ({product_id, other_id, count}, cộng dồn sau mỗi đơn hàng trên
+  một thread nền, services/checkout.py); danh sách được tính lại từ đó cho các sản
+  phẩm của đơn;
+- similar: [{product_id, score}], K láng giềng gần nhất trong vector DB, ghi khi dựng
+  index (create_vector_db_from_mongo.py).
+Gợi ý cho một sản phẩm vì thế chỉ là một lần đọc theo _id.
+
+Tính lại số đếm và bought_together từ toàn bộ đơn hàng:
+
+    python -m services.recommendations rebuild
+"""
+import argparse
+import heapq
+import logging
+import queue
+import threading
+from collections import defaultdict
+from datetime import datetime
+from bson import ObjectId
+from pymongo import DESCENDING, MongoClient, UpdateOne
+import config
+from models.product import Product
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def _order_product_ids(product_ids):
+    return list(dict.fromkeys(product_ids))[:config.RECOMMENDATION_MAX_ORDER_ITEMS]
+
+
+def _bulk_write(collection, operations):
+    for start in range(0, len(operations), BATCH_SIZE):
+        collection.bulk_write(operations[start:start + BATCH_SIZE], ordered=False)
+
+
+def record_co_purchases(db, order):
+    """Count every pair of products bought together in order, then refresh their bought_together lists."""
+    product_ids = _order_product_ids(item.product_id for item in order.items)
+    if len(product_ids) < 2:
+        return
+    _bulk_write(db.product_co_purchases, [
+        UpdateOne(
+            {"_id": f"{product_id}:{other_id}"},
+            {"$inc": {"count": 1}, "$setOnInsert": {"product_id": product_id, "other_id": other_id}},
+            upsert=True
+        )
+        for product_id in product_ids for other_id in product_ids if other_id != product_id
+    ])
+    refresh_bought_together(db, product_ids)
+
+
+class CoPurchaseRecorder:
+    """
+    Runs record_co_purchases() on a background thread, so checkout only queues the order.
+
+    At most RECOMMENDATION_QUEUE_SIZE orders wait; past that an order is skipped with a
+    warning (the rebuild command counts it again), and failures are only logged.
+    """
+
+    def __init__(self, max_queued=None):
+        self._queue = queue.Queue(maxsize=max_queued or config.RECOMMENDATION_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, db, order):
+        if len({item.product_id for item in order.items}) < 2:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="co-purchases", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait((db, order))
+        except queue.Full:
+            logger.warning(f"Co-purchase queue full, order {order.id} not counted until the next rebuild")
+
+    def _run(self):
+        while True:
+            db, order = self._queue.get()
+            try:
+                record_co_purchases(db, order)
+            except Exception:
+                logger.exception(f"Recording co-purchases failed for order {order.id}")
+
+
+co_purchase_recorder = CoPurchaseRecorder()
+
+
+def refresh_bought_together(db, product_ids):
+    """Re-derive the capped bought_together list of each product from its pair counts."""
+    now = datetime.utcnow()
+    operations = []
+    for product_id in product_ids:
+        top = db.product_co_purchases.find(
+            {"product_id": product_id}, {"_id": 0, "other_id": 1, "count": 1}
+        ).sort("count", DESCENDING).limit(config.RECOMMENDATION_BOUGHT_TOGETHER)
+        operations.append(UpdateOne(
+            {"_id": product_id},
+            {"$set": {
+                "bought_together": [{"product_id": pair["other_id"], "count": pair["count"]} for pair in top],
+                "updated_at": now,
+            }},
+            upsert=True
+        ))
+    _bulk_write(db.product_recommendations, operations)
+
+
+def save_similar_products(db, neighbours):
+    """Store {product_id: [(neighbour_id, score), ...]} computed from the vector index."""
+    now = datetime.utcnow()
+    operations = []
+    for product_id, similar in neighbours.items():
+        operations.append(UpdateOne(
+            {"_id": product_id},
+            {"$set": {
+                "similar": [{"product_id": other_id, "score": float(score)} for other_id, score in similar],
+                "similar_updated_at": now,
+            }},
+            upsert=True
+        ))
+        if len(operations) >= BATCH_SIZE:
+            db.product_recommendations.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        db.product_recommendations.bulk_write(operations, ordered=False)
+    return len(neighbours)
+
+
+def recommendation_ids(db, product_id, limit):
+    """{"similar": [...], "bought_together": [...]} product ids for product_id, best first."""
+    entry = db.product_recommendations.find_one({"_id": str(product_id)}, {"similar": 1, "bought_together": 1}) or {}
+    return {
+        "similar": [similar["product_id"] for similar in entry.get("similar", [])][:limit],
+        "bought_together": [pair["product_id"] for pair in entry.get("bought_together", [])][:limit],
+    }
+
+
+def recommended_products(db, product_id, limit=None):
+    """
+    Similar and frequently-bought-together products for product_id as Product.to_json()
+    dicts, read from the precomputed table and hydrated with one `$in` query.
+    """
+    limit = limit or config.RECOMMENDATION_LIMIT
+    ids = recommendation_ids(db, product_id, limit)
+    object_ids = [ObjectId(other_id) for other_id in set(ids["similar"] + ids["bought_together"]) if ObjectId.is_valid(other_id)]
+    products = {str(doc["_id"]): doc for doc in db.product.find({"_id": {"$in": object_ids}})}
+    return {
+        key: [Product.from_dict(dict(products[other_id])).to_json() for other_id in other_ids if other_id in products]
+        for key, other_ids in ids.items()
+    }
+
+
+def rebuild_co_purchases(db):
+    """Recompute every pair count and bought_together list from the orders collection. Returns the number of orders read."""
+    counts = defaultdict(lambda: defaultdict(int))
+    orders = 0
+    for order_data in db.orders.find({}, {"items.product_id": 1}).batch_size(BATCH_SIZE):
+        product_ids = _order_product_ids(item["product_id"] for item in order_data.get("items", []))
+        for product_id in product_ids:
+            for other_id in product_ids:
+                if other_id != product_id:
+                    counts[product_id][other_id] += 1
+        orders += 1
+
+    # Đơn đặt trong lúc tính lại bị ghi đè bởi số đếm ở đây; cặp không còn trong đơn nào thì bị xóa
+    rebuilt_at = datetime.utcnow()
+    _bulk_write(db.product_co_purchases, [
+        UpdateOne(
+            {"_id": f"{product_id}:{other_id}"},
+            {"$set": {"product_id": product_id, "other_id": other_id, "count": count, "rebuilt_at": rebuilt_at}},
+            upsert=True
+        )
+        for product_id, others in counts.items() for other_id, count in others.items()
+    ])
+    db.product_co_purchases.delete_many({"rebuilt_at": {"$ne": rebuilt_at}})
+
+    # bought_with là dạng cũ (map không giới hạn), bỏ luôn khi tính lại
+    db.product_recommendations.update_many({}, {"$unset": {"bought_together": "", "bought_with": ""}})
+    _bulk_write(db.product_recommendations, [
+        UpdateOne({"_id": product_id}, {"$set": {"bought_together": [
+            {"product_id": other_id, "count": count}
+            for other_id, count in heapq.nlargest(config.RECOMMENDATION_BOUGHT_TOGETHER, others.items(), key=lambda pair: pair[1])
+        ]}}, upsert=True)
+        for product_id, others in counts.items()
+    ])
+    return orders
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bảng gợi ý sản phẩm")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="tính lại bảng thường được mua cùng từ toàn bộ đơn hàng")
+
+    args = parser.parse_args()
+    db = MongoClient(config.MONGO_URI).get_database()
+
+    if args.command == "rebuild":
+        count = rebuild_co_purchases(db)
+        print(f"Đã tính lại bảng mua cùng từ {count} đơn hàng")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
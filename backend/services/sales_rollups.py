@@ -0,0 +1,194 @@
+"""
+Báo cáo bán hàng theo ngày và cảnh báo sắp hết hàng cho trang quản trị.
+
+Mỗi ngày (UTC) là một document trong sales_daily, được cộng dồn bằng $inc upsert
+ngay khi đơn hàng được tạo (services/checkout.py) hoặc bị hủy / hoàn tiền, nên đọc
+báo cáo N ngày chỉ đọc N document. low_stock_alerts giữ các sản phẩm có tồn kho
+<= LOW_STOCK_THRESHOLD.
+
+Tính lại toàn bộ từ orders và product:
+
+    python -m services.sales_rollups rebuild
+"""
+import argparse
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import InsertOne, MongoClient
+import config
+from models.order import Order
+
+logger = logging.getLogger(__name__)
+
+# Đơn ở các trạng thái này không được tính vào doanh thu
+REVERSED_STATUSES = {Order.STATUS_CANCELLED, Order.STATUS_REFUNDED}
+
+
+def day_key(moment):
+    return moment.strftime("%Y-%m-%d")
+
+
+def _order_increments(order, category_ids, sign, status_change=False):
+    """
+    The $inc document that adds (sign=1) or removes (sign=-1) order from its day. With
+    status_change the order is being cancelled/refunded (sign=-1) or moved back out of
+    that status (sign=1), which also moves reversed_orders by one the other way.
+    """
+    increments = defaultdict(int)
+    increments["orders"] += sign
+    increments["revenue_vnd"] += sign * int(order.total_amount or 0)
+    for item in order.items:
+        revenue_vnd = int(round((item.price or 0) * item.quantity))
+        increments["units"] += sign * item.quantity
+        increments[f"products.{item.product_id}.units"] += sign * item.quantity
+        increments[f"products.{item.product_id}.revenue_vnd"] += sign * revenue_vnd
+        category_id = category_ids.get(item.product_id)
+        if category_id:
+            increments[f"categories.{category_id}.units"] += sign * item.quantity
+            increments[f"categories.{category_id}.revenue_vnd"] += sign * revenue_vnd
+    if status_change:
+        increments["reversed_orders"] -= sign
+    return dict(increments)
+
+
+def record_order(db, order, category_ids, sign=1, session=None, status_change=False):
+    """Add order to (or, with sign=-1, remove it from) the rollup of the day it was placed."""
+    day = day_key(order.created_at)
+    db.sales_daily.update_one(
+        {"_id": day},
+        {"$inc": _order_increments(order, category_ids, sign, status_change), "$setOnInsert": {"date": day}},
+        upsert=True,
+        session=session
+    )
+
+
+def product_categories(db, product_ids, session=None):
+    object_ids = [ObjectId(product_id) for product_id in product_ids if ObjectId.is_valid(product_id)]
+    return {
+        str(doc["_id"]): doc.get("category_id")
+        for doc in db.product.find({"_id": {"$in": object_ids}}, {"category_id": 1}, session=session)
+    }
+
+
+def reversal_sign(previous_status, status):
+    """-1 when an order moves into a reversed status, 1 when it moves back out, otherwise 0."""
+    was_reversed = previous_status in REVERSED_STATUSES
+    is_reversed = status in REVERSED_STATUSES
+    if was_reversed == is_reversed:
+        return 0
+    return -1 if is_reversed else 1
+
+
+def record_status_change(db, order, status):
+    """
+    Keep the rollups in step with order (still carrying its previous status) moving to
+    status: entering a reversed status (cancelled, refunded) removes the order from its
+    day, leaving one adds it back.
+    """
+    sign = reversal_sign(order.status, status)
+    if sign:
+        category_ids = product_categories(db, [item.product_id for item in order.items])
+        record_order(db, order, category_ids, sign=sign, status_change=True)
+
+
+def refresh_low_stock(db, product_ids, session=None):
+    """Raise or clear low-stock alerts for product_ids after their stock changed."""
+    object_ids = [ObjectId(product_id) for product_id in product_ids if ObjectId.is_valid(product_id)]
+    if not object_ids:
+        return
+    low, now = [], datetime.utcnow()
+    for doc in db.product.find(
+        {"_id": {"$in": object_ids}, "stock_count": {"$lte": config.LOW_STOCK_THRESHOLD}},
+        {"title": 1, "stock_count": 1, "category_id": 1}, session=session
+    ):
+        low.append(doc["_id"])
+        db.low_stock_alerts.update_one(
+            {"_id": str(doc["_id"])},
+            {"$set": {"title": doc.get("title"), "stock_count": doc.get("stock_count", 0),
+                      "category_id": doc.get("category_id"), "updated_at": now},
+             "$setOnInsert": {"raised_at": now}},
+            upsert=True,
+            session=session
+        )
+    cleared = [str(object_id) for object_id in object_ids if object_id not in low]
+    if cleared:
+        db.low_stock_alerts.delete_many({"_id": {"$in": cleared}}, session=session)
+
+
+def daily_rollups(db, days):
+    """The last `days` rollup documents (UTC, today included), oldest first."""
+    first_day = day_key(datetime.utcnow() - timedelta(days=days - 1))
+    return list(db.sales_daily.find({"_id": {"$gte": first_day}}).sort("_id", 1))
+
+
+def top_entries(rollups, field, limit):
+    """Sum the products/categories maps of rollups; top `limit` (id, {units, revenue_vnd}) by units."""
+    totals = defaultdict(lambda: {"units": 0, "revenue_vnd": 0})
+    for rollup in rollups:
+        for key, values in rollup.get(field, {}).items():
+            totals[key]["units"] += values.get("units", 0)
+            totals[key]["revenue_vnd"] += values.get("revenue_vnd", 0)
+    ranked = sorted(
+        ((key, values) for key, values in totals.items() if values["units"] > 0),
+        key=lambda entry: (-entry[1]["units"], -entry[1]["revenue_vnd"])
+    )
+    return ranked[:limit]
+
+
+def rebuild(db, batch_size=500):
+    """Recompute sales_daily and low_stock_alerts from orders and products. Returns the number of orders counted."""
+    category_ids = {str(doc["_id"]): doc.get("category_id") for doc in db.product.find({}, {"category_id": 1})}
+    days = defaultdict(lambda: defaultdict(int))
+    counted = 0
+    for order_data in db.orders.find({}, {"user_id": 0, "shipping_address": 0}).batch_size(batch_size):
+        order = Order.from_dict(order_data)
+        day = days[day_key(order.created_at)]
+        if order.status in REVERSED_STATUSES:
+            # Luồng thời gian thực cộng đơn rồi trừ lại khi hủy, chỉ còn lại reversed_orders
+            day["reversed_orders"] += 1
+            continue
+        for field, value in _order_increments(order, category_ids, 1).items():
+            day[field] += value
+        counted += 1
+
+    db.sales_daily.delete_many({})
+    operations = []
+    for day, increments in days.items():
+        document = {"_id": day, "date": day, "products": {}, "categories": {}}
+        for field, value in increments.items():
+            target = document
+            *path, leaf = field.split(".")
+            for part in path:
+                target = target.setdefault(part, {})
+            target[leaf] = value
+        operations.append(InsertOne(document))
+        if len(operations) >= batch_size:
+            db.sales_daily.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        db.sales_daily.bulk_write(operations, ordered=False)
+
+    db.low_stock_alerts.delete_many({})
+    refresh_low_stock(db, [str(product_id) for product_id in db.product.distinct(
+        "_id", {"stock_count": {"$lte": config.LOW_STOCK_THRESHOLD}}
+    )])
+    return counted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Báo cáo bán hàng theo ngày")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="tính lại sales_daily và low_stock_alerts từ đầu")
+
+    args = parser.parse_args()
+    db = MongoClient(config.MONGO_URI).get_database()
+
+    if args.command == "rebuild":
+        count = rebuild(db)
+        print(f"Đã tính lại báo cáo từ {count} đơn hàng")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
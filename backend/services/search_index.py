@@ -0,0 +1,216 @@
+import bisect
+import logging
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+import config
+from services.catalog_version import catalog_version
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Trọng số theo trường: khớp ở tiêu đề quan trọng hơn ở mô tả
+FIELD_WEIGHTS = (("title", 3), ("features", 2), ("description", 1))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def normalize(text):
+    """Lowercase and fold Vietnamese diacritics: 'Điện Thoại' -> 'dien thoai'."""
+    text = str(text or "").lower().replace("đ", "d")
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(normalize(text))
+
+
+class SearchIndex:
+    """
+    In-process inverted index over product title, features and description.
+
+    Text is diacritic-folded before tokenizing so "dien thoai" matches "điện thoại".
+    Results are ranked with BM25 (field-weighted term frequencies), preferring products
+    that match more of the query terms; the last query term also matches as a prefix
+    so results follow the user while typing. Like the home snapshot, the index follows
+    `catalog_version`: bumps with category ids reindex only those categories, anything
+    else triggers a full rebuild on the next query.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._postings = {}
+        self._doc_terms = {}
+        self._doc_category = {}
+        self._doc_len = {}
+        self._total_len = 0
+        self._vocabulary = []
+        self._version = None
+        self._dirty = set()
+        self._full_rebuild = True
+
+    def on_catalog_change(self, version, category_ids):
+        with self._lock:
+            if category_ids is None:
+                self._full_rebuild = True
+            else:
+                self._dirty.update(category_ids)
+
+    def ensure_fresh(self, db):
+        version = catalog_version.current(db)
+        with self._lock:
+            if self._version == version:
+                return version
+
+        with self._build_lock:
+            with self._lock:
+                if self._version == version:
+                    return version
+                full_rebuild, dirty = self._full_rebuild, set(self._dirty)
+                self._full_rebuild, self._dirty = False, set()
+
+            try:
+                if full_rebuild:
+                    self._rebuild(db, version)
+                else:
+                    self._reindex_categories(db, version, dirty)
+            except Exception:
+                with self._lock:
+                    self._full_rebuild = self._full_rebuild or full_rebuild
+                    self._dirty.update(dirty)
+                raise
+        return version
+
+    def search(self, db, query, limit=None):
+        """Return [(product_id, score)] best first, at most limit (capped at SEARCH_MAX_RESULTS)."""
+        limit = min(limit or config.SEARCH_MAX_RESULTS, config.SEARCH_MAX_RESULTS)
+        terms = tokenize(query)
+        if not terms:
+            return []
+        self.ensure_fresh(db)
+
+        with self._lock:
+            doc_count = len(self._doc_len)
+            if not doc_count:
+                return []
+            avg_len = self._total_len / doc_count
+
+            # Mỗi phần tử là nhóm từ có thể khớp cho một từ trong truy vấn
+            term_groups = [[term] for term in dict.fromkeys(terms[:-1])]
+            term_groups.append(self._expand_prefix(terms[-1]))
+
+            scores = {}
+            matched = Counter()
+            for group in term_groups:
+                group_hits = set()
+                for term in group:
+                    postings = self._postings.get(term)
+                    if not postings:
+                        continue
+                    idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    # Từ khớp theo tiền tố được tính nhẹ hơn từ khớp nguyên vẹn
+                    weight = 1.0 if term == group[0] else 0.5
+                    for product_id, tf in postings.items():
+                        norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self._doc_len[product_id] / avg_len)
+                        scores[product_id] = scores.get(product_id, 0.0) + weight * idf * tf * (BM25_K1 + 1) / norm
+                        group_hits.add(product_id)
+                for product_id in group_hits:
+                    matched[product_id] += 1
+
+        ranked = sorted(scores, key=lambda product_id: (matched[product_id], scores[product_id]), reverse=True)
+        return [(product_id, scores[product_id]) for product_id in ranked[:limit]]
+
+    def vocabulary(self, db):
+        """Sorted list of every indexed term."""
+        self.ensure_fresh(db)
+        with self._lock:
+            return self._vocabulary
+
+    def _expand_prefix(self, prefix):
+        terms = [prefix]
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        for term in self._vocabulary[start:start + config.SEARCH_PREFIX_EXPANSIONS + 1]:
+            if not term.startswith(prefix):
+                break
+            if term != prefix:
+                terms.append(term)
+        return terms
+
+    def _rebuild(self, db, version):
+        postings, doc_terms, doc_category, doc_len = {}, {}, {}, {}
+        for product_data in db.product.find({}, self._projection()):
+            product_id = str(product_data["_id"])
+            terms = self._weighted_terms(product_data)
+            doc_terms[product_id] = terms
+            doc_category[product_id] = product_data.get("category_id")
+            doc_len[product_id] = sum(terms.values())
+            for term, tf in terms.items():
+                postings.setdefault(term, {})[product_id] = tf
+
+        with self._lock:
+            self._postings = postings
+            self._doc_terms = doc_terms
+            self._doc_category = doc_category
+            self._doc_len = doc_len
+            self._total_len = sum(doc_len.values())
+            self._vocabulary = sorted(postings)
+            self._version = version
+        logger.info(f"Search index rebuilt at catalog version {version} ({len(doc_len)} products, {len(postings)} terms)")
+
+    def _reindex_categories(self, db, version, category_ids):
+        fresh = list(db.product.find({"category_id": {"$in": list(category_ids)}}, self._projection()))
+
+        with self._lock:
+            stale = [product_id for product_id, category_id in self._doc_category.items() if category_id in category_ids]
+            for product_id in stale:
+                self._remove(product_id)
+            for product_data in fresh:
+                product_id = str(product_data["_id"])
+                self._remove(product_id)
+                terms = self._weighted_terms(product_data)
+                self._doc_terms[product_id] = terms
+                self._doc_category[product_id] = product_data.get("category_id")
+                self._doc_len[product_id] = sum(terms.values())
+                self._total_len += self._doc_len[product_id]
+                for term, tf in terms.items():
+                    self._postings.setdefault(term, {})[product_id] = tf
+            self._vocabulary = sorted(self._postings)
+            self._version = version
+
+    def _remove(self, product_id):
+        terms = self._doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(product_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._doc_category.pop(product_id, None)
+        self._total_len -= self._doc_len.pop(product_id, 0)
+
+    @staticmethod
+    def _projection():
+        return {field: 1 for field, _ in FIELD_WEIGHTS} | {"category_id": 1}
+
+    @staticmethod
+    def _weighted_terms(product_data):
+        terms = Counter()
+        for field, weight in FIELD_WEIGHTS:
+            value = product_data.get(field)
+            if isinstance(value, list):
+                value = " ".join(str(item) for item in value)
+            for term in tokenize(value):
+                terms[term] += weight
+        return terms
+
+
+search_index = SearchIndex()
+catalog_version.subscribe(search_index.on_catalog_change)
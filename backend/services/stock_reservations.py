@@ -0,0 +1,256 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+import config
+from services.catalog_version import stock_version
+
+logger = logging.getLogger(__name__)
+
+
+def holder_key(user_id=None, session_id=None):
+    """Owner of a cart's holds: the user, or the anonymous session."""
+    if user_id:
+        return f"user:{user_id}"
+    if session_id:
+        return f"session:{session_id}"
+    return None
+
+
+def _reserved_count_filter(reserved):
+    """Match a reserved_count read as `reserved` (a missing field reads as 0)."""
+    return {"$in": [0, None]} if reserved == 0 else reserved
+
+
+class StockReservations:
+    """
+    Time-limited stock holds for cart items.
+
+    Each product keeps a `reserved_count` next to `stock_count`; a hold takes units
+    with one conditional `$inc` (`reserved_count + qty <= stock_count`), so the
+    availability check reads that single product document instead of scanning carts.
+    Every held (holder, product) pair is also a `stock_holds` document with
+    `expires_at`, STOCK_HOLD_MINUTES after the item was last changed. Expired holds are
+    given back by `release_expired()`, which `HoldReaper` runs in the background;
+    checkout consumes the holds of the items it orders (services/checkout.py).
+    Every change bumps `stock_version`, so ETags of responses showing availability change.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def available(self, product_id):
+        """Units of product_id not in stock holds, or None if the product does not exist."""
+        product = self.db.product.find_one({"_id": ObjectId(product_id)}, {"stock_count": 1, "reserved_count": 1})
+        if not product:
+            return None
+        return max(0, product.get("stock_count", 0) - product.get("reserved_count", 0))
+
+    def reserve(self, holder, product_id, quantity):
+        """Hold quantity more units for holder. Returns False when not enough stock is free."""
+        product_id = str(product_id)
+        if not self._take(product_id, quantity):
+            return False
+        try:
+            self.db.stock_holds.update_one(
+                {"holder": holder, "product_id": product_id},
+                {"$inc": {"quantity": quantity}, "$set": {"expires_at": self._expires_at()}},
+                upsert=True
+            )
+        except Exception:
+            # Process chết đúng lúc này thì reserved_count bị lệch; reconcile() sửa lại sau
+            self._give_back(product_id, quantity)
+            raise
+        return True
+
+    def set_quantity(self, holder, product_id, quantity):
+        """
+        Make holder's hold on product_id exactly quantity (0 releases it). Returns False when
+        the extra units are not available. Items without a hold (e.g. one that expired) are
+        reserved in full.
+        """
+        product_id = str(product_id)
+        hold_filter = {"holder": holder, "product_id": product_id}
+        # Hold được cập nhật có điều kiện theo số lượng vừa đọc; nếu request khác chen vào thì trả lại và thử lại
+        for _ in range(3):
+            hold = self.db.stock_holds.find_one(hold_filter, {"quantity": 1})
+            held = hold["quantity"] if hold else 0
+            delta = quantity - held
+            if delta > 0 and not self._take(product_id, delta):
+                return False
+            if delta < 0:
+                self._give_back(product_id, -delta)
+
+            if quantity == 0:
+                changed = hold is None or self.db.stock_holds.delete_one({**hold_filter, "quantity": held}).deleted_count == 1
+            elif hold:
+                changed = self.db.stock_holds.update_one(
+                    {**hold_filter, "quantity": held},
+                    {"$set": {"quantity": quantity, "expires_at": self._expires_at()}}
+                ).matched_count == 1
+            else:
+                try:
+                    self.db.stock_holds.insert_one({**hold_filter, "quantity": quantity, "expires_at": self._expires_at()})
+                    changed = True
+                except DuplicateKeyError:
+                    changed = False
+            if changed:
+                return True
+
+            if delta > 0:
+                self._give_back(product_id, delta)
+            elif delta < 0:
+                self._inc_reserved(product_id, -delta)
+        return False
+
+    def release(self, holder, product_id, quantity=None):
+        """Give back holder's hold on product_id, or only quantity units of it."""
+        product_id = str(product_id)
+        hold_filter = {"holder": holder, "product_id": product_id}
+        if quantity is not None:
+            hold = self.db.stock_holds.find_one_and_update(
+                {**hold_filter, "quantity": {"$gt": quantity}}, {"$inc": {"quantity": -quantity}}
+            )
+            if hold:
+                self._give_back(product_id, quantity)
+                return
+        hold = self.db.stock_holds.find_one_and_delete(hold_filter)
+        if hold:
+            self._give_back(product_id, hold["quantity"])
+
+    def release_all(self, holder):
+        while True:
+            hold = self.db.stock_holds.find_one_and_delete({"holder": holder})
+            if not hold:
+                return
+            self._give_back(hold["product_id"], hold["quantity"])
+
+    def transfer(self, from_holder, to_holder):
+        """Move every hold of from_holder to to_holder (anonymous cart merged at login)."""
+        while True:
+            hold = self.db.stock_holds.find_one_and_delete({"holder": from_holder})
+            if not hold:
+                return
+            self.db.stock_holds.update_one(
+                {"holder": to_holder, "product_id": hold["product_id"]},
+                {"$inc": {"quantity": hold["quantity"]}, "$set": {"expires_at": self._expires_at()}},
+                upsert=True
+            )
+
+    def release_expired(self, limit=None):
+        """Give back holds past expires_at. Returns the number released."""
+        now = datetime.utcnow()
+        released = 0
+        for hold in self.db.stock_holds.find({"expires_at": {"$lte": now}}, {"_id": 1}).limit(limit or config.STOCK_HOLD_REAP_BATCH):
+            # Xóa có điều kiện để hold vừa được gia hạn, đã bị checkout tiêu thụ hoặc đã được
+            # tiến trình khác thu hồi không bị trả lại hai lần
+            expired = self.db.stock_holds.find_one_and_delete({"_id": hold["_id"], "expires_at": {"$lte": now}})
+            if expired:
+                self._give_back(expired["product_id"], expired["quantity"])
+                released += 1
+        return released
+
+    def reconcile(self, previous=None):
+        """
+        Find products whose reserved_count differs from the sum of their stock_holds (a
+        crash between `_take` and the hold write leaks units). Returns {product_id:
+        (reserved_count, held)}. Only mismatches also present, with the same values, in
+        `previous` are corrected: a reserve still between its two writes looks the same
+        for an instant, so a mismatch must persist across two passes to count as a leak.
+        """
+        held = {
+            entry["_id"]: entry["quantity"]
+            for entry in self.db.stock_holds.aggregate([
+                {"$group": {"_id": "$product_id", "quantity": {"$sum": "$quantity"}}}
+            ])
+        }
+        object_ids = [ObjectId(product_id) for product_id in held if ObjectId.is_valid(product_id)]
+        mismatches = {}
+        for product in self.db.product.find(
+            {"$or": [{"reserved_count": {"$nin": [0, None]}}, {"_id": {"$in": object_ids}}]},
+            {"reserved_count": 1}
+        ):
+            product_id = str(product["_id"])
+            reserved = product.get("reserved_count") or 0
+            if reserved != held.get(product_id, 0):
+                mismatches[product_id] = (reserved, held.get(product_id, 0))
+
+        for product_id, (reserved, quantity) in mismatches.items():
+            if (previous or {}).get(product_id) != (reserved, quantity):
+                continue
+            fixed = self.db.product.update_one(
+                {"_id": ObjectId(product_id), "reserved_count": _reserved_count_filter(reserved)},
+                {"$set": {"reserved_count": quantity}}
+            ).modified_count
+            if fixed:
+                logger.warning(f"Reconciled reserved_count of product {product_id}: {reserved} -> {quantity}")
+                stock_version.bump(self.db)
+        return mismatches
+
+    def _take(self, product_id, quantity):
+        if not ObjectId.is_valid(product_id):
+            return False
+        taken = self.db.product.update_one(
+            {
+                "_id": ObjectId(product_id),
+                "$expr": {"$lte": [
+                    {"$add": [{"$ifNull": ["$reserved_count", 0]}, quantity]},
+                    {"$ifNull": ["$stock_count", 0]}
+                ]}
+            },
+            {"$inc": {"reserved_count": quantity}}
+        ).matched_count == 1
+        if taken:
+            stock_version.bump(self.db)
+        return taken
+
+    def _give_back(self, product_id, quantity):
+        self._inc_reserved(product_id, -quantity)
+
+    def _inc_reserved(self, product_id, quantity):
+        if ObjectId.is_valid(product_id):
+            self.db.product.update_one({"_id": ObjectId(product_id)}, {"$inc": {"reserved_count": quantity}})
+            stock_version.bump(self.db)
+
+    @staticmethod
+    def _expires_at():
+        return datetime.utcnow() + timedelta(minutes=config.STOCK_HOLD_MINUTES)
+
+
+class HoldReaper:
+    """
+    Background thread that releases expired stock holds every STOCK_HOLD_REAP_INTERVAL_SECONDS
+    and reconciles reserved_count with stock_holds every STOCK_RECONCILE_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, db, interval_seconds=None):
+        self.reservations = StockReservations(db)
+        self.interval = interval_seconds or config.STOCK_HOLD_REAP_INTERVAL_SECONDS
+        self._mismatches = {}
+        self._reconciled_at = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stock-hold-reaper", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                # Thu hồi theo lô cho tới khi hết hold quá hạn
+                while self.reservations.release_expired() >= config.STOCK_HOLD_REAP_BATCH:
+                    pass
+            except Exception as e:
+                logger.error(f"Releasing expired stock holds failed: {e}")
+
+            if time.monotonic() - self._reconciled_at >= config.STOCK_RECONCILE_INTERVAL_SECONDS:
+                self._reconciled_at = time.monotonic()
+                try:
+                    self._mismatches = self.reservations.reconcile(self._mismatches)
+                except Exception as e:
+                    logger.error(f"Reconciling reserved stock failed: {e}")
+
+    def close(self):
+        self._stop.set()
@@ -0,0 +1,206 @@
+"""
+Gợi ý tìm kiếm (typeahead) từ một mảng tiền tố đã sắp xếp trong bộ nhớ.
+
+    python -m services.suggest_index --backfill-sales   # tính lại product.sales_count từ orders
+"""
+import argparse
+import bisect
+import heapq
+import logging
+import threading
+import time
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
+import config
+from services.catalog_version import catalog_version
+from models.product import parse_brand
+from services.search_index import normalize, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Chỉ đánh chỉ mục hậu tố bắt đầu từ vài từ đầu của tiêu đề
+MAX_TITLE_OFFSETS = 6
+
+
+class SuggestIndex:
+    """
+    Completions for the search box.
+
+    Every product title is indexed under the normalized suffixes starting at each of
+    its first words ("samsung gal" completes "Điện thoại Samsung Galaxy ..."), and every
+    brand under its own name. Keys live in one sorted list, so a prefix lookup is a
+    bisect plus a scan of the matching range; results are weighted by `sales_count`.
+    Orders placed by this process add to the weights in memory (`record_sales`), and
+    are replayed onto a structure being rebuilt so the swap does not drop them. The
+    structure is rebuilt in a background thread when the catalog version changes, and
+    every SUGGEST_REFRESH_SECONDS to pick up sales made by other processes, while
+    queries keep using the current one; only the very first query waits for a build.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._keys = []
+        self._entries = []
+        self._suggestions = []
+        self._positions = {}
+        self._memo = {}
+        self._version = None
+        self._built_at = 0
+        self._building = False
+        self._pending_sales = None
+
+    def suggest(self, db, prefix, limit=None):
+        limit = min(limit or config.SUGGEST_MAX_RESULTS, config.SUGGEST_MAX_RESULTS)
+        prefix = " ".join(tokenize(prefix)) + (" " if prefix[-1:].isspace() else "")
+        if not prefix.strip():
+            return []
+        self._ensure_fresh(db)
+
+        with self._lock:
+            cached = self._memo.get(prefix)
+            if cached is not None and len(cached) >= limit:
+                return cached[:limit]
+
+            start = bisect.bisect_left(self._keys, prefix)
+            end = bisect.bisect_left(self._keys, prefix + "\uffff")
+            best = {}
+            for position in range(start, end):
+                index = self._entries[position]
+                best[index] = self._suggestions[index]["weight"]
+            top = heapq.nlargest(limit, best, key=best.get)
+            results = [self._suggestions[index] for index in top]
+            if len(self._memo) < config.SUGGEST_MEMO_SIZE:
+                self._memo[prefix] = results
+        return results
+
+    def record_sales(self, quantities):
+        """Add {product_id: units sold} to the product and brand weights."""
+        with self._lock:
+            self._add_sales(self._suggestions, self._positions, quantities)
+            if self._pending_sales is not None:
+                # Đang dựng lại: index mới có thể đã đọc sales_count trước đơn này, giữ lại để cộng vào trước khi thay
+                self._pending_sales.append(quantities)
+            self._memo = {}
+
+    @staticmethod
+    def _add_sales(suggestions, positions, quantities):
+        for product_id, quantity in quantities.items():
+            for index in positions.get(product_id, ()):
+                suggestions[index]["weight"] += quantity
+
+    def _ensure_fresh(self, db):
+        version = catalog_version.current(db)
+        with self._lock:
+            if self._version == version and time.monotonic() - self._built_at < config.SUGGEST_REFRESH_SECONDS:
+                return
+            if self._version is not None:
+                if not self._building:
+                    self._building = True
+                    threading.Thread(target=self._rebuild_in_background, args=(db, version), daemon=True).start()
+                return
+        with self._build_lock:
+            with self._lock:
+                if self._version is not None:
+                    return
+            self._rebuild(db, version)
+
+    def _rebuild_in_background(self, db, version):
+        try:
+            with self._build_lock:
+                self._rebuild(db, version)
+        except Exception as e:
+            logger.error(f"Suggest index rebuild failed: {e}")
+        finally:
+            with self._lock:
+                self._building = False
+
+    def _rebuild(self, db, version):
+        with self._lock:
+            self._pending_sales = []
+        try:
+            self._build(db, version)
+        finally:
+            with self._lock:
+                self._pending_sales = None
+
+    def _build(self, db, version):
+        suggestions = []
+        pairs = []
+        brands = {}
+        positions = {}
+        for product_data in db.product.find({}, {"title": 1, "features": 1, "sales_count": 1}):
+            title = product_data.get("title") or ""
+            words = tokenize(title)
+            if not words:
+                continue
+            weight = product_data.get("sales_count", 0)
+            index = len(suggestions)
+            suggestions.append({
+                "text": title, "type": "product", "product_id": str(product_data["_id"]), "weight": weight
+            })
+            positions[str(product_data["_id"])] = [index]
+            for offset in range(min(len(words), MAX_TITLE_OFFSETS)):
+                pairs.append((" ".join(words[offset:]), index))
+
+            brand = parse_brand(product_data.get("features"))
+            if brand:
+                brand_key = normalize(brand)
+                name, brand_weight, product_ids = brands.get(brand_key, (brand, 0, []))
+                product_ids.append(str(product_data["_id"]))
+                brands[brand_key] = (name, brand_weight + weight, product_ids)
+
+        for brand_key, (name, weight, product_ids) in brands.items():
+            # Thương hiệu đứng trên sản phẩm khi cùng lượng bán
+            pairs.append((" ".join(tokenize(brand_key)), len(suggestions)))
+            for product_id in product_ids:
+                positions[product_id].append(len(suggestions))
+            suggestions.append({"text": name, "type": "brand", "weight": weight + 1})
+
+        pairs.sort()
+        with self._lock:
+            for quantities in self._pending_sales:
+                self._add_sales(suggestions, positions, quantities)
+            self._keys = [key for key, _ in pairs]
+            self._entries = [index for _, index in pairs]
+            self._suggestions = suggestions
+            self._positions = positions
+            self._memo = {}
+            self._version = version
+            self._built_at = time.monotonic()
+        logger.info(f"Suggest index rebuilt at catalog version {version} ({len(pairs)} keys)")
+
+
+def backfill_sales_counts(db):
+    """Recompute product.sales_count from every order. Returns the number of products updated."""
+    totals = db.orders.aggregate([
+        {"$unwind": "$items"},
+        {"$group": {"_id": "$items.product_id", "quantity": {"$sum": "$items.quantity"}}}
+    ])
+    operations = [
+        UpdateOne({"_id": ObjectId(total["_id"])}, {"$set": {"sales_count": total["quantity"]}})
+        for total in totals if ObjectId.is_valid(total["_id"])
+    ]
+    if not operations:
+        return 0
+    result = db.product.bulk_write(operations, ordered=False)
+    catalog_version.bump(db)
+    return result.modified_count
+
+
+suggest_index = SuggestIndex()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chỉ mục gợi ý tìm kiếm")
+    parser.add_argument("--backfill-sales", action="store_true", help="tính lại sales_count từ các đơn hàng")
+    args = parser.parse_args()
+
+    db = MongoClient(config.MONGO_URI).get_database()
+    if args.backfill_sales:
+        print(f"Đã cập nhật sales_count cho {backfill_sales_counts(db)} sản phẩm")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,118 @@
+"""
+Kiểm thử checkout có điều kiện trong transaction, cần một replica set MongoDB cục bộ:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+    mongosh --eval "rs.initiate()"
+    TEST_MONGO_URI="mongodb://localhost:27017/?replicaSet=rs0" python -m unittest discover tests
+
+Không kết nối được hoặc server không phải replica set thì các test bị bỏ qua.
+"""
+import os
+import threading
+import unittest
+import uuid
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from models.cart import Cart, CartItem
+from services.checkout import CheckoutError, CheckoutService, supports_transactions
+
+TEST_MONGO_URI = os.getenv("TEST_MONGO_URI", "mongodb://localhost:27017/?replicaSet=rs0")
+
+
+def _replica_set_client():
+    client = MongoClient(TEST_MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        client.close()
+        return None
+    if not supports_transactions(client):
+        client.close()
+        return None
+    return client
+
+
+class CheckoutTransactionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = _replica_set_client()
+        if cls.client is None:
+            raise unittest.SkipTest(f"No MongoDB replica set at {TEST_MONGO_URI}")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.close()
+
+    def setUp(self):
+        self.db = self.client[f"checkout_test_{uuid.uuid4().hex[:8]}"]
+        # Collection phải tồn tại trước khi ghi trong transaction trên server cũ
+        for name in ("product", "carts", "orders", "stock_holds"):
+            self.db.create_collection(name)
+        self.checkout = CheckoutService(self.client, self.db)
+
+    def tearDown(self):
+        self.client.drop_database(self.db.name)
+
+    def _product(self, stock_count, reserved_count=0, title="Sản phẩm"):
+        return str(self.db.product.insert_one({
+            "title": title, "price": "100.000", "price_vnd": 100000, "stock_count": stock_count,
+            "reserved_count": reserved_count, "sales_count": 0, "category_id": None,
+        }).inserted_id)
+
+    def _cart(self, user_id, quantities):
+        cart = Cart(id=ObjectId(), user_id=user_id, items=[
+            CartItem(product_id, quantity, "100.000", "Sản phẩm") for product_id, quantity in quantities.items()
+        ])
+        self.db.carts.insert_one(cart.to_dict())
+        return cart
+
+    def _stock(self, product_id):
+        return self.db.product.find_one({"_id": ObjectId(product_id)}, {"stock_count": 1, "sales_count": 1})
+
+    def test_concurrent_checkouts_take_the_last_unit_once(self):
+        product_id = self._product(stock_count=1)
+        carts = [self._cart(f"user-{index}", {product_id: 1}) for index in range(2)]
+        barrier = threading.Barrier(len(carts))
+        results = []
+
+        def place(cart):
+            barrier.wait()
+            try:
+                results.append(self.checkout.place_order(cart, cart.user_id, {"address": "x"}, "cod"))
+            except CheckoutError as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=place, args=(cart,)) for cart in carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sum(not isinstance(result, CheckoutError) for result in results), 1)
+        self.assertEqual(sum(isinstance(result, CheckoutError) for result in results), 1)
+        self.assertEqual(self._stock(product_id)["stock_count"], 0)
+        self.assertEqual(self._stock(product_id)["sales_count"], 1)
+        self.assertEqual(self.db.orders.count_documents({}), 1)
+        self.assertEqual(self.db.carts.count_documents({}), 1)
+
+    def test_insufficient_item_rolls_back_the_whole_order(self):
+        enough = self._product(stock_count=5, title="Còn hàng")
+        # stock_count đủ khi định giá, nhưng 2 đơn vị đang được giỏ khác giữ nên lệnh trừ kho có điều kiện thất bại
+        short = self._product(stock_count=3, reserved_count=2, title="Thiếu hàng")
+        cart = self._cart("user-1", {enough: 2, short: 3})
+
+        with self.assertRaises(CheckoutError) as raised:
+            self.checkout.place_order(cart, cart.user_id, {"address": "x"}, "cod")
+
+        self.assertIn("Thiếu hàng", raised.exception.message)
+        self.assertEqual(self._stock(enough)["stock_count"], 5)
+        self.assertEqual(self._stock(enough)["sales_count"], 0)
+        self.assertEqual(self._stock(short)["stock_count"], 3)
+        self.assertEqual(self.db.orders.count_documents({}), 0)
+        self.assertEqual(self.db.carts.count_documents({"_id": ObjectId(cart.id)}), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()